@@ -0,0 +1,187 @@
+import math
+import os
+import threading
+import time
+
+# Admission control for pipeline runs. A bounded number of runs execute at once, a
+# bounded number of requests may wait for a slot, and everything beyond that is turned
+# away immediately with a Retry-After hint instead of piling up face-alignment models
+# and meshes in memory.
+
+# Rough peak memory of one run per vertex and per face of the head mesh: the float32
+# scan, trimesh's float64 copy with normals and caches, the ray-casting tree and the
+# exported buffers.
+BYTES_PER_VERTEX = 256
+BYTES_PER_FACE = 384
+
+class Overloaded(Exception):
+    """
+    Raised when a run cannot be admitted. status is the HTTP status to answer with
+    (429 when the wait queue is full, 503 when the wait timed out) and retry_after
+    the suggested delay in seconds.
+    """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class MemoryBudgetExceeded(Exception):
+    """
+    Raised before the heavy stages when a mesh is too large for the per-run memory budget.
+    """
+
+    def __init__(self, estimate, budget):
+        super().__init__(f"Estimated {estimate / 2**20:.0f} MiB for this mesh exceeds the "
+                         f"per-run budget of {budget / 2**20:.0f} MiB")
+        self.estimate = estimate
+        self.budget = budget
+
+def estimate_run_memory(n_vertices, n_faces):
+    """
+    Estimated peak memory in bytes of a pipeline run on a mesh of the given size.
+    """
+    return int(n_vertices * BYTES_PER_VERTEX + n_faces * BYTES_PER_FACE)
+
+def check_memory_budget(n_vertices, n_faces, budget):
+    """
+    Raise MemoryBudgetExceeded if a mesh of the given size does not fit in budget bytes.
+    A budget of None disables the check.
+    """
+    if budget is None:
+        return
+    estimate = estimate_run_memory(n_vertices, n_faces)
+    if estimate > budget:
+        raise MemoryBudgetExceeded(estimate, budget)
+
+def stl_face_count(stl_file_path):
+    """
+    Number of triangles of a binary STL, read from its size (84-byte header, 50 bytes per face).
+    """
+    return max(os.path.getsize(stl_file_path) - 84, 0) // 50
+
+class AdmissionController:
+    """
+    Caps concurrent pipeline runs and the queue of requests waiting for a slot.
+
+    Usage:
+        with controller.admit():
+            run_pipeline(...)
+
+    or, for a slot held until a streamed response is closed:
+        slot = controller.admit().acquire()
+        response.call_on_close(slot.release)
+    """
+
+    def __init__(self, max_concurrent=2, max_queue=8, queue_timeout=30.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        # Moving average of the run time, used for Retry-After
+        self.average_run_seconds = 30.0
+        # Set by drain(): no new runs are admitted while the process shuts down
+        self.draining = False
+        self._condition = threading.Condition()
+
+    def retry_after(self):
+        # Time until the current queue should have drained, in whole seconds
+        batches = (self.running + self.waiting) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(batches * self.average_run_seconds))
+
+    def check_capacity(self):
+        """
+        Cheap early check, before the upload is read: raise Overloaded if a new request
+        could neither run nor wait.
+        """
+        with self._condition:
+            if self.draining:
+                raise Overloaded("Server shutting down", 503, self.retry_after())
+            if self.running >= self.max_concurrent and self.waiting >= self.max_queue:
+                raise Overloaded("Server busy, wait queue is full", 429, self.retry_after())
+
+    def acquire(self):
+        with self._condition:
+            if self.draining:
+                raise Overloaded("Server shutting down", 503, self.retry_after())
+            if self.running >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    raise Overloaded("Server busy, wait queue is full", 429, self.retry_after())
+
+                self.waiting += 1
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while self.running >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if self.draining:
+                            raise Overloaded("Server shutting down", 503, self.retry_after())
+                        if remaining <= 0:
+                            raise Overloaded("Server busy, timed out waiting for a slot", 503, self.retry_after())
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            self.running += 1
+
+    def release(self, run_seconds=None):
+        with self._condition:
+            self.running -= 1
+            if run_seconds is not None:
+                self.average_run_seconds = 0.8 * self.average_run_seconds + 0.2 * run_seconds
+            self._condition.notify_all()
+
+    def drain(self, timeout=None):
+        """
+        Stop admitting runs, turn waiting requests away and wait for the running ones
+        to finish.
+
+        Returns:
+        bool: True if all runs finished, False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self.draining = True
+            self._condition.notify_all()
+            while self.running > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def admit(self):
+        return _Admission(self)
+
+    def stats(self):
+        with self._condition:
+            return {"running": self.running, "waiting": self.waiting, "draining": self.draining,
+                    "max_concurrent": self.max_concurrent, "max_queue": self.max_queue}
+
+class _Admission:
+    # One run slot, held as a context manager, or from acquire() until release() when it
+    # must outlive the request handler (a streamed response)
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.start = None
+
+    def acquire(self):
+        self.controller.acquire()
+        self.start = time.monotonic()
+        return self
+
+    def release(self):
+        # Only the first call frees the slot, so release can be called from more than one place
+        if self.start is not None:
+            start, self.start = self.start, None
+            self.controller.release(time.monotonic() - start)
+
+    def __enter__(self):
+        if self.start is None:
+            self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
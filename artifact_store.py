@@ -0,0 +1,96 @@
+import hashlib
+import os
+import tempfile
+import threading
+from cache_utils import touch, evict_to_budget
+
+# Uploaded scans and photos, stored under the SHA-256 of their contents:
+#   <root>/<sha256>.glb     the scan
+#   <root>/<sha256>.stl     its STL conversion, written once beside it by convert_glb_to_stl
+#   <root>/<sha256>.png     the photo (.jpg for JPEG)
+# Identical uploads are stored once, and names never collide between requests, server
+# restarts or worker processes. Each upload is streamed to a hidden file while it is
+# hashed and renamed into place, so readers never see half a file. After every put,
+# files older than the TTL are removed, then the least recently used ones until the
+# store fits its disk budget. Files used within the last min_age_seconds are never
+# evicted, since a queued or running pipeline may still read them.
+
+ARTIFACT_DIR = "cache/artifacts"
+DEFAULT_MAX_BYTES = 2 * 2**30
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MIN_AGE_SECONDS = 15 * 60
+
+class ArtifactStore:
+    """
+    Content-addressed files with a disk budget and TTL/LRU eviction.
+
+    Parameters:
+    root (str): Directory of the store
+    max_bytes (int): Disk budget, None for no limit
+    ttl_seconds (float): Files not used for this long are removed, None to keep them
+    min_age_seconds (float): Files used more recently than this are never evicted
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 min_age_seconds=DEFAULT_MIN_AGE_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.min_age_seconds = min_age_seconds
+        self._lock = threading.Lock()
+
+    def put_stream(self, stream, suffix, chunk_size=1 << 20):
+        """
+        Store the contents of a binary stream, read to its end.
+
+        Parameters:
+        stream: File-like object, e.g. a werkzeug upload's stream
+        suffix (str): File extension including the dot, e.g. ".glb"
+
+        Returns:
+        str: Path of the stored file
+        """
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(prefix=".", dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(chunk_size), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            path = os.path.join(self.root, digest.hexdigest() + suffix)
+            if os.path.exists(path):
+                # Already stored: keep the existing file and mark it as used
+                os.remove(tmp_path)
+                touch(path)
+            else:
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Apply the TTL and the disk budget.
+
+        Returns:
+        list: Paths of the removed files
+        """
+        with self._lock:
+            removed = evict_to_budget(self.root, self.max_bytes, self.ttl_seconds, self.min_age_seconds)
+        if removed:
+            print(f"Artifact store: evicted {len(removed)} files")
+        return removed
+
+    def usage(self):
+        """
+        Number of files and their total size in bytes.
+        """
+        if not os.path.isdir(self.root):
+            return 0, 0
+        sizes = [entry.stat().st_size for entry in os.scandir(self.root)
+                 if entry.is_file() and not entry.name.startswith('.')]
+        return len(sizes), sum(sizes)
@@ -0,0 +1,189 @@
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from cache_utils import file_sha256
+
+# Batch reprocessing of an archive of scans. GLB/image pairs found in two directories are
+# run through the pipeline on a pool of worker processes. Every item's status, stage
+# timings and output files are recorded in a JSON manifest that is rewritten after each
+# item, so a rerun after a crash or interruption skips the items already done (as long as
+# their inputs and outputs are unchanged).
+#
+# Example:
+#   python batch.py --glb-dir input_gltf --image-dir input_png -o batch_output --workers 4
+
+DEFAULT_OUTPUT_DIR = "batch_output"
+MANIFEST_NAME = "manifest.json"
+
+def find_input_pairs(glb_dir="input_gltf", image_dir="input_png"):
+    """
+    Pair the GLB scans with the photos of the same name (request_3.glb with request_3.png).
+    Falls back to pairing them in sorted order when no names match.
+
+    Returns:
+    list: (glb path, image path) pairs
+    """
+    images = {}
+    for pattern in ("*.png", "*.jpg", "*.jpeg"):
+        for path in glob.glob(os.path.join(image_dir, pattern)):
+            images[os.path.splitext(os.path.basename(path))[0]] = path
+    scans = sorted(glob.glob(os.path.join(glb_dir, "*.glb")))
+
+    pairs = [(scan, images[os.path.splitext(os.path.basename(scan))[0]]) for scan in scans
+             if os.path.splitext(os.path.basename(scan))[0] in images]
+    if not pairs:
+        pairs = list(zip(scans, sorted(images.values())))
+    return pairs
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"items": {}}
+
+def save_manifest(manifest, manifest_path):
+    # Write to a hidden file and rename it into place, so a crash never leaves half a manifest
+    directory = os.path.dirname(manifest_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".", dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def item_inputs(glb_path, image_path):
+    return {"glb": glb_path, "image": image_path,
+            "glb_sha256": file_sha256(glb_path), "image_sha256": file_sha256(image_path)}
+
+def is_finished(record, inputs):
+    """
+    Whether a manifest record is a completed run of these inputs whose outputs still exist.
+    """
+    if record is None or record.get("status") != "done":
+        return False
+    if record.get("inputs", {}).get("glb_sha256") != inputs["glb_sha256"] or \
+            record.get("inputs", {}).get("image_sha256") != inputs["image_sha256"]:
+        return False
+    return all(os.path.isfile(path) for path in record.get("outputs", []))
+
+def process_item(glb_path, image_path, item_dir, montage=None, output_format="stl", electrodes_only=False):
+    """
+    Run the pipeline on one pair and write its files to item_dir. Runs in a worker process.
+
+    Returns:
+    dict: status ("done" or "failed"), stage timings, output paths, and the error if any
+    """
+    # Imported here so the parent process stays light
+    from pipeline import run_pipeline
+    from export_formats import export_entries
+    from stage_timing import StageTimings
+
+    start = time.perf_counter()
+    timings = StageTimings()
+    record = {"worker_pid": os.getpid()}
+    try:
+        result = run_pipeline(glb_path, image_path, montage=montage, write_files=False, timings=timings)
+        entries = export_entries(output_format, result["head_mesh"], result["electrode_mesh"],
+                                 result["electrode_instances"], electrodes_only=electrodes_only)
+        os.makedirs(item_dir, exist_ok=True)
+        outputs = []
+        with timings.stage("export"):
+            for name, chunks in entries:
+                path = os.path.join(item_dir, name)
+                with open(path + ".part", 'wb') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                os.replace(path + ".part", path)
+                outputs.append(path)
+        record.update(status="done", outputs=outputs)
+    except Exception as e:
+        record.update(status="failed", error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+    record["timings"] = {name: round(seconds, 3) for name, seconds in timings.as_dict().items()}
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+def run_batch(pairs, output_dir=DEFAULT_OUTPUT_DIR, manifest_path=None, workers=None, montage=None,
+              output_format="stl", electrodes_only=False, force=False):
+    """
+    Process GLB/image pairs on a process pool, recording progress in a manifest.
+
+    Parameters:
+    pairs (list): (glb path, image path) pairs, see find_input_pairs
+    output_dir (str): Each item's files go to output_dir/<scan name>/
+    manifest_path (str): Defaults to output_dir/manifest.json
+    workers (int): Worker processes, defaults to the number of cores
+    force (bool): Rerun items the manifest lists as done
+
+    Returns:
+    dict: The manifest, with one record per item name
+    """
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    items = manifest.setdefault("items", {})
+
+    pending = []
+    for glb_path, image_path in pairs:
+        name = os.path.splitext(os.path.basename(glb_path))[0]
+        inputs = item_inputs(glb_path, image_path)
+        if not force and is_finished(items.get(name), inputs):
+            continue
+        items[name] = {"status": "pending", "inputs": inputs}
+        pending.append((name, glb_path, image_path))
+    save_manifest(manifest, manifest_path)
+
+    skipped = len(pairs) - len(pending)
+    print(f"{len(pairs)} items, {skipped} already done, {len(pending)} to process")
+    if not pending:
+        return manifest
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for name, glb_path, image_path in pending:
+            future = pool.submit(process_item, glb_path, image_path, os.path.join(output_dir, name),
+                                 montage, output_format, electrodes_only)
+            futures[future] = name
+
+        for done, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                # The worker process died (out of memory, killed)
+                record = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+            items[name].update(record, finished_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            save_manifest(manifest, manifest_path)
+
+            if record["status"] != "done":
+                failed += 1
+            print(f"[{done}/{len(pending)}] {name}: {record['status']}"
+                  + (f" ({record.get('seconds', 0):.1f}s)" if record["status"] == "done" else f" - {record['error']}"))
+
+    print(f"Finished: {len(pending) - failed} done, {failed} failed, {skipped} skipped. Manifest: {manifest_path}")
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline over a directory of scans and photos")
+    parser.add_argument("--glb-dir", default="input_gltf", help="Directory of GLB scans")
+    parser.add_argument("--image-dir", default="input_png", help="Directory of face photos")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT_DIR, help="Output directory")
+    parser.add_argument("--manifest", help="Manifest path (default: <output>/manifest.json)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--montage", choices=("10-20", "10-10", "10-5"), help="Montage instead of the ring layout")
+    parser.add_argument("--format", default="stl", choices=("stl", "glb", "ply", "ply16"), help="Output format")
+    parser.add_argument("--electrodes-only", action="store_true", help="Leave the head out of the electrode file")
+    parser.add_argument("--force", action="store_true", help="Reprocess items that are already done")
+    args = parser.parse_args()
+
+    pairs = find_input_pairs(args.glb_dir, args.image_dir)
+    if not pairs:
+        parser.error(f"No GLB/image pairs found in {args.glb_dir} and {args.image_dir}")
+    run_batch(pairs, output_dir=args.output, manifest_path=args.manifest, workers=args.workers,
+              montage=args.montage, output_format=args.format, electrodes_only=args.electrodes_only,
+              force=args.force)
@@ -0,0 +1,318 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+
+# Scaling microbenchmarks of the geometric kernels on synthetic head-and-shoulders
+# meshes. Each kernel runs at every mesh size (10k to 5M vertices by default); its best
+# wall time over --repeat runs and its peak traced allocation (tracemalloc, which numpy
+# reports to) are recorded, and a least-squares fit of log(time) and log(memory) against
+# log(vertices) gives the empirical scaling exponent: about 0 for constant work, 1 for
+# linear, above 1 for anything worse. The fit uses the FIT_POINTS largest sizes, and
+# leaves out runs shorter than MIN_FIT_SECONDS, where fixed overhead dominates and a
+# kernel that merely lost some overhead would seem to scale worse.
+#
+# Results can be written as JSON (--json) and compared with those of another commit
+# (--baseline); a kernel whose time exponent grew by more than --tolerance is flagged
+# and the exit status is 1, so the comparison can gate a CI job.
+#
+# Example:
+#   python benchmark_kernels.py --json bench.json > bench_output.txt
+#   git checkout other-branch
+#   python benchmark_kernels.py --baseline bench.json
+
+DEFAULT_SIZES = (10_000, 30_000, 100_000, 300_000, 1_000_000, 3_000_000, 5_000_000)
+DEFAULT_REPEAT = 3
+# A kernel is not run at larger sizes once one run took longer than this
+DEFAULT_MAX_SECONDS = 20.0
+MIN_FIT_SECONDS = 1e-3
+FIT_POINTS = 4
+# Allowed growth of a time exponent before a kernel is flagged
+DEFAULT_TOLERANCE = 0.15
+
+# Parts of the synthetic scan: (share of the vertices, radii, center), y up, nose
+# towards +x and shoulders along z, sized like an adult in metres
+SYNTHETIC_PARTS = (
+    (0.45, (0.12, 0.12, 0.24), (0.0, -0.05, 0.0)),   # shoulders and chest
+    (0.10, (0.055, 0.09, 0.055), (0.0, 0.12, 0.0)),  # neck
+    (0.40, (0.10, 0.12, 0.08), (0.0, 0.27, 0.0)),    # head
+    (0.05, (0.03, 0.02, 0.015), (0.10, 0.25, 0.0)),  # nose
+)
+
+def _ellipsoid(n_vertices, radii, center):
+    # Closed UV ellipsoid of about n_vertices: rings of points plus the two poles
+    rows = max(3, int(math.sqrt(n_vertices / 2)))
+    cols = max(6, (n_vertices - 2) // rows)
+    theta = np.pi * (np.arange(rows) + 1) / (rows + 1)
+    phi = 2 * np.pi * np.arange(cols) / cols
+    sin_t, cos_t = np.sin(theta)[:, None], np.cos(theta)[:, None]
+    ring = np.stack([sin_t * np.cos(phi), np.broadcast_to(cos_t, (rows, cols)), sin_t * np.sin(phi)], axis=-1)
+    vertices = np.concatenate([[[0, 1, 0]], ring.reshape(-1, 3), [[0, -1, 0]]]) * radii + center
+
+    # Quads between consecutive rings, two triangles each, and a fan at each pole
+    r, c = np.meshgrid(np.arange(rows - 1), np.arange(cols), indexing='ij')
+    a = 1 + r * cols + c
+    b = 1 + r * cols + (c + 1) % cols
+    quads = np.concatenate([np.stack([a, b, a + cols], -1), np.stack([b, b + cols, a + cols], -1)]).reshape(-1, 3)
+    c = np.arange(cols)
+    south = len(vertices) - 1
+    top = np.stack([np.zeros(cols, dtype=int), 1 + (c + 1) % cols, 1 + c], -1)
+    bottom = np.stack([np.full(cols, south), 1 + (rows - 1) * cols + c, 1 + (rows - 1) * cols + (c + 1) % cols], -1)
+    return vertices, np.concatenate([top, quads, bottom])
+
+def synthetic_head(n_vertices):
+    """
+    Head-and-shoulders mesh of about n_vertices, oriented like prepare_head_mesh's output.
+
+    Returns:
+    tuple: ((n, 3) float32 vertices, (m, 3) int32 faces)
+    """
+    vertices, faces, offset = [], [], 0
+    for share, radii, center in SYNTHETIC_PARTS:
+        v, f = _ellipsoid(max(8, int(share * n_vertices)), np.array(radii), np.array(center))
+        vertices.append(v)
+        faces.append(f + offset)
+        offset += len(v)
+    return np.concatenate(vertices).astype(np.float32), np.concatenate(faces).astype(np.int32)
+
+# Kernels: name -> setup(vertices, faces) returning the callable to time. Setup work
+# (building meshes, finding inputs) is not timed, but runs again before every repeat
+# so caches on the mesh do not carry over. Imports happen here, so a kernel whose
+# module cannot be imported is reported as skipped instead of stopping the suite.
+
+def _neck(vertices, faces):
+    from reference_point_scaling import find_neck_y
+    return lambda: find_neck_y(vertices)
+
+def _shoulders(vertices, faces):
+    from reference_point_scaling import shoulder_along_z
+    return lambda: shoulder_along_z(vertices)
+
+def _orientation(vertices, faces):
+    # Sampled decisions; the synthetic neck is ambiguous, so allow any margin
+    from reference_point_scaling import orientation_profile
+    return lambda: orientation_profile(vertices, faces, min_margin=0.0)
+
+def _nose(vertices, faces):
+    from reference_point_scaling import find_neck_y, find_nose_and_back_of_head
+    neck_height = find_neck_y(vertices)
+    return lambda: find_nose_and_back_of_head(vertices, neck_height)
+
+def _align(vertices, faces):
+    from reference_point_scaling import align_points
+    points = np.array([[0.0, 0.0, 0.0], [-0.05, 0.0, -0.08], [-0.05, 0.0, 0.08], [-0.2, 0.0, 0.0]])
+    nose, back_head = np.array([0.13, 0.25, 0.0]), np.array([-0.10, 0.27, 0.0])
+    return lambda: align_points(points, nose, back_head)
+
+def _ray_mesh_intersection(vertices, faces):
+    from electrode_modelling import ray_mesh_intersection
+    from compact_mesh import CompactMesh
+    mesh = CompactMesh(vertices, faces)
+    origin, direction = np.array([0.0, 0.27, 0.0]), np.array([0.0, 1.0, 0.0])
+    return lambda: ray_mesh_intersection(mesh, origin, direction)
+
+def _electrode_points(vertices, faces):
+    from model_generation import ring_points, DEFAULT_RINGS
+    center = np.array([0.0, 0.27, 0.0])
+    return center, 0.08, ring_points(center, 0.08, DEFAULT_RINGS)
+
+def _ray_casting(vertices, faces):
+    # Cold: a new mesh, so the ray index is built as in a request
+    from model_generation import closest_ray_hits
+    from compact_mesh import CompactMesh
+    mesh = CompactMesh(vertices, faces)
+    origins = _electrode_points(vertices, faces)[2]
+    return lambda: closest_ray_hits(mesh, origins)
+
+def _electrode_transforms(vertices, faces):
+    from model_generation import electrode_instances, combine_electrode_model
+    from compact_mesh import CompactMesh
+    head_mesh = CompactMesh(vertices, faces)
+    electrode_mesh = CompactMesh(*_ellipsoid(200, np.array([0.01, 0.004, 0.01]), np.zeros(3)))
+    center, radius, points = _electrode_points(vertices, faces)
+    points = [p + [0, 0.12, 0] for p in points]
+    return lambda: combine_electrode_model(electrode_mesh, electrode_instances(points, center, radius), head_mesh)
+
+KERNELS = {
+    "find_neck_y": _neck,
+    "shoulder_along_z": _shoulders,
+    "orientation_profile": _orientation,
+    "find_nose_and_back_of_head": _nose,
+    "align_points": _align,
+    "ray_mesh_intersection": _ray_mesh_intersection,
+    "closest_ray_hits": _ray_casting,
+    "electrode_transforms": _electrode_transforms,
+}
+
+def measure(setup, vertices, faces, repeat=DEFAULT_REPEAT):
+    """
+    Best wall time over repeat runs, then the peak traced allocation of one more run.
+
+    Returns:
+    tuple: (seconds, peak bytes)
+    """
+    quiet = io.StringIO()
+    best = math.inf
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(quiet):
+            run = setup(vertices, faces)
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        quiet.seek(0)
+        quiet.truncate()
+
+    with contextlib.redirect_stdout(quiet):
+        run = setup(vertices, faces)
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+def fit_exponent(sizes, values, floor=0.0, max_points=FIT_POINTS):
+    """
+    Slope of log(value) against log(size), over the max_points largest sizes with a value
+    above floor.
+
+    Returns:
+    float or None: The exponent, None with fewer than two usable points
+    """
+    points = [(math.log(n), math.log(v)) for n, v in zip(sizes, values) if v is not None and v > floor]
+    points = sorted(points)[-max_points:]
+    if len(points) < 2 or len({x for x, _ in points}) < 2:
+        return None
+    x, y = np.array(points).T
+    return float(np.polyfit(x, y, 1)[0])
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes=DEFAULT_SIZES, kernels=None, repeat=DEFAULT_REPEAT, max_seconds=DEFAULT_MAX_SECONDS):
+    """
+    Run the kernels at every size.
+
+    Parameters:
+    sizes (sequence): Vertex counts of the synthetic meshes
+    kernels (sequence): Kernel names, default all of KERNELS
+    repeat (int): Timed runs per kernel and size, the best one counts
+    max_seconds (float): A kernel slower than this is not run at larger sizes
+
+    Returns:
+    dict: commit, sizes (actual vertex counts) and per kernel the seconds and peak_bytes
+          at each size (None where not run), the fitted time_exponent and memory_exponent,
+          and skipped (reason) if it could not run at all
+    """
+    names = list(kernels or KERNELS)
+    results = {name: {"seconds": [], "peak_bytes": []} for name in names}
+    actual_sizes = []
+    for size in sorted(sizes):
+        vertices, faces = synthetic_head(size)
+        actual_sizes.append(len(vertices))
+        print(f"{len(vertices):>9} vertices, {len(faces):>9} faces")
+        for name in names:
+            result = results[name]
+            too_slow = any(s is not None and s > max_seconds for s in result["seconds"])
+            if "skipped" in result or too_slow:
+                result["seconds"].append(None)
+                result["peak_bytes"].append(None)
+                continue
+            try:
+                seconds, peak = measure(KERNELS[name], vertices, faces, repeat)
+            except ImportError as e:
+                result["skipped"] = f"import failed: {e}"
+                print(f"  {name:<28} skipped, {result['skipped']}")
+                result["seconds"].append(None)
+                result["peak_bytes"].append(None)
+                continue
+            result["seconds"].append(seconds)
+            result["peak_bytes"].append(peak)
+            print(f"  {name:<28} {seconds * 1000:10.2f} ms {peak / 2**20:10.1f} MiB")
+
+    for result in results.values():
+        result["time_exponent"] = fit_exponent(actual_sizes, result["seconds"], MIN_FIT_SECONDS)
+        result["memory_exponent"] = fit_exponent(actual_sizes, result["peak_bytes"])
+    return {"commit": git_commit(), "sizes": actual_sizes, "kernels": results}
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Kernels whose time exponent grew by more than tolerance since the baseline run.
+
+    Returns:
+    list: (kernel, baseline exponent, current exponent) of the flagged kernels
+    """
+    flagged = []
+    for name, result in current["kernels"].items():
+        before = baseline.get("kernels", {}).get(name, {}).get("time_exponent")
+        after = result.get("time_exponent")
+        if before is not None and after is not None and after - before > tolerance:
+            flagged.append((name, before, after))
+    return flagged
+
+def print_report(report, baseline=None):
+    def exponent(value):
+        return "     -" if value is None else f"{value:6.2f}"
+
+    print(f"\nScaling exponents (commit {report['commit'] or 'unknown'}, "
+          f"{report['sizes'][0]}-{report['sizes'][-1]} vertices)")
+    header = f"{'kernel':<28} {'time':>6} {'memory':>6}"
+    if baseline is not None:
+        header += f" {'base':>6}  (baseline {baseline.get('commit') or 'unknown'})"
+    print(header)
+    for name, result in report["kernels"].items():
+        if "skipped" in result:
+            print(f"{name:<28} skipped, {result['skipped']}")
+            continue
+        line = f"{name:<28} {exponent(result['time_exponent'])} {exponent(result['memory_exponent'])}"
+        if baseline is not None:
+            line += f" {exponent(baseline.get('kernels', {}).get(name, {}).get('time_exponent'))}"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling microbenchmarks of the geometric kernels")
+    parser.add_argument("--sizes", type=lambda s: [int(float(n)) for n in s.split(",")], default=DEFAULT_SIZES,
+                        help="Comma-separated vertex counts (default: 10k to 5M)")
+    parser.add_argument("--kernels", type=lambda s: s.split(","), help=f"Comma-separated subset of {', '.join(KERNELS)}")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per kernel and size")
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS,
+                        help="Stop growing a kernel once a run takes longer than this")
+    parser.add_argument("--json", metavar="PATH", help="Write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="Results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed growth of a time exponent before a kernel is flagged")
+    args = parser.parse_args()
+
+    unknown = set(args.kernels or ()) - set(KERNELS)
+    if unknown:
+        parser.error(f"Unknown kernels: {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(args.sizes, args.kernels, args.repeat, args.max_seconds)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if baseline is not None:
+        flagged = compare(report, baseline, args.tolerance)
+        for name, before, after in flagged:
+            print(f"SCALING REGRESSION: {name} exponent {before:.2f} -> {after:.2f}")
+        if flagged:
+            raise SystemExit(1)
+        print("No scaling regressions")
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import time
+
+# Helpers shared by the on-disk caches (landmarks, parsed meshes, uploaded artifacts).
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    """
+    Hash the contents of a file without reading it into memory in one go.
+
+    Parameters:
+    file_path (str): Path to the file to hash
+    chunk_size (int): Number of bytes read per iteration
+
+    Returns:
+    str: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(*parts):
+    """
+    Combine several strings (content hash, model version, ...) into a single key
+    that is safe to use as a file name.
+    """
+    return hashlib.sha256("|".join(str(p) for p in parts).encode()).hexdigest()
+
+def touch(path):
+    # Mark an entry as recently used. The modification time is the LRU clock.
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+def evict_lru(cache_dir, max_entries):
+    """
+    Remove the least recently used entries of a cache directory until at most
+    max_entries remain. Entries are the direct children of cache_dir (files or
+    directories) and are ordered by modification time.
+
+    Returns:
+    list: Paths of the removed entries
+    """
+    if max_entries is None or not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        # Skip partially written entries, they are renamed into place once complete.
+        if name.startswith('.'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+
+    if len(entries) <= max_entries:
+        return []
+
+    entries.sort()
+    removed = []
+    for _, path in entries[:len(entries) - max_entries]:
+        try:
+            if os.path.isdir(path):
+                for child in os.listdir(path):
+                    os.remove(os.path.join(path, child))
+                os.rmdir(path)
+            else:
+                os.remove(path)
+            removed.append(path)
+        except OSError:
+            # Another process may have evicted or be reading it; try again next time.
+            continue
+    return removed
+
+def evict_to_budget(cache_dir, max_bytes, ttl_seconds=None, min_age_seconds=0):
+    """
+    Remove the files of a cache directory older than ttl_seconds, then the least
+    recently used ones until their total size is at most max_bytes. Files used within
+    the last min_age_seconds are kept even over budget, as a run may still need them.
+
+    Returns:
+    list: Paths of the removed files
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+
+    now = time.time()
+    entries = []
+    removed = []
+    for entry in os.scandir(cache_dir):
+        # Skip partially written files, they are renamed into place once complete.
+        if entry.name.startswith('.') or not entry.is_file():
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        age = now - stat.st_mtime
+        if ttl_seconds is not None and age > ttl_seconds and age > min_age_seconds:
+            try:
+                os.remove(entry.path)
+                removed.append(entry.path)
+            except OSError:
+                pass
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    if max_bytes is None or total <= max_bytes:
+        return removed
+
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= max_bytes or now - mtime <= min_age_seconds:
+            break
+        try:
+            os.remove(path)
+            removed.append(path)
+            total -= size
+        except OSError:
+            # Another process may have evicted it already; try again next time.
+            continue
+    return removed
@@ -0,0 +1,347 @@
+import numpy as np
+from result_packaging import iter_binary_stl
+
+# Lightweight triangle mesh used by the pipeline stages in place of trimesh, pyvista and
+# numpy-stl objects. Vertices are contiguous float32 and faces int32, so a mesh costs
+# 24 bytes per vertex-and-face pair instead of the float64 copies, caches and record
+# arrays the libraries keep. Arrays are used as given when they already have that
+# layout, which keeps memory-mapped meshes from the mesh cache shared between workers.
+# Normals, bounds and the ray-query index are computed on first use. Library objects
+# are only created at the edges, with to_trimesh.
+#
+# Ray queries on large meshes run in two levels: rays are cast against a coarse copy
+# of the mesh (vertex clustering on a grid of LOD_DIVISIONS cells along the longest
+# side, built once), and the fine triangles are then tested only in the cells of a
+# WALK_DIVISIONS grid along each ray, up to just past its coarse hit. Clustering moves
+# the surface by up to about a cell, so the first fine hit is usually before that
+# point; when it is not (nothing found there, or the closest hit lies beyond it), and
+# for rays the coarse level misses, the walk continues along the rest of the ray.
+# Every fine triangle crossing a walked stretch of the ray is tested, so the hits are
+# those of the single-level query.
+#
+# The neck and orientation decisions do not use this coarse copy: clustering sorts every
+# vertex, which costs more than a full cross-section profile. Their coarse level is the
+# vertex sample of reference_point_scaling.orientation_profile.
+
+# Meshes with more faces than this use the two-level ray query
+MULTIRES_MIN_FACES = 200000
+LOD_DIVISIONS = 64
+# Grid of the fine-triangle walk, finer than the coarse level so fewer triangles are tested
+WALK_DIVISIONS = 128
+# Faces overlapping more walk cells than this are tested along every ray instead of binned
+MAX_FACE_CELLS = 64
+
+class CompactMesh:
+    """
+    Triangle mesh with float32 vertices, int32 faces and lazily computed properties.
+    Treat the arrays as read-only; use transformed() for a moved copy.
+
+    Parameters:
+    vertices (array): (n, 3) positions
+    faces (array): (m, 3) vertex indices
+    face_colors (array): Optional (m, 4) uint8 RGBA colors
+    """
+
+    __slots__ = ("vertices", "faces", "face_colors", "_face_normals", "_vertex_normals", "_bounds",
+                 "_ray_indexes", "_levels", "_face_grids", "__weakref__")
+
+    def __init__(self, vertices, faces, face_colors=None):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int32).reshape(-1, 3)
+        self.face_colors = None if face_colors is None else np.asarray(face_colors, dtype=np.uint8)
+        self._face_normals = None
+        self._vertex_normals = None
+        self._bounds = None
+        self._ray_indexes = {}
+        self._levels = {}
+        self._face_grids = {}
+
+    @classmethod
+    def from_trimesh(cls, mesh):
+        face_colors = None
+        visual = getattr(mesh, "visual", None)
+        if visual is not None and getattr(visual, "kind", None) == "face":
+            face_colors = visual.face_colors
+        return cls(mesh.vertices, mesh.faces, face_colors)
+
+    def to_trimesh(self):
+        """
+        A trimesh copy (float64) for library calls that need one.
+        """
+        import trimesh
+        mesh = trimesh.Trimesh(vertices=self.vertices, faces=self.faces, process=False)
+        if self.face_colors is not None:
+            mesh.visual.face_colors = self.face_colors
+        return mesh
+
+    @property
+    def nbytes(self):
+        return self.vertices.nbytes + self.faces.nbytes
+
+    @property
+    def bounds(self):
+        # (2, 3) array of the minimum and maximum corner
+        if self._bounds is None:
+            self._bounds = np.array([self.vertices.min(axis=0), self.vertices.max(axis=0)], dtype=float)
+        return self._bounds
+
+    @property
+    def extents(self):
+        return self.bounds[1] - self.bounds[0]
+
+    @property
+    def center(self):
+        # Centre of the bounding box
+        return self.bounds.mean(axis=0)
+
+    @property
+    def face_normals(self):
+        if self._face_normals is None:
+            normals = self._face_cross()
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            self._face_normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+        return self._face_normals
+
+    @property
+    def vertex_normals(self):
+        # Area-weighted average of the normals of the faces around each vertex
+        if self._vertex_normals is None:
+            cross = self._face_cross()
+            normals = np.zeros_like(self.vertices)
+            for corner in range(3):
+                np.add.at(normals, self.faces[:, corner], cross)
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            self._vertex_normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+        return self._vertex_normals
+
+    def _face_cross(self):
+        a, b, c = (self.vertices[self.faces[:, i]] for i in range(3))
+        return np.cross(b - a, c - a)
+
+    def transformed(self, transform):
+        """
+        A copy moved by a 4x4 homogeneous transform.
+        """
+        transform = np.asarray(transform, dtype=float)
+        vertices = self.vertices @ transform[:3, :3].T.astype(np.float32) + transform[:3, 3].astype(np.float32)
+        return CompactMesh(vertices, self.faces, self.face_colors)
+
+    def export(self, file_path):
+        """
+        Write the mesh to a file. STL is written directly from the arrays, other
+        formats go through trimesh.
+        """
+        if not file_path.lower().endswith(".stl"):
+            return self.to_trimesh().export(file_path)
+        with open(file_path, 'wb') as f:
+            for chunk in iter_binary_stl(self.vertices, self.faces):
+                f.write(chunk)
+
+    def _grid(self, divisions):
+        # Cell size and the grid cell key of every vertex, for a grid of divisions cells
+        # along the longest side. Shared by simplified and the face grid.
+        if divisions not in self._face_grids:
+            cell = max(float(self.extents.max()) / divisions, np.finfo(np.float32).eps)
+            cells = np.floor((self.vertices - self.bounds[0]) / cell).astype(np.int64)
+            self._face_grids[divisions] = {"cell": cell, "vertex_keys": self._cell_keys(cells, divisions)}
+        return self._face_grids[divisions]
+
+    @staticmethod
+    def _cell_keys(cells, divisions):
+        # Cells one past either edge of the grid are valid neighbours, hence the + 1 and + 3
+        cells = cells + 1
+        return (cells[..., 0] * (divisions + 3) + cells[..., 1]) * (divisions + 3) + cells[..., 2]
+
+    def simplified(self, divisions=LOD_DIVISIONS):
+        """
+        Coarse copy of the mesh by vertex clustering: the vertices in each cell of a grid
+        with divisions cells along the longest side are merged into their mean, and
+        faces that collapse are dropped. Built once per divisions.
+        """
+        if divisions not in self._levels:
+            _, cluster = np.unique(self._grid(divisions)["vertex_keys"], return_inverse=True)
+            cluster = cluster.reshape(-1)
+            counts = np.bincount(cluster)
+            vertices = np.column_stack([np.bincount(cluster, weights=self.vertices[:, i]) / counts
+                                        for i in range(3)])
+            faces = cluster[self.faces]
+            faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+            _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+            self._levels[divisions] = CompactMesh(vertices, faces[np.sort(first)])
+        return self._levels[divisions]
+
+    def _faces_near(self, points, divisions):
+        # Faces in the cells next to the cell of each of the (k, 3) points. Every face is
+        # binned in all the cells its bounding box overlaps, so a face crossing a cell is
+        # found from that cell's neighbours however wide it is. A walk samples every half
+        # cell, so a crossing is within a quarter cell of a sample, in a neighbouring cell.
+        grid = self._grid(divisions)
+        if "faces" not in grid:
+            grid["faces"] = self._face_bins(grid["cell"], divisions)
+        unique_keys, starts, order, spanning = grid["faces"]
+
+        cell = np.floor((np.asarray(points).reshape(-1, 3) - self.bounds[0]) / grid["cell"]).astype(np.int64)
+        steps = np.arange(-1, 2)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), -1).reshape(-1, 3)
+        keys = np.unique(self._cell_keys(np.clip(cell[:, None] + offsets, -1, divisions + 1), divisions))
+
+        positions = np.searchsorted(unique_keys, keys)
+        found = positions < len(unique_keys)
+        found[found] = unique_keys[positions[found]] == keys[found]
+        if not np.any(found) and not len(spanning):
+            return order[:0]
+        # A face over several of the cells is listed once for each, which the ray tests allow
+        return np.concatenate([order[starts[p]:starts[p + 1]] for p in positions[found]] + [spanning])
+
+    def _face_bins(self, cell, divisions):
+        # Face indices sorted by the key of each cell their bounding box overlaps, with
+        # the start of every key's run. Faces over more than MAX_FACE_CELLS cells are
+        # returned separately instead, to be tested near every point.
+        cells = np.floor((self.vertices - self.bounds[0]) / cell).astype(np.int32)
+        a, b, c = (cells[self.faces[:, i]] for i in range(3))
+        lower = np.minimum(np.minimum(a, b), c)
+        spans = np.maximum(np.maximum(a, b), c) - lower + 1
+        counts = spans[:, 0] * spans[:, 1] * spans[:, 2]
+        spanning = np.flatnonzero(counts > MAX_FACE_CELLS).astype(np.int32)
+
+        # Most faces lie in one cell; the others get one entry per overlapped cell, from
+        # the cell's position within the face's box
+        face_ids = np.flatnonzero(counts == 1)
+        keys = [self._cell_keys(lower[face_ids].astype(np.int64), divisions)]
+        wide = np.flatnonzero((counts > 1) & (counts <= MAX_FACE_CELLS))
+        wide_ids = np.repeat(wide, counts[wide])
+        local = np.arange(len(wide_ids)) - np.repeat(np.cumsum(counts[wide]) - counts[wide], counts[wide])
+        span = spans[wide_ids]
+        offset = np.column_stack([local // (span[:, 1] * span[:, 2]), local // span[:, 2] % span[:, 1],
+                                  local % span[:, 2]])
+        keys.append(self._cell_keys(lower[wide_ids] + offset, divisions))
+        face_ids, keys = np.concatenate([face_ids, wide_ids]), np.concatenate(keys)
+
+        order = np.argsort(keys, kind='stable')
+        unique_keys, starts = np.unique(keys[order], return_index=True)
+        return unique_keys, np.append(starts, len(order)), face_ids[order].astype(np.int32), spanning
+
+    def _ray_span(self, origin, direction):
+        # Distances along the ray where it enters and leaves the bounding box
+        lower, upper = self.bounds
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t1, t2 = (lower - origin) / direction, (upper - origin) / direction
+        return max(0.0, np.nanmax(np.minimum(t1, t2))), np.nanmin(np.maximum(t1, t2))
+
+    def _faces_along(self, origin, direction, divisions, t_start=0.0, t_stop=np.inf):
+        # Faces crossing the ray between t_start and t_stop inside the bounding box
+        # (plus some beyond), sampled every half cell
+        t_enter, t_exit = self._ray_span(origin, direction)
+        t_enter, t_exit = max(t_enter, t_start), min(t_exit, t_stop)
+        if not t_exit >= t_enter:
+            return np.zeros(0, dtype=np.int32)
+        step = self._grid(divisions)["cell"] / 2
+        return self._faces_near(origin + np.arange(t_enter, t_exit + step, step)[:, None] * direction, divisions)
+
+    def _ray_index(self, direction):
+        # Faces projected onto the plane perpendicular to direction, sorted by the lower
+        # bound of their first projected coordinate. Built once per direction.
+        key = tuple(np.round(direction, 12))
+        index = self._ray_indexes.get(key)
+        if index is None:
+            helper = np.eye(3)[np.argmin(np.abs(direction))]
+            axis_u = np.cross(direction, helper)
+            axis_u /= np.linalg.norm(axis_u)
+            axis_w = np.cross(direction, axis_u)
+            basis = np.column_stack([axis_u, axis_w]).astype(np.float32)
+
+            projected = (self.vertices @ basis)[self.faces]
+            lower = projected.min(axis=1)
+            upper = projected.max(axis=1)
+            order = np.argsort(lower[:, 0], kind='stable')
+            widest = float((upper[:, 0] - lower[:, 0]).max()) if len(order) else 0.0
+            index = (basis, order, lower[order], upper[order], widest)
+            self._ray_indexes[key] = index
+        return index
+
+    def _closest_t(self, origin, direction, candidates):
+        # Distance along the ray to the closest of the candidate faces it hits, or None.
+        # Moller-Trumbore, in double precision.
+        if len(candidates) == 0:
+            return None
+        triangles = self.vertices[self.faces[candidates]].astype(float)
+        edge1 = triangles[:, 1] - triangles[:, 0]
+        edge2 = triangles[:, 2] - triangles[:, 0]
+        p = np.cross(direction, edge2)
+        det = np.einsum('ij,ij->i', edge1, p)
+        valid = np.abs(det) > 1e-12
+        inv_det = np.divide(1.0, det, out=np.zeros_like(det), where=valid)
+        s = origin - triangles[:, 0]
+        u = np.einsum('ij,ij->i', s, p) * inv_det
+        q = np.cross(s, edge1)
+        v = (q @ direction) * inv_det
+        t = np.einsum('ij,ij->i', edge2, q) * inv_det
+
+        eps = 1e-9
+        valid &= (u >= -eps) & (v >= -eps) & (u + v <= 1 + eps) & (t >= 0)
+        return t[valid].min() if np.any(valid) else None
+
+    def first_hits(self, origins, direction=(0.0, 1.0, 0.0), multires=None):
+        """
+        Cast one ray per origin along a shared direction and keep the closest hit of each.
+
+        Parameters:
+        origins (array): (n, 3) ray origins
+        direction (array): Shared ray direction
+        multires (bool): Search a coarse copy first and refine the hits locally, by
+                         default for meshes with more than MULTIRES_MIN_FACES faces
+
+        Returns:
+        tuple: (hits (n, 3), hit_mask (n,)). Rays that miss keep their origin.
+        """
+        origins = np.asarray(origins, dtype=float).reshape(-1, 3)
+        direction = np.asarray(direction, dtype=float)
+        direction = direction / np.linalg.norm(direction)
+
+        hits = origins.copy()
+        hit_mask = np.zeros(len(origins), dtype=bool)
+        if len(origins) == 0 or len(self.faces) == 0:
+            return hits, hit_mask
+
+        if multires is None:
+            multires = len(self.faces) > MULTIRES_MIN_FACES
+        if multires:
+            coarse_hits, coarse_mask = self.simplified().first_hits(origins, direction, multires=False)
+            # Past the coarse hit by the largest distance clustering moves a vertex
+            margin = np.sqrt(3) * self._grid(LOD_DIVISIONS)["cell"]
+            for i, origin in enumerate(origins):
+                t, walked = None, 0.0
+                if coarse_mask[i]:
+                    walked = float(np.dot(coarse_hits[i] - origin, direction)) + margin
+                    t = self._closest_t(origin, direction, self._faces_along(origin, direction, WALK_DIVISIONS,
+                                                                             t_stop=walked))
+                if t is None or t > walked:
+                    # Nothing up to there (or the coarse level missed): walk the rest of the ray
+                    rest = self._closest_t(origin, direction, self._faces_along(origin, direction, WALK_DIVISIONS,
+                                                                                t_start=walked))
+                    if rest is not None and (t is None or rest < t):
+                        t = rest
+                if t is not None:
+                    hits[i] = origin + t * direction
+                    hit_mask[i] = True
+            return hits, hit_mask
+
+        basis, order, lower, upper, widest = self._ray_index(direction)
+        projected_origins = origins @ basis.astype(float)
+        # Faces whose projected box can contain the ray: lower u in [u - widest, u]
+        starts = np.searchsorted(lower[:, 0], projected_origins[:, 0] - widest, side='left')
+        stops = np.searchsorted(lower[:, 0], projected_origins[:, 0], side='right')
+
+        for i, ((pu, pw), start, stop) in enumerate(zip(projected_origins, starts, stops)):
+            window = slice(start, stop)
+            inside = (upper[window, 0] >= pu) & (lower[window, 1] <= pw) & (upper[window, 1] >= pw)
+            t = self._closest_t(origins[i], direction, order[window][inside])
+            if t is not None:
+                hits[i] = origins[i] + t * direction
+                hit_mask[i] = True
+
+        return hits, hit_mask
+
+def as_trimesh(mesh):
+    # The library object for a mesh that may be a CompactMesh
+    return mesh.to_trimesh() if isinstance(mesh, CompactMesh) else mesh
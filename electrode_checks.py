@@ -0,0 +1,125 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from model_generation import head_region_tree
+
+# Sanity checks of an electrode layout against the head:
+#   clearance  signed distance from each electrode to the scalp, negative inside the head.
+#              The probe vertices of every electrode are transformed at once and matched
+#              to the head in one batched query of the head's cached KD-tree
+#              (model_generation.head_region_tree); the sign comes from the normal of
+#              the nearest head vertex.
+#   overlap    pairs of electrodes whose bounding spheres intersect, found with a KD-tree
+#              over the electrode centers instead of comparing every pair.
+# Electrodes closer to the scalp than min_clearance are pushed outward, away from the
+# layout center; those still too close afterwards, and overlapping pairs, are reported.
+# The central target electrode sits inside the head on purpose and is not checked; the
+# caller names it by index, as layouts are free to reuse its color.
+
+# Electrode vertices used as clearance probes, so the cost per electrode stays fixed
+MAX_PROBE_VERTICES = 64
+# Rounds of pushing, the nearest scalp point may not lie straight below an electrode
+MAX_ADJUST_ROUNDS = 3
+DEFAULT_MIN_CLEARANCE = 0.0
+
+def probe_vertices(electrode_mesh, max_probes=MAX_PROBE_VERTICES):
+    """
+    Up to max_probes electrode vertices spread over the model: the extremes along each
+    axis first, then evenly spaced vertices.
+    """
+    vertices = np.asarray(electrode_mesh.vertices, dtype=float)
+    if len(vertices) <= max_probes:
+        return vertices
+    extremes = np.concatenate([vertices.argmin(axis=0), vertices.argmax(axis=0)])
+    spread = np.linspace(0, len(vertices) - 1, max_probes - len(extremes)).astype(int)
+    return vertices[np.unique(np.concatenate([extremes, spread]))]
+
+def _signed_clearance(head_mesh, points):
+    # Signed distance of points to the nearest head vertex, positive outside
+    tree, vertices = head_region_tree(head_mesh)
+    distances, nearest = tree.query(points)
+    normals = np.asarray(head_mesh.vertex_normals)[nearest]
+    outside = np.einsum('ij,ij->i', points - vertices[nearest], normals) >= 0
+    return np.where(outside, distances, -distances)
+
+def electrode_clearances(head_mesh, probes, transforms):
+    """
+    Minimum signed clearance of each electrode, in one batched query.
+
+    Parameters:
+    head_mesh (CompactMesh): Oriented head mesh
+    probes (array): (k, 3) electrode probe vertices, see probe_vertices
+    transforms (array): (e, 4, 4) electrode transforms
+
+    Returns:
+    array: (e,) clearances, negative for electrodes reaching into the head
+    """
+    if len(transforms) == 0:
+        return np.zeros(0)
+    points = np.einsum('eij,kj->eki', transforms[:, :3, :3], probes) + transforms[:, None, :3, 3]
+    return _signed_clearance(head_mesh, points.reshape(-1, 3)).reshape(len(transforms), -1).min(axis=1)
+
+def overlapping_pairs(electrode_mesh, transforms):
+    """
+    Pairs of electrodes whose bounding spheres intersect.
+
+    Returns:
+    list: (i, j) index pairs, i < j
+    """
+    vertices = np.asarray(electrode_mesh.vertices, dtype=float)
+    local_center = (vertices.min(axis=0) + vertices.max(axis=0)) / 2
+    radius = np.linalg.norm(vertices - local_center, axis=1).max()
+    centers = np.einsum('eij,j->ei', transforms[:, :3, :3], local_center) + transforms[:, :3, 3]
+    return sorted(cKDTree(centers).query_pairs(2 * radius))
+
+def check_electrode_layout(head_mesh, electrode_mesh, instances, central=None,
+                           min_clearance=DEFAULT_MIN_CLEARANCE, adjust=True):
+    """
+    Check the clearance and overlap of a layout, pushing electrodes that are too close
+    to the scalp outward.
+
+    Parameters:
+    head_mesh (CompactMesh): Oriented head mesh
+    electrode_mesh (trimesh.Trimesh): Scaled electrode model
+    instances (list): (4x4 transform, RGBA color) electrode instances
+    central (int): Index of the central target electrode, which is not checked, None if
+                   the layout has none (model_generation.CENTRAL_INDEX for ring layouts)
+    min_clearance (float): Smallest allowed distance between an electrode and the scalp
+    adjust (bool): Move electrodes that are too close outward, otherwise only report them
+
+    Returns:
+    tuple: (instances, with adjusted transforms, report dict with the clearance of every
+            checked electrode, the indices adjusted, the indices still too close, and the
+            overlapping index pairs)
+    """
+    checked = [i for i in range(len(instances)) if i != central]
+    report = {"clearance": {}, "adjusted": [], "too_close": [], "overlapping": []}
+    if not checked:
+        return instances, report
+
+    probes = probe_vertices(electrode_mesh)
+    transforms = np.array([instances[i][0] for i in checked], dtype=float)
+    clearances = electrode_clearances(head_mesh, probes, transforms)
+
+    adjusted = set()
+    for _ in range(MAX_ADJUST_ROUNDS if adjust else 0):
+        close = np.flatnonzero(clearances < min_clearance)
+        if not len(close):
+            break
+        # The electrode's y-axis points towards the layout center, so -y moves it outward
+        outward = -transforms[close, :3, 1]
+        transforms[close, :3, 3] += outward * (min_clearance - clearances[close])[:, None]
+        clearances[close] = electrode_clearances(head_mesh, probes, transforms[close])
+        adjusted.update(checked[i] for i in close)
+    report["adjusted"] = sorted(adjusted)
+
+    instances = list(instances)
+    for i, index in enumerate(checked):
+        instances[index] = (transforms[i], instances[index][1])
+        report["clearance"][index] = float(clearances[i])
+    report["too_close"] = [checked[i] for i in np.flatnonzero(clearances < min_clearance)]
+    report["overlapping"] = [(checked[i], checked[j]) for i, j in overlapping_pairs(electrode_mesh, transforms)]
+
+    print(f"Electrode check: {len(checked)} electrodes, minimum clearance {clearances.min():.4f}, "
+          f"{len(report['adjusted'])} pushed outward, {len(report['too_close'])} still too close, "
+          f"{len(report['overlapping'])} overlapping pairs")
+    return instances, report
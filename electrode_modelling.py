@@ -4,6 +4,7 @@ import stl_reader
 import pyvista as pv
 import trimesh
 from scipy.spatial.transform import Rotation as R
+from point_sets import load_point_set
 # Places the electrodes in the given locations from the 10-20 electrode placement system
 # The electrodes should be placed on the surface of the head model such the the negative y direction of
 # the electrode is pointing towards the center of the head model.
@@ -173,8 +174,8 @@ def visualize(stl_file_path, scaled_ref_points, electrode_points, electrode_mesh
     plotter.show()
 
 if __name__ == "__main__":
-    #Get points from aligned_points.xyz
-    aligned_points = np.loadtxt("aligned_points.xyz")
+    #Get points from aligned_points.npz
+    aligned_points = load_point_set("aligned_points.npz")
 
     # Find the electrode positions and display these points
     electrode_positions = []
@@ -0,0 +1,252 @@
+import json
+import struct
+import numpy as np
+from model_generation import combine_electrode_model, HEAD_FACE_COLOR
+from compact_mesh import CompactMesh
+from result_packaging import iter_binary_stl, STL_CHUNK_FACES
+
+# Output formats for the head and electrode models besides STL:
+#   glb   - binary glTF 2.0. The electrode geometry is stored once and every electrode
+#           is a node with its own transform (instancing), one material per ring color.
+#   ply   - binary little-endian PLY with float32 positions and per-face colors.
+#   ply16 - the same with positions quantized to 16 bits per axis. The offset and scale
+#           needed to restore them are stored in a header comment, see read_ply.
+
+FORMATS = ("stl", "glb", "ply", "ply16")
+
+# glTF constants
+_GLB_MAGIC = 0x46546C67
+_GLB_JSON = 0x4E4F534A
+_GLB_BIN = 0x004E4942
+_FLOAT = 5126
+_UNSIGNED_INT = 5125
+_ARRAY_BUFFER = 34962
+_ELEMENT_ARRAY_BUFFER = 34963
+
+def _pad4(data, fill=b'\0'):
+    return data + fill * (-len(data) % 4)
+
+class _GlbBuilder:
+    # Collects binary buffer views, accessors, materials, meshes and nodes of a glTF scene.
+
+    def __init__(self):
+        self.blobs = []
+        self.offset = 0
+        self.gltf = {
+            "asset": {"version": "2.0", "generator": "EEG_Model_Generator"},
+            "scene": 0,
+            "scenes": [{"nodes": []}],
+            "nodes": [], "meshes": [], "materials": [],
+            "accessors": [], "bufferViews": [], "buffers": [],
+        }
+
+    def _view(self, data, target):
+        self.gltf["bufferViews"].append({"buffer": 0, "byteOffset": self.offset,
+                                         "byteLength": len(data), "target": target})
+        data = _pad4(data)
+        self.blobs.append(data)
+        self.offset += len(data)
+        return len(self.gltf["bufferViews"]) - 1
+
+    def geometry(self, vertices, faces):
+        # Store positions and indices once, return their accessor indices.
+        positions = np.ascontiguousarray(vertices, dtype=np.float32)
+        indices = np.ascontiguousarray(faces, dtype=np.uint32).reshape(-1)
+        accessors = self.gltf["accessors"]
+        accessors.append({"bufferView": self._view(positions.tobytes(), _ARRAY_BUFFER),
+                          "componentType": _FLOAT, "count": len(positions), "type": "VEC3",
+                          "min": positions.min(axis=0).tolist(), "max": positions.max(axis=0).tolist()})
+        accessors.append({"bufferView": self._view(indices.tobytes(), _ELEMENT_ARRAY_BUFFER),
+                          "componentType": _UNSIGNED_INT, "count": len(indices), "type": "SCALAR"})
+        return len(accessors) - 2, len(accessors) - 1
+
+    def mesh(self, geometry, color):
+        position, indices = geometry
+        self.gltf["materials"].append({"pbrMetallicRoughness": {
+            "baseColorFactor": [c / 255.0 for c in color], "metallicFactor": 0.0, "roughnessFactor": 0.8}})
+        self.gltf["meshes"].append({"primitives": [{"attributes": {"POSITION": position}, "indices": indices,
+                                                    "material": len(self.gltf["materials"]) - 1}]})
+        return len(self.gltf["meshes"]) - 1
+
+    def node(self, mesh, transform=None, name=None):
+        node = {"mesh": mesh}
+        if name is not None:
+            node["name"] = name
+        if transform is not None and not np.allclose(transform, np.eye(4)):
+            # glTF matrices are column-major
+            node["matrix"] = np.asarray(transform, dtype=float).T.reshape(-1).tolist()
+        self.gltf["nodes"].append(node)
+        self.gltf["scenes"][0]["nodes"].append(len(self.gltf["nodes"]) - 1)
+
+    def chunks(self):
+        self.gltf["buffers"].append({"byteLength": self.offset})
+        json_chunk = _pad4(json.dumps(self.gltf, separators=(',', ':')).encode(), b' ')
+        total = 12 + 8 + len(json_chunk) + 8 + self.offset
+        yield struct.pack('<III', _GLB_MAGIC, 2, total)
+        yield struct.pack('<II', len(json_chunk), _GLB_JSON) + json_chunk
+        yield struct.pack('<II', self.offset, _GLB_BIN)
+        yield from self.blobs
+
+def iter_glb(head_mesh=None, electrode_mesh=None, instances=()):
+    """
+    Serialize the head and the instanced electrodes as binary glTF.
+
+    Parameters:
+    head_mesh (CompactMesh): Head, or None for an electrodes-only file
+    electrode_mesh (trimesh.Trimesh): Scaled electrode model, stored once
+    instances (list): (4x4 transform, RGBA color) pairs, one node each
+
+    Yields:
+    bytes: GLB header, JSON chunk and binary chunk pieces
+    """
+    builder = _GlbBuilder()
+    if head_mesh is not None:
+        head = builder.mesh(builder.geometry(head_mesh.vertices, head_mesh.faces), HEAD_FACE_COLOR)
+        builder.node(head, name="head")
+
+    if len(instances) > 0:
+        electrode = builder.geometry(electrode_mesh.vertices, electrode_mesh.faces)
+        # One mesh per color, all sharing the electrode accessors
+        meshes = {}
+        for i, (transform, color) in enumerate(instances):
+            key = tuple(color)
+            if key not in meshes:
+                meshes[key] = builder.mesh(electrode, color)
+            builder.node(meshes[key], transform, name=f"electrode_{i}")
+
+    yield from builder.chunks()
+
+def iter_ply(vertices, faces, face_colors=None, quantize=False, chunk_faces=STL_CHUNK_FACES):
+    """
+    Serialize a mesh as binary little-endian PLY.
+
+    Parameters:
+    vertices (array): (n, 3) positions
+    faces (array): (m, 3) vertex indices
+    face_colors (array): Optional (m, 3 or 4) uint8 colors
+    quantize (bool): Store positions as uint16 per axis instead of float32
+
+    Yields:
+    bytes: Header, vertex data, then face records in chunks
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces)
+
+    header = ["ply", "format binary_little_endian 1.0", "comment EEG_Model_Generator"]
+    if quantize:
+        offset = vertices.min(axis=0) if len(vertices) else np.zeros(3)
+        scale = (vertices.max(axis=0) - offset) if len(vertices) else np.ones(3)
+        scale[scale == 0] = 1.0
+        header.append("comment quantization " + " ".join(f"{v:.9g}" for v in (*offset, *scale)))
+        vertex_type = "ushort"
+    else:
+        vertex_type = "float"
+    header.append(f"element vertex {len(vertices)}")
+    header += [f"property {vertex_type} {axis}" for axis in "xyz"]
+    header.append(f"element face {len(faces)}")
+    header.append("property list uchar int vertex_indices")
+    if face_colors is not None:
+        header += ["property uchar red", "property uchar green", "property uchar blue"]
+    header.append("end_header")
+    yield ("\n".join(header) + "\n").encode()
+
+    if quantize:
+        quantized = np.rint((vertices - offset) / scale * 65535)
+        yield np.clip(quantized, 0, 65535).astype('<u2').tobytes()
+    else:
+        yield vertices.astype('<f4').tobytes()
+
+    fields = [('count', 'u1'), ('indices', '<i4', (3,))]
+    if face_colors is not None:
+        fields.append(('color', 'u1', (3,)))
+        face_colors = np.asarray(face_colors, dtype=np.uint8)[:, :3]
+    record = np.dtype(fields)
+    for start in range(0, len(faces), chunk_faces):
+        records = np.zeros(len(faces[start:start + chunk_faces]), dtype=record)
+        records['count'] = 3
+        records['indices'] = faces[start:start + chunk_faces]
+        if face_colors is not None:
+            records['color'] = face_colors[start:start + chunk_faces]
+        yield records.tobytes()
+
+def read_ply(data):
+    """
+    Read a binary PLY written by iter_ply, restoring quantized positions.
+
+    Parameters:
+    data (bytes): File contents
+
+    Returns:
+    tuple: (vertices (n, 3) float array, faces (m, 3) int array, face colors (m, 3) or None)
+    """
+    end = data.index(b"end_header\n") + len(b"end_header\n")
+    header = data[:end].decode().splitlines()
+    quantization = None
+    vertex_count = face_count = 0
+    vertex_type = '<f4'
+    has_color = False
+    for line in header:
+        parts = line.split()
+        if parts[:2] == ["comment", "quantization"]:
+            quantization = np.array([float(v) for v in parts[2:8]])
+        elif parts[:2] == ["element", "vertex"]:
+            vertex_count = int(parts[2])
+        elif parts[:2] == ["element", "face"]:
+            face_count = int(parts[2])
+        elif parts[:2] == ["property", "ushort"]:
+            vertex_type = '<u2'
+        elif parts[:3] == ["property", "uchar", "red"]:
+            has_color = True
+
+    vertices = np.frombuffer(data, dtype=vertex_type, count=vertex_count * 3, offset=end).reshape(-1, 3)
+    if quantization is not None:
+        vertices = quantization[:3] + vertices / 65535.0 * quantization[3:]
+    vertices = vertices.astype(np.float64)
+
+    fields = [('count', 'u1'), ('indices', '<i4', (3,))]
+    if has_color:
+        fields.append(('color', 'u1', (3,)))
+    offset = end + vertex_count * 3 * np.dtype(vertex_type).itemsize
+    records = np.frombuffer(data, dtype=np.dtype(fields), count=face_count, offset=offset)
+    return vertices, records['indices'].astype(np.int64), records['color'].copy() if has_color else None
+
+def _face_colors(mesh):
+    # Per-face colors of a mesh, if it carries any
+    if isinstance(mesh, CompactMesh):
+        return mesh.face_colors
+    visual = getattr(mesh, "visual", None)
+    if visual is not None and getattr(visual, "kind", None) == "face":
+        return visual.face_colors
+    return None
+
+def export_entries(fmt, head_mesh, electrode_mesh, instances, electrodes_only=False):
+    """
+    The files returned to the client in the requested format.
+
+    Parameters:
+    fmt (str): One of FORMATS
+    head_mesh (CompactMesh): Oriented head
+    electrode_mesh (trimesh.Trimesh): Scaled electrode model
+    instances (list): (4x4 transform, RGBA color) electrode placements
+    electrodes_only (bool): Leave the head out of the electrode file
+
+    Returns:
+    list: (archive name, iterable of bytes) pairs for person.<ext> and electrode.<ext>
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown output format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+    electrode_head = None if electrodes_only else head_mesh
+    if fmt == "glb":
+        return [("person.glb", iter_glb(head_mesh)),
+                ("electrode.glb", iter_glb(electrode_head, electrode_mesh, instances))]
+
+    # STL and PLY have no instancing, so the electrodes are copied into one mesh.
+    combined = combine_electrode_model(electrode_mesh, instances, electrode_head)
+    if fmt == "stl":
+        return [("person.stl", iter_binary_stl(head_mesh.vertices, head_mesh.faces)),
+                ("electrode.stl", iter_binary_stl(combined.vertices, combined.faces))]
+
+    quantize = fmt == "ply16"
+    return [("person.ply", iter_ply(head_mesh.vertices, head_mesh.faces, quantize=quantize)),
+            ("electrode.ply", iter_ply(combined.vertices, combined.faces, _face_colors(combined), quantize=quantize))]
@@ -1,9 +1,10 @@
 import os
+import tempfile
 import numpy as np
 import trimesh
 import argparse
 
-def convert_glb_to_stl(input_file, output_file=None):
+def convert_glb_to_stl(input_file, output_file=None, reuse=False):
     """
     Convert a GLB file to STL format
     
@@ -13,6 +14,9 @@ def convert_glb_to_stl(input_file, output_file=None):
         Path to input GLB file
     output_file : str, optional
         Path to output STL file. If not provided, will use same name as input file with .stl extension
+    reuse : bool, optional
+        Keep an existing output file instead of converting again. Only for inputs whose
+        name identifies their contents, like the files of the artifact store.
     
     Returns:
     --------
@@ -27,6 +31,10 @@ def convert_glb_to_stl(input_file, output_file=None):
     # Check if the input file is a GLB file
     if not input_file.lower().endswith('.glb'):
         raise ValueError("Input file must be a GLB file (.glb extension)")
+
+    if reuse and os.path.isfile(output_file):
+        print(f"Reusing STL conversion: {output_file}")
+        return output_file
     
     # Load the GLB file
     print(f"Loading GLB file: {input_file}...")
@@ -60,9 +68,18 @@ def convert_glb_to_stl(input_file, output_file=None):
     else:
         combined_mesh = mesh
     
-    # Export the mesh to STL
+    # Export the mesh to STL, through a hidden temporary file in the same directory so
+    # concurrent conversions of the same scan never expose a partial file
     print(f"Exporting to STL: {output_file}...")
-    combined_mesh.export(output_file, file_type='stl')
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".stl", dir=os.path.dirname(output_file) or ".")
+    os.close(fd)
+    try:
+        combined_mesh.export(tmp_path, file_type='stl')
+        os.replace(tmp_path, output_file)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
     
     print(f"Conversion complete: {output_file}")
     return output_file
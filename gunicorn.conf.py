@@ -0,0 +1,43 @@
+# Production serving: gunicorn -c gunicorn.conf.py server:app
+#
+# A pre-fork server with several worker processes, each running a few threads. With
+# preload the app (numpy, trimesh, torch, face_alignment) is imported once in the master
+# and the electrode template is loaded before forking, so workers share those pages
+# copy-on-write instead of each paying for them.
+#
+# Admission limits (EEG_MAX_CONCURRENT_RUNS, EEG_MAX_QUEUE) apply per worker, so the box
+# runs up to workers * EEG_MAX_CONCURRENT_RUNS pipelines at once. Size the per-run memory
+# budget (EEG_RUN_MEMORY_BUDGET_MB) accordingly.
+#
+# On SIGTERM gunicorn stops accepting connections and gives workers graceful_timeout
+# seconds to finish their requests before killing them.
+
+import os
+
+bind = os.environ.get("EEG_BIND", "0.0.0.0:8080")
+workers = int(os.environ.get("EEG_WORKERS", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("EEG_THREADS", 4))
+# A pipeline run takes tens of seconds, far longer than gunicorn's default 30s timeout
+timeout = int(os.environ.get("EEG_WORKER_TIMEOUT", 600))
+graceful_timeout = int(float(os.environ.get("EEG_DRAIN_TIMEOUT", 120)))
+preload_app = os.environ.get("EEG_PRELOAD", "1").lower() in ("1", "true", "yes", "on")
+
+def _share_model():
+    # A model on the CPU can be loaded before forking and shared. GPU and MPS contexts do
+    # not survive fork, so those are loaded in each worker after forking instead.
+    return os.environ.get("EEG_LANDMARK_DEVICE", "mps") == "cpu"
+
+def on_starting(server):
+    # Lets /shutdown signal the master, which drains all workers
+    os.environ["EEG_SERVER_PID"] = str(os.getpid())
+
+def when_ready(server):
+    # Runs in the master after the app was preloaded and before the workers are forked
+    if server.cfg.preload_app:
+        import server as eeg_server
+        eeg_server.warm_up(load_model=_share_model())
+
+def post_fork(server, worker):
+    import server as eeg_server
+    eeg_server.warm_up(load_model=not (server.cfg.preload_app and _share_model()))
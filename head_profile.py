@@ -0,0 +1,237 @@
+import numpy as np
+
+# Cross-section profile of a head scan along the vertical (y) axis, built in one pass:
+# every vertex is binned into one of PROFILE_SLICES slices along y and one of
+# PROFILE_GRID x PROFILE_GRID cells in its slice's x-z plane, and a single scatter
+# marks the occupied (slice, x, z) cells. No vertex is sorted. Per slice:
+#   x_min, x_max, z_min, z_max   extents of the occupied cells
+#   width, depth                 x and z extents
+#   perimeter                    occupied cells * cell size * pi / 4, the expected length
+#                                of a curve crossing that many cells
+#   area                         area of the ellipse spanned by width and depth
+# The anatomy levels (neck, chin, top of the head, ear band) are all read off the
+# profile, so nothing rescans the vertices. Rotations about y keep the slices, so the
+# profile of a scan can follow it through orientation with transform_profile.
+# Coarse decisions can use the profile of a vertex sample (sample_vertices) instead.
+
+PROFILE_SLICES = 256
+PROFILE_GRID = 128
+
+# Slices at the ragged ends of a scan are not neck candidates
+EDGE_SLICES = 2
+# Neck candidates closer than this fraction of the height to the chosen one do not
+# count as a runner-up when computing the margin
+NECK_MARGIN_DISTANCE = 0.05
+# The chin is searched in this fraction of the height above the neck
+CHIN_SEARCH_FRACTION = 0.4
+# Slices at least this fraction of the widest head slice form the ear band
+EAR_BAND_FRACTION = 0.97
+
+def sample_vertices(vertices, faces, size, seed=0):
+    """
+    Stratified, area-weighted vertex sample: faces are drawn with probability proportional
+    to their area by systematic sampling of the cumulative area, and one corner of each is
+    taken. Scans with many more faces than needed are first thinned to evenly spaced
+    strata of faces, so the cost does not grow with the scan.
+
+    Parameters:
+    vertices (array): (n, 3) vertices
+    faces (array): (m, 3) vertex indices
+    size (int): Number of draws, 0 for all vertices
+    seed (int): Seed of the draws, so a scan always gets the same sample
+
+    Returns:
+    array: (up to size, 3) sampled vertices, or vertices itself if there are fewer than size
+    """
+    if size <= 0 or len(vertices) <= size or len(faces) == 0:
+        return vertices
+    rng = np.random.default_rng(seed)
+
+    # One random face from each of 2 * size strata of consecutive faces
+    n_strata = min(len(faces), 2 * size)
+    edges = np.linspace(0, len(faces), n_strata + 1).astype(np.int64)
+    candidates = faces[edges[:-1] + (rng.random(n_strata) * (edges[1:] - edges[:-1])).astype(np.int64)]
+
+    a, b, c = (vertices[candidates[:, i]].astype(float) for i in range(3))
+    areas = np.linalg.norm(np.cross(b - a, c - a), axis=1)
+    cumulative = np.cumsum(areas)
+    if cumulative[-1] <= 0:
+        chosen = np.linspace(0, n_strata - 1, size).astype(np.int64)
+    else:
+        positions = (np.arange(size) + rng.random()) * (cumulative[-1] / size)
+        chosen = np.minimum(np.searchsorted(cumulative, positions), n_strata - 1)
+    corners = rng.integers(0, 3, size)
+    # Large faces can be drawn more than once, keep each vertex once
+    return vertices[np.unique(candidates[chosen, corners])]
+
+def cross_section_profile(vertices, slices=PROFILE_SLICES, grid=PROFILE_GRID):
+    """
+    Bin the vertices along y and measure every slice.
+
+    Parameters:
+    vertices (array): (n, 3) vertices, y pointing up
+    slices (int): Number of slices between the lowest and highest vertex
+    grid (int): Cells per side of the x-z grid of each slice
+
+    Returns:
+    dict: levels (slice centers), slice_height, count, x_min, x_max, z_min, z_max, width,
+          depth, perimeter and area, one entry per slice (nan extents for empty slices)
+    """
+    columns = [np.ascontiguousarray(np.asarray(vertices)[:, axis]) for axis in range(3)]
+    low = np.array([c.min() for c in columns], dtype=float)
+    high = np.array([c.max() for c in columns], dtype=float)
+    slice_height = max(high[1] - low[1], 1e-12) / slices
+    cell = max(high[0] - low[0], high[2] - low[2], 1e-12) / grid
+
+    def bins(values, origin, size, n):
+        index = ((values - origin) / size).astype(np.intp)
+        return np.clip(index, 0, n - 1, out=index)
+
+    iy = bins(columns[1], low[1], slice_height, slices)
+    ix = bins(columns[0], low[0], cell, grid)
+    iz = bins(columns[2], low[2], cell, grid)
+    count = np.bincount(iy, minlength=slices)
+    occupied = np.zeros(slices * grid * grid, dtype=bool)
+    occupied[(iy * grid + ix) * grid + iz] = True
+    occupied = occupied.reshape(slices, grid, grid)
+
+    in_x, in_z = occupied.any(axis=2), occupied.any(axis=1)
+    empty = count == 0
+
+    def extent(hit, origin):
+        # Lower edge of the first and upper edge of the last occupied column
+        first = np.argmax(hit, axis=1)
+        last = grid - 1 - np.argmax(hit[:, ::-1], axis=1)
+        lower, upper = origin + first * cell, origin + (last + 1) * cell
+        return np.where(empty, np.nan, lower), np.where(empty, np.nan, upper)
+
+    x_min, x_max = extent(in_x, low[0])
+    z_min, z_max = extent(in_z, low[2])
+    width, depth = x_max - x_min, z_max - z_min
+    return {
+        "levels": low[1] + (np.arange(slices) + 0.5) * slice_height,
+        "slice_height": slice_height,
+        "count": count,
+        "x_min": x_min, "x_max": x_max,
+        "z_min": z_min, "z_max": z_max,
+        "width": width, "depth": depth,
+        "perimeter": np.count_nonzero(occupied.reshape(slices, -1), axis=1) * cell * np.pi / 4,
+        "area": np.pi / 4 * width * depth,
+    }
+
+def transform_profile(profile, transform):
+    """
+    Profile of the mesh after a 4x4 rotation about the y-axis (plus translation), such as
+    the 90 and 180 degree turns of prepare_head_mesh. The extents are those of the turned
+    bounding rectangle of each slice, exact for multiples of 90 degrees.
+    """
+    R, t = np.asarray(transform)[:3, :3], np.asarray(transform)[:3, 3]
+    corners = [(profile["x_min"], profile["z_min"]), (profile["x_min"], profile["z_max"]),
+               (profile["x_max"], profile["z_min"]), (profile["x_max"], profile["z_max"])]
+    x = np.array([R[0, 0] * cx + R[0, 2] * cz + t[0] for cx, cz in corners])
+    z = np.array([R[2, 0] * cx + R[2, 2] * cz + t[2] for cx, cz in corners])
+    turned = dict(profile)
+    turned.update({
+        "levels": profile["levels"] + t[1],
+        "x_min": x.min(axis=0), "x_max": x.max(axis=0),
+        "z_min": z.min(axis=0), "z_max": z.max(axis=0),
+    })
+    turned["width"] = turned["x_max"] - turned["x_min"]
+    turned["depth"] = turned["z_max"] - turned["z_min"]
+    return turned
+
+def _occupied(profile):
+    return np.flatnonzero(profile["count"] > 0)
+
+def _head_peak(profile, candidates):
+    # Slice with the largest cross-section in the upper half of the scan (the cranium)
+    levels = profile["levels"]
+    upper = candidates[levels[candidates] >= (levels[candidates[0]] + levels[candidates[-1]]) / 2]
+    return upper[np.argmax(profile["area"][upper])]
+
+def neck_level(profile):
+    """
+    The neck: the slice with the smallest cross-section between the bottom of the scan and
+    the widest slice of the head. The margin is how much larger (relatively) the smallest
+    slice away from it is, so two similar candidates give a small margin.
+
+    Returns:
+    tuple: (neck level, margin)
+    """
+    occupied = _occupied(profile)
+    peak = _head_peak(profile, occupied)
+    candidates = occupied[(occupied >= occupied[0] + EDGE_SLICES) & (occupied <= peak)]
+    if not len(candidates):
+        candidates = occupied[occupied <= peak]
+    area, levels = profile["area"], profile["levels"]
+    best = candidates[np.argmin(area[candidates])]
+
+    height = levels[occupied[-1]] - levels[occupied[0]]
+    far = candidates[np.abs(levels[candidates] - levels[best]) > NECK_MARGIN_DISTANCE * height]
+    if not len(far):
+        return float(levels[best]), 1.0
+    runner_up = area[far].min()
+    margin = float((runner_up - area[best]) / runner_up) if runner_up > 0 else 0.0
+    return float(levels[best]), margin
+
+def shoulder_axis(profile):
+    """
+    Whether the shoulders lie along z: the widest z extent of any slice exceeds the widest
+    x extent. The margin is the relative difference between the two.
+
+    Returns:
+    tuple: (True if along z, margin)
+    """
+    max_width, max_depth = np.nanmax(profile["width"]), np.nanmax(profile["depth"])
+    widest = max(max_width, max_depth)
+    margin = float(abs(max_depth - max_width) / widest) if widest > 0 else 0.0
+    return bool(max_depth > max_width), margin
+
+def anatomy_levels(profile, neck_height=None):
+    """
+    Anatomical levels of an oriented head (nose towards +x, top towards +y).
+
+    Parameters:
+    profile (dict): Profile of the oriented mesh, see cross_section_profile and transform_profile
+    neck_height (float): Neck level if already known, otherwise taken from neck_level
+
+    Returns:
+    dict: neck_height, chin (where the front of the head juts out above the neck),
+          head_top, and ear_band (low, high), the levels where the head is widest
+          from side to side
+    """
+    occupied = _occupied(profile)
+    levels = profile["levels"]
+    if neck_height is None:
+        neck_height = neck_level(profile)[0]
+    head_top = float(levels[occupied[-1]] + profile["slice_height"] / 2)
+
+    above_neck = occupied[levels[occupied] > neck_height]
+    if len(above_neck) < 2:
+        return {"neck_height": float(neck_height), "chin": float(neck_height),
+                "head_top": head_top, "ear_band": (float(neck_height), head_top)}
+
+    # Chin: the largest forward step of the face between consecutive slices above the neck
+    chin_limit = neck_height + CHIN_SEARCH_FRACTION * (head_top - neck_height)
+    search = above_neck[levels[above_neck] <= chin_limit]
+    if len(search) < 2:
+        search = above_neck[:2]
+    steps = np.diff(profile["x_max"][search])
+    chin = float(levels[search[1 + np.argmax(steps)]])
+
+    # Ear band: the contiguous run of slices above the chin around the widest one in z
+    head = above_neck[levels[above_neck] >= chin]
+    if not len(head):
+        head = above_neck
+    depth = profile["depth"][head]
+    widest = int(np.argmax(depth))
+    wide = depth >= EAR_BAND_FRACTION * depth[widest]
+    low = high = widest
+    while low > 0 and wide[low - 1]:
+        low -= 1
+    while high < len(head) - 1 and wide[high + 1]:
+        high += 1
+    half = profile["slice_height"] / 2
+    ear_band = (float(levels[head[low]] - half), float(levels[head[high]] + half))
+
+    return {"neck_height": float(neck_height), "chin": chin, "head_top": head_top, "ear_band": ear_band}
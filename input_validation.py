@@ -0,0 +1,182 @@
+import json
+import struct
+
+# Cheap validation of uploads before any pipeline work. Only the GLB header and JSON
+# chunk and the first bytes of the image are read, so corrupt or oversized inputs are
+# rejected before trimesh or the face-alignment model ever see them.
+
+GLB_MAGIC = b"glTF"
+GLB_JSON_CHUNK = 0x4E4F534A
+# Largest JSON chunk we are willing to parse
+MAX_GLB_JSON_BYTES = 16 * 2**20
+
+# Bytes read from the start of an image to find its dimensions
+IMAGE_PROBE_BYTES = 64 * 1024
+
+class InvalidInput(ValueError):
+    """
+    Raised when an uploaded file is corrupt, of the wrong type or outside the limits.
+    """
+
+def _read_exact(stream, n):
+    data = stream.read(n)
+    if len(data) != n:
+        raise InvalidInput("GLB file is truncated")
+    return data
+
+def _accessor_count(accessors, index):
+    # Element count of an accessor, rejecting indices and counts that are not
+    # non-negative integers (negative indices would silently pick another accessor)
+    if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < len(accessors):
+        raise IndexError(f"accessor {index!r}")
+    count = accessors[index]["count"]
+    if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+        raise TypeError(f"accessor {index} count {count!r}")
+    return count
+
+def probe_glb(stream, file_size=None):
+    """
+    Read the GLB header and JSON chunk and sum the declared geometry sizes.
+
+    Parameters:
+    stream (file-like): Binary stream positioned at the start of the GLB, left where reading stopped
+    file_size (int): Actual size of the upload, if known, checked against the declared length
+
+    Returns:
+    dict: version, length, vertices and faces declared by the mesh primitives
+
+    Raises:
+    InvalidInput: If the header or JSON chunk is malformed
+    """
+    magic, version, length = struct.unpack('<4sII', _read_exact(stream, 12))
+    if magic != GLB_MAGIC:
+        raise InvalidInput("Not a GLB file (bad magic)")
+    if version != 2:
+        raise InvalidInput(f"Unsupported glTF version {version}, expected 2")
+    if file_size is not None and length != file_size:
+        raise InvalidInput(f"GLB header declares {length} bytes but the upload has {file_size}")
+
+    chunk_length, chunk_type = struct.unpack('<II', _read_exact(stream, 8))
+    if chunk_type != GLB_JSON_CHUNK:
+        raise InvalidInput("GLB file does not start with a JSON chunk")
+    if chunk_length > MAX_GLB_JSON_BYTES or 20 + chunk_length > length:
+        raise InvalidInput(f"GLB JSON chunk of {chunk_length} bytes is out of bounds")
+
+    try:
+        gltf = json.loads(_read_exact(stream, chunk_length))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise InvalidInput(f"GLB JSON chunk is not valid JSON: {e}")
+
+    if not isinstance(gltf, dict):
+        raise InvalidInput("GLB JSON chunk is not an object")
+
+    vertices = faces = 0
+    try:
+        accessors = gltf.get("accessors", [])
+        for mesh in gltf.get("meshes", []):
+            for primitive in mesh.get("primitives", []):
+                # Mode 4 (triangles) is the default, other modes hold no faces
+                position = _accessor_count(accessors, primitive["attributes"]["POSITION"])
+                vertices += position
+                if primitive.get("mode", 4) == 4:
+                    if "indices" in primitive:
+                        faces += _accessor_count(accessors, primitive["indices"]) // 3
+                    else:
+                        faces += position // 3
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        # Lists or numbers where objects belong raise AttributeError on .get
+        raise InvalidInput(f"GLB mesh references a missing or malformed accessor: {e!r}")
+
+    if faces == 0:
+        raise InvalidInput("GLB file contains no triangle meshes")
+
+    return {"version": version, "length": length, "vertices": vertices, "faces": faces}
+
+def _png_size(data):
+    # 8-byte signature, then the IHDR chunk: length, type, width, height
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        raise InvalidInput("PNG file is truncated or has no IHDR chunk")
+    return struct.unpack('>II', data[16:24])
+
+def _jpeg_size(data):
+    # Walk the marker segments until a start-of-frame marker, which holds the size
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            raise InvalidInput("JPEG file is corrupt")
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        (segment_length,) = struct.unpack('>H', data[i + 2:i + 4])
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if i + 9 > len(data):
+                break
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        i += 2 + segment_length
+    raise InvalidInput(f"No JPEG frame header in the first {len(data)} bytes")
+
+def probe_image(data):
+    """
+    Identify a PNG or JPEG image and read its dimensions from its first bytes.
+
+    Parameters:
+    data (bytes): Start of the file, IMAGE_PROBE_BYTES is enough for common files
+
+    Returns:
+    dict: format ("png" or "jpeg"), width and height
+
+    Raises:
+    InvalidInput: If the image is not a readable PNG or JPEG
+    """
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        fmt, (width, height) = "png", _png_size(data)
+    elif data.startswith(b"\xff\xd8"):
+        fmt, (width, height) = "jpeg", _jpeg_size(data)
+    else:
+        raise InvalidInput("Image must be a PNG or JPEG file")
+
+    if width == 0 or height == 0:
+        raise InvalidInput("Image has zero width or height")
+    return {"format": fmt, "width": width, "height": height}
+
+def _stream_size(stream):
+    try:
+        position = stream.tell()
+        stream.seek(0, 2)
+        size = stream.tell()
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+def validate_uploads(glb_stream, image_stream, max_image_pixels=None):
+    """
+    Validate an uploaded GLB and image, rewinding both streams afterwards.
+
+    Parameters:
+    glb_stream (file-like): Seekable stream of the GLB upload
+    image_stream (file-like): Seekable stream of the image upload
+    max_image_pixels (int): Largest accepted width * height, None for no limit
+
+    Returns:
+    tuple: (glb info from probe_glb, image info from probe_image)
+    """
+    try:
+        glb_info = probe_glb(glb_stream, _stream_size(glb_stream))
+    finally:
+        glb_stream.seek(0)
+
+    try:
+        image_info = probe_image(image_stream.read(IMAGE_PROBE_BYTES))
+    finally:
+        image_stream.seek(0)
+
+    if max_image_pixels is not None and image_info["width"] * image_info["height"] > max_image_pixels:
+        raise InvalidInput(f"Image of {image_info['width']}x{image_info['height']} exceeds "
+                           f"the limit of {max_image_pixels} pixels")
+    return glb_info, image_info
@@ -0,0 +1,263 @@
+import json
+import os
+import shutil
+import time
+import uuid
+
+# Background pipeline jobs with progress reported as Server-Sent Events.
+#
+# Each job is a directory under JOB_DIR holding an append-only events.jsonl written by
+# the thread running the job, the result zip once it is ready, and a "cancel" marker set
+# by clients that abort the job. Everything is on disk, so any server worker process can
+# stream the events of a job, serve its result or cancel it.
+#
+#   <id>/events.jsonl   one JSON event per line: stage, then done, error or cancelled
+#   <id>/result.zip     the person and electrode files, written by the job
+#   <id>/cancel         present once a client cancelled the job
+#   <id>/profile.pstats or profile.collapsed
+#                       profile of the run, for jobs submitted with profiling on
+
+JOB_DIR = "cache/jobs"
+# Finished jobs beyond this many are removed, least recently active first. Unfinished
+# jobs are never evicted, the admission controller already bounds how many there are.
+MAX_JOBS = 64
+# Finished jobs and their results are removed after this many seconds
+JOB_TTL_SECONDS = 30 * 60
+# Unfinished jobs with no event for this many seconds were left behind by a worker
+# that died, and are removed too
+ABANDONED_JOB_SECONDS = 6 * 60 * 60
+
+# How often an event stream checks for new events, and sends a comment to keep
+# proxies from closing an idle connection
+EVENT_POLL_SECONDS = 0.2
+KEEPALIVE_SECONDS = 15
+
+# Human readable name of each pipeline stage, sent with its event
+STAGE_LABELS = {
+    "validate": "validated",
+    "save": "uploaded",
+    "queue": "started",
+    "landmarks": "landmarks found",
+    "convert": "converted",
+    "orient": "oriented",
+    "align": "aligned",
+    "layout": "rays cast",
+    "export": "exported",
+}
+
+TERMINAL_EVENTS = ("done", "error", "cancelled")
+
+class JobCancelled(Exception):
+    """
+    Raised between stages of a job a client has cancelled.
+    """
+
+class Job:
+    """
+    Handle on the directory of one job. Only the thread running the job writes events.
+    """
+
+    def __init__(self, job_id, job_dir=JOB_DIR):
+        self.id = job_id
+        self.path = os.path.join(job_dir, job_id)
+        self.events_path = os.path.join(self.path, "events.jsonl")
+        self.result_path = os.path.join(self.path, "result.zip")
+        self.cancel_path = os.path.join(self.path, "cancel")
+        self.start = time.monotonic()
+
+    @classmethod
+    def create(cls, job_dir=JOB_DIR, max_jobs=MAX_JOBS, ttl_seconds=JOB_TTL_SECONDS):
+        os.makedirs(job_dir, exist_ok=True)
+        remove_expired_jobs(job_dir, ttl_seconds)
+        job = cls(uuid.uuid4().hex, job_dir)
+        os.makedirs(job.path)
+        open(job.events_path, 'w').close()
+        evict_finished_jobs(job_dir, max_jobs)
+        return job
+
+    @classmethod
+    def open(cls, job_id, job_dir=JOB_DIR):
+        """
+        Return the job with this id, or None if it is unknown or was removed.
+        """
+        if not job_id or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        job = cls(job_id, job_dir)
+        return job if os.path.isfile(job.events_path) else None
+
+    def emit(self, event, **data):
+        record = {"event": event, "elapsed": round(time.monotonic() - self.start, 3), **data}
+        with open(self.events_path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+    def stage_listener(self, name, seconds):
+        """
+        StageTimings listener: report the finished stage and stop if the job was cancelled.
+        """
+        self.emit("stage", stage=name, label=STAGE_LABELS.get(name, name), duration=round(seconds, 3))
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def cancel(self):
+        open(self.cancel_path, 'w').close()
+
+    @property
+    def cancelled(self):
+        return os.path.exists(self.cancel_path)
+
+    def read_events(self, offset=0):
+        """
+        Read the complete events written after byte offset.
+
+        Returns:
+        tuple: (list of events, offset to continue from)
+        """
+        try:
+            with open(self.events_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return [], offset
+        # The last line may still be being written
+        complete = data[:data.rfind(b"\n") + 1]
+        events = [json.loads(line) for line in complete.splitlines() if line]
+        return events, offset + len(complete)
+
+    def status(self):
+        """
+        The last event of the job, or None if it has not started yet.
+        """
+        events, _ = self.read_events()
+        return events[-1] if events else None
+
+    @property
+    def finished(self):
+        status = self.status()
+        return status is not None and status["event"] in TERMINAL_EVENTS
+
+    @property
+    def last_active(self):
+        # Time of the job's last event (or of its creation), None once it was removed.
+        # Serving the result or the profile does not count, only the job's own progress.
+        try:
+            return os.path.getmtime(self.events_path)
+        except OSError:
+            return None
+
+    def write_result(self, chunks):
+        # Write to a hidden file and rename it into place, so a half-written zip is never served
+        tmp_path = os.path.join(self.path, ".result.zip")
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, self.result_path)
+
+    def write_profile(self, profiler):
+        """
+        Save a request_profiling.RequestProfiler of the run with the job.
+        """
+        return profiler.write(os.path.join(self.path, "profile" + profiler.suffix))
+
+    @property
+    def profile_path(self):
+        # The saved profile, None if the job was not profiled
+        for name in ("profile.pstats", "profile.collapsed"):
+            path = os.path.join(self.path, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def _list_jobs(job_dir):
+    # Jobs of job_dir with the time of their last event
+    jobs = []
+    for name in os.listdir(job_dir):
+        if name.startswith('.'):
+            continue
+        job = Job(name, job_dir)
+        last_active = job.last_active
+        if last_active is not None:
+            jobs.append((last_active, job))
+    return jobs
+
+def remove_expired_jobs(job_dir=JOB_DIR, ttl_seconds=JOB_TTL_SECONDS,
+                        abandoned_seconds=ABANDONED_JOB_SECONDS):
+    """
+    Remove the finished jobs whose last event is older than ttl_seconds, and the
+    unfinished ones that have not progressed for abandoned_seconds.
+    """
+    now = time.time()
+    for last_active, job in _list_jobs(job_dir):
+        idle = now - last_active
+        if idle > abandoned_seconds or (idle > ttl_seconds and job.finished):
+            job.remove()
+
+def evict_finished_jobs(job_dir=JOB_DIR, max_jobs=MAX_JOBS):
+    """
+    Remove the finished jobs with the oldest last event until at most max_jobs jobs
+    remain. A job's directory mtime only changes when files are added to it, so the
+    clock is the mtime of its events.jsonl. Running or queued jobs are kept even if
+    that leaves more than max_jobs.
+
+    Returns:
+    list: Ids of the removed jobs
+    """
+    if max_jobs is None:
+        return []
+    jobs = _list_jobs(job_dir)
+    excess = len(jobs) - max_jobs
+    removed = []
+    for _, job in sorted(jobs, key=lambda entry: entry[0]):
+        if len(removed) >= excess:
+            break
+        if job.finished:
+            job.remove()
+            removed.append(job.id)
+    return removed
+
+def format_sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+def iter_sse(job, last_event_id=None, timeout=None):
+    """
+    Stream the events of a job as Server-Sent Events until it finishes.
+
+    Parameters:
+    job (Job): Job to follow
+    last_event_id (str): Last-Event-ID sent by a reconnecting client, earlier events are skipped
+    timeout (float): Stop after this many seconds, None to follow the job to its end
+
+    Yields:
+    str: SSE messages, with the event's position in the job as its id
+    """
+    skip = int(last_event_id) + 1 if last_event_id is not None and last_event_id.isdigit() else 0
+    index = 0
+    offset = 0
+    start = last_sent = time.monotonic()
+    while True:
+        events, offset = job.read_events(offset)
+        for event in events:
+            if index >= skip:
+                yield format_sse(event["event"], event, event_id=index)
+                last_sent = time.monotonic()
+            index += 1
+            if event["event"] in TERMINAL_EVENTS:
+                return
+
+        now = time.monotonic()
+        if timeout is not None and now - start > timeout:
+            return
+        if not os.path.isdir(job.path):
+            yield format_sse("error", {"event": "error", "status": 410, "error": "Job was removed"})
+            return
+        if now - last_sent > KEEPALIVE_SECONDS:
+            yield ": keepalive\n\n"
+            last_sent = now
+        time.sleep(EVENT_POLL_SECONDS)
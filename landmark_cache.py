@@ -0,0 +1,76 @@
+import os
+import tempfile
+import numpy as np
+from cache_utils import file_sha256, cache_key, touch, evict_lru
+
+# Persistent cache of the 68 facial landmarks and the 4 derived reference points.
+# Entries are keyed by the image content, the landmark model version and the version
+# of the reference-point derivation, so a re-upload of the same photo skips neural
+# inference entirely.
+
+CACHE_DIR = "cache/landmarks"
+MAX_ENTRIES = 512
+
+def image_cache_key(image_file_path, model_version, reference_version):
+    """
+    Build the cache key for an image.
+
+    Parameters:
+    image_file_path (str): Path to the portrait image
+    model_version (str): Identifier of the landmark model that produced the points
+    reference_version (int): Version of the reference-point derivation
+                             (reference_points.REFERENCE_POINTS_VERSION)
+
+    Returns:
+    str: Key used to name the cache entry
+    """
+    return cache_key(file_sha256(image_file_path), model_version, reference_version)
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, f"{key}.npz")
+
+def load_landmarks(key, cache_dir=CACHE_DIR):
+    """
+    Look up a cached entry.
+
+    Returns:
+    tuple or None: (landmarks (68, 3), reference_points (4, 3)) on a hit, None on a miss
+    """
+    path = _entry_path(key, cache_dir)
+    try:
+        with np.load(path) as data:
+            landmarks = data["landmarks"]
+            reference_points = data["reference_points"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+    touch(path)
+    print(f"Landmark cache hit: {key[:12]}")
+    return landmarks, reference_points
+
+def store_landmarks(key, landmarks, reference_points, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+    """
+    Store the landmarks and reference points of an image, then evict the least
+    recently used entries beyond max_entries.
+
+    Parameters:
+    key (str): Key from image_cache_key
+    landmarks (array): (68, 3) landmarks of the first detected face
+    reference_points (array): (4, 3) nasion, left preauricular, right preauricular, inion
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write to a hidden temporary file and rename, so readers never see a partial entry.
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".npz", dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f,
+                     landmarks=np.asarray(landmarks, dtype=np.float32),
+                     reference_points=np.asarray(reference_points, dtype=np.float64))
+        os.replace(tmp_path, _entry_path(key, cache_dir))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    evict_lru(cache_dir, max_entries)
@@ -1,9 +1,34 @@
+import os
+import threading
 import face_alignment
 import numpy as np
 from skimage import io
 
+# Identifies the model behind the landmarks, used to key the landmark cache.
+# Bump the suffix if the landmark type or post-processing changes.
+LANDMARK_MODEL_VERSION = f"face_alignment-{getattr(face_alignment, '__version__', 'unknown')}-3D"
+
+class NoFaceDetected(ValueError):
+    """
+    Raised when the face-alignment model finds no face in the image.
+    """
+
+# Device the face-alignment model runs on
+LANDMARK_DEVICE = os.environ.get("EEG_LANDMARK_DEVICE", "mps")
+
+# Loaded face-alignment models by device. Loading takes seconds, so the model is created
+# once per process (or once before forking, see gunicorn.conf.py) and reused.
+_models = {}
+_models_lock = threading.Lock()
+
+def landmark_model(device=LANDMARK_DEVICE):
+    with _models_lock:
+        if device not in _models:
+            _models[device] = face_alignment.FaceAlignment(face_alignment.LandmarksType.THREE_D, device=device)
+        return _models[device]
+
 def find_landmarks(filename="000002.jpg"):
-    fa = face_alignment.FaceAlignment(face_alignment.LandmarksType.THREE_D, device='mps')
+    fa = landmark_model()
     input = io.imread(filename)
     preds = fa.get_landmarks(input)
 
@@ -22,18 +47,11 @@ def find_landmarks(filename="000002.jpg"):
         print(np.array2string(landmarks_3d, precision=2, separator=', '))
     else:
         print("No face detected in the image.")
-
-    #Save landmarks to .xyz file
-    save_to_xyz(preds, "landmarks.xyz")
+        raise NoFaceDetected(f"No face detected in {filename}")
 
     #Return the landmarks
     return preds
 
 
 
-    print("Success!")
-
-def save_to_xyz(preds, filename="landmarks.xyz"):
-    # Extract first detected face (shape: (68, 3) for 3D landmarks)
-    single_face_landmarks = preds[0]  # 2D array
-    np.savetxt(filename, single_face_landmarks, fmt="%.6f")
\ No newline at end of file
+    print("Success!")
\ No newline at end of file
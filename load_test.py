@@ -0,0 +1,276 @@
+import argparse
+import itertools
+import json
+import os
+import shlex
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from stage_timing import parse_server_timing
+from batch import find_input_pairs
+
+# Load generator for the /upload endpoint. Replays the scan + photo pairs of input_gltf
+# and input_png against a running (or locally started) server and reports throughput,
+# latency percentiles, error rates and the per-stage timings the server returns in its
+# Server-Timing header.
+#
+#   closed loop: --concurrency clients, each sending its next request when the previous
+#                one finished. Measures the throughput the server sustains.
+#   open loop:   requests arrive at --rate per second (Poisson arrivals) regardless of
+#                how fast they complete. Latency is measured from the scheduled arrival
+#                time, so queueing in the client is not hidden.
+#
+# Example:
+#   python load_test.py --start-server "gunicorn -c gunicorn.conf.py server:app" --concurrency 4 --requests 40
+
+DEFAULT_URL = "http://127.0.0.1:8080"
+
+def encode_multipart(fields, files):
+    """
+    Build a multipart/form-data body.
+
+    Parameters:
+    fields (dict): Form field name -> string value
+    files (dict): Form field name -> (file name, bytes)
+
+    Returns:
+    tuple: (body bytes, Content-Type header value)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+def build_requests(pairs, fields):
+    # Upload bodies are built once and replayed, so the client spends no time on them
+    bodies = []
+    for glb_path, image_path in pairs:
+        with open(glb_path, 'rb') as f:
+            glb = f.read()
+        with open(image_path, 'rb') as f:
+            image = f.read()
+        bodies.append(encode_multipart(fields, {"file_glb": (os.path.basename(glb_path), glb),
+                                                "file_png": (os.path.basename(image_path), image)}))
+    return bodies
+
+def send_upload(url, body, content_type, timeout, started=None):
+    """
+    POST one upload and read the whole response.
+
+    Parameters:
+    started (float): time.perf_counter() the request was due, defaults to now
+
+    Returns:
+    dict: status (0 on a connection error), latency in seconds, response bytes,
+          stage timings from Server-Timing and the error message, if any
+    """
+    if started is None:
+        started = time.perf_counter()
+    request = urllib.request.Request(url.rstrip("/") + "/upload", data=body, method="POST",
+                                     headers={"Content-Type": content_type, "Accept-Encoding": "gzip"})
+    result = {"status": 0, "bytes": 0, "stages": {}, "error": None}
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            result["status"] = response.status
+            result["stages"] = parse_server_timing(response.headers.get("Server-Timing"))
+            for chunk in iter(lambda: response.read(1 << 16), b''):
+                result["bytes"] += len(chunk)
+    except urllib.error.HTTPError as e:
+        result["status"] = e.code
+        result["error"] = e.read(200).decode(errors="replace")
+    except (urllib.error.URLError, OSError) as e:
+        result["error"] = str(e)
+    result["latency"] = time.perf_counter() - started
+    return result
+
+def run_closed_loop(url, bodies, concurrency, n_requests=None, duration=None, timeout=600):
+    """
+    concurrency clients send requests back to back until n_requests were sent or
+    duration seconds passed.
+
+    Returns:
+    list: Results of send_upload
+    """
+    results = []
+    lock = threading.Lock()
+    counter = iter(range(n_requests)) if n_requests is not None else itertools.count()
+    deadline = None if duration is None else time.perf_counter() + duration
+
+    def client():
+        while deadline is None or time.perf_counter() < deadline:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            body, content_type = bodies[i % len(bodies)]
+            result = send_upload(url, body, content_type, timeout)
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def run_open_loop(url, bodies, rate, n_requests=None, duration=None, timeout=600, max_in_flight=256, seed=0):
+    """
+    Send requests with exponentially distributed gaps averaging 1 / rate seconds,
+    independent of how fast the server answers.
+
+    Returns:
+    list: Results of send_upload
+    """
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        due = start
+        i = 0
+        while (n_requests is None or i < n_requests) and (duration is None or due - start < duration):
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            body, content_type = bodies[i % len(bodies)]
+            futures.append(pool.submit(send_upload, url, body, content_type, timeout, due))
+            due += rng.exponential(1.0 / rate)
+            i += 1
+    return [f.result() for f in futures]
+
+def summarize(results, elapsed):
+    """
+    Aggregate the results of a run.
+
+    Returns:
+    dict: Request counts, throughput, latency percentiles of successful requests,
+          error rate, counts per status and per-stage timing statistics
+    """
+    ok = [r for r in results if 200 <= r["status"] < 300]
+    latencies = np.array([r["latency"] for r in ok])
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+
+    stages = {}
+    for r in ok:
+        for name, seconds in r["stages"].items():
+            stages.setdefault(name, []).append(seconds)
+
+    summary = {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed > 0 else 0.0,
+        "error_rate": 1 - len(ok) / len(results) if results else 0.0,
+        "statuses": statuses,
+        "response_mb": sum(r["bytes"] for r in ok) / 2**20,
+        "stages": {name: {"mean_s": float(np.mean(v)), "p50_s": float(np.percentile(v, 50)),
+                          "p95_s": float(np.percentile(v, 95))} for name, v in stages.items()},
+    }
+    if len(latencies):
+        summary["latency_s"] = {"mean": float(latencies.mean()),
+                                **{f"p{q}": float(np.percentile(latencies, q)) for q in (50, 95, 99)},
+                                "max": float(latencies.max())}
+    return summary
+
+def print_summary(summary):
+    print(f"\n{summary['requests']} requests in {summary['elapsed_s']:.1f}s, "
+          f"{summary['succeeded']} succeeded ({summary['error_rate']:.1%} errors)")
+    print(f"Throughput: {summary['throughput_rps']:.3f} requests/s, {summary['response_mb']:.1f} MiB received")
+    print("Statuses: " + ", ".join(f"{status}: {count}" for status, count in sorted(summary["statuses"].items())))
+    if "latency_s" in summary:
+        print("Latency: " + ", ".join(f"{name} {value:.2f}s" for name, value in summary["latency_s"].items()))
+    if summary["stages"]:
+        print("\nServer stage     mean      p50      p95")
+        for name, stats in summary["stages"].items():
+            print(f"{name:<12} {stats['mean_s']:8.3f} {stats['p50_s']:8.3f} {stats['p95_s']:8.3f}")
+
+def start_server(command, url, startup_timeout=120):
+    """
+    Start the server with a shell-style command and wait until it answers on url.
+
+    Returns:
+    subprocess.Popen: The server process
+    """
+    process = subprocess.Popen(shlex.split(command))
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode} during startup")
+        try:
+            urllib.request.urlopen(url, timeout=2).close()
+            return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"Server did not answer on {url} within {startup_timeout}s")
+
+def stop_server(process, timeout=150):
+    # SIGTERM drains running requests, see server.py and gunicorn.conf.py
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the /upload endpoint")
+    parser.add_argument("--url", default=DEFAULT_URL, help="Server base URL")
+    parser.add_argument("--start-server", metavar="COMMAND",
+                        help='Start the server first, e.g. "gunicorn -c gunicorn.conf.py server:app"')
+    parser.add_argument("--concurrency", type=int, default=2, help="Closed loop: number of concurrent clients")
+    parser.add_argument("--rate", type=float, help="Open loop: arrivals per second (overrides --concurrency)")
+    parser.add_argument("--requests", type=int, help="Number of requests to send")
+    parser.add_argument("--duration", type=float, help="Seconds to keep sending (default: 20 requests)")
+    parser.add_argument("--glb-dir", default="input_gltf")
+    parser.add_argument("--png-dir", default="input_png")
+    parser.add_argument("--format", default="stl", help="Output format requested from the server")
+    parser.add_argument("--montage", help="Montage requested from the server")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout in seconds")
+    parser.add_argument("--warmup", type=int, default=0, help="Requests sent and discarded before measuring")
+    parser.add_argument("--json", metavar="PATH", help="Also write the summary as JSON")
+    args = parser.parse_args()
+
+    if args.requests is None and args.duration is None:
+        args.requests = 20
+
+    pairs = find_input_pairs(args.glb_dir, args.png_dir)
+    if not pairs:
+        parser.error(f"No GLB/image pairs found in {args.glb_dir} and {args.png_dir}")
+    fields = {"format": args.format}
+    if args.montage:
+        fields["montage"] = args.montage
+    bodies = build_requests(pairs, fields)
+    print(f"Replaying {len(pairs)} input pairs against {args.url}")
+
+    server = start_server(args.start_server, args.url) if args.start_server else None
+    try:
+        if args.warmup:
+            run_closed_loop(args.url, bodies, args.concurrency, n_requests=args.warmup, timeout=args.timeout)
+
+        start = time.perf_counter()
+        if args.rate:
+            results = run_open_loop(args.url, bodies, args.rate, args.requests, args.duration, args.timeout)
+        else:
+            results = run_closed_loop(args.url, bodies, args.concurrency, args.requests, args.duration, args.timeout)
+        summary = summarize(results, time.perf_counter() - start)
+        summary["mode"] = {"rate": args.rate} if args.rate else {"concurrency": args.concurrency}
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
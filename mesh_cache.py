@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from cache_utils import file_sha256, cache_key, touch, evict_lru
+
+# Cache of parsed, oriented head meshes keyed by the GLB content hash.
+# Each entry is a directory holding raw float32 vertices and int32 faces, opened
+# with np.memmap on later runs, plus the orientation results in meta.json:
+#   <key>/vertices.f32   (n, 3) float32, oriented
+#   <key>/faces.i32      (m, 3) int32
+#   <key>/profile.npz    cross-section profile of the oriented mesh (head_profile)
+#   <key>/meta.json      shapes, neck height, orientation transform, nose, back of head,
+#                        anatomy levels
+
+CACHE_DIR = "cache/meshes"
+MAX_ENTRIES = 64
+
+# Bump when the orientation logic changes so stale geometry is not reused.
+MESH_CACHE_VERSION = 5
+
+def glb_cache_key(glb_file_path):
+    """
+    Build the cache key for a GLB scan from its contents.
+    """
+    return cache_key(file_sha256(glb_file_path), MESH_CACHE_VERSION)
+
+def load_head_mesh(key, cache_dir=CACHE_DIR):
+    """
+    Open a cached head mesh without parsing or copying it.
+
+    Returns:
+    dict or None: Same layout as reference_point_scaling.prepare_head_mesh (without
+                  "path"), with read-only memory-mapped vertices and faces. None on a miss.
+    """
+    entry = os.path.join(cache_dir, key)
+    try:
+        with open(os.path.join(entry, "meta.json")) as f:
+            meta = json.load(f)
+        vertices = np.memmap(os.path.join(entry, "vertices.f32"), dtype=np.float32,
+                             mode='r', shape=tuple(meta["vertices_shape"]))
+        faces = np.memmap(os.path.join(entry, "faces.i32"), dtype=np.int32,
+                          mode='r', shape=tuple(meta["faces_shape"]))
+        with np.load(os.path.join(entry, "profile.npz")) as arrays:
+            profile = {name: arrays[name] for name in arrays.files}
+        profile["slice_height"] = float(profile["slice_height"])
+        anatomy = dict(meta["anatomy"], ear_band=tuple(meta["anatomy"]["ear_band"]))
+    except (OSError, ValueError, KeyError):
+        return None
+
+    touch(entry)
+    print(f"Mesh cache hit: {key[:12]} ({meta['vertices_shape'][0]} vertices)")
+
+    return {
+        "vertices": vertices,
+        "faces": faces,
+        "neck_height": meta["neck_height"],
+        "transform": np.array(meta["transform"]),
+        "nose": np.array(meta["nose"]),
+        "back_head": np.array(meta["back_head"]),
+        "profile": profile,
+        "anatomy": anatomy,
+    }
+
+def store_head_mesh(key, head, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+    """
+    Store an oriented head mesh, then evict least recently used entries.
+
+    Parameters:
+    key (str): Key from glb_cache_key
+    head (dict): Output of reference_point_scaling.prepare_head_mesh
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = os.path.join(cache_dir, key)
+    if os.path.isdir(entry):
+        return entry
+
+    vertices = np.ascontiguousarray(head["vertices"], dtype=np.float32)
+    faces = np.ascontiguousarray(head["faces"], dtype=np.int32)
+    meta = {
+        "vertices_shape": list(vertices.shape),
+        "faces_shape": list(faces.shape),
+        "neck_height": float(head["neck_height"]),
+        "transform": np.asarray(head["transform"], dtype=float).tolist(),
+        "nose": np.asarray(head["nose"], dtype=float).tolist(),
+        "back_head": np.asarray(head["back_head"], dtype=float).tolist(),
+        "anatomy": head["anatomy"],
+    }
+
+    # Build the entry in a hidden directory and rename it into place in one step.
+    tmp_entry = tempfile.mkdtemp(prefix=".", dir=cache_dir)
+    try:
+        vertices.tofile(os.path.join(tmp_entry, "vertices.f32"))
+        faces.tofile(os.path.join(tmp_entry, "faces.i32"))
+        np.savez(os.path.join(tmp_entry, "profile.npz"), **head["profile"])
+        with open(os.path.join(tmp_entry, "meta.json"), 'w') as f:
+            json.dump(meta, f)
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another process stored the same scan first.
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        if not os.path.isdir(entry):
+            raise
+
+    evict_lru(cache_dir, max_entries)
+    return entry
@@ -1,18 +1,20 @@
+import weakref
 import numpy as np
 from scipy.spatial import KDTree
 import trimesh
+from compact_mesh import CompactMesh
+from point_sets import PointSet, as_reference_points
 import os
-import re
 
 def display_landmarks_only(xyz_file_path, sphere_radius=0.01, intermediate_ratio=0.75, output_path="landmarks_only.stl"):
     """
-    Reads landmarks from an XYZ file and creates a visualization with 9 total landmarks:
+    Reads the reference points and creates a visualization with 9 total landmarks:
     - 4 original landmarks (red)
     - 1 center landmark/centroid (yellow)
     - 4 intermediate landmarks between each original and the center (blue)
     
     Parameters:
-    xyz_file_path (str): Path to the .xyz file containing the landmark points
+    xyz_file_path (str or PointSet): Reference points, or a point set file (.npz or .xyz) holding them
     sphere_radius (float): Radius of the spheres representing landmarks (default: 0.01)
     intermediate_ratio (float): Determines position of intermediate landmarks between 
                                original landmarks and center (0.5 = halfway)
@@ -21,32 +23,7 @@ def display_landmarks_only(xyz_file_path, sphere_radius=0.01, intermediate_ratio
     Returns:
     str: Path to the saved STL file
     """
-    try:
-        # Read the xyz file as a single line of text
-        with open(xyz_file_path, 'r') as f:
-            content = f.read().strip()
-        
-        # Parse the coordinates - Extract all floating point numbers
-        coords = re.findall(r'-?\d+\.\d+e[+-]\d+|\d+\.\d+', content)
-        
-        # Convert to floats
-        coords = [float(x) for x in coords]
-        
-        # We expect exactly 12 values (4 points × 3 coordinates)
-        if len(coords) != 12:
-            raise ValueError(f"Expected 12 coordinate values (4 points × 3 coordinates). Found {len(coords)}")
-            
-        # Reshape into 4 points with 3 coordinates each
-        original_points = np.array(coords).reshape(4, 3)
-        
-        print(f"Successfully loaded 4 landmark points from {xyz_file_path}")
-        print("Original landmarks:")
-        for i, point in enumerate(original_points):
-            print(f"Point {i+1}: {point}")
-        
-    except Exception as e:
-        print(f"Error loading XYZ file: {e}")
-        raise
+    original_points = read_reference_points(xyz_file_path).points
     
     # Calculate the center point (centroid) of all original landmarks
     center_point = np.mean(original_points, axis=0)
@@ -93,173 +70,143 @@ def display_landmarks_only(xyz_file_path, sphere_radius=0.01, intermediate_ratio
     
     return output_path
 
-def shift_centered_with_central_target(xyz_file_path, head_mesh_file, electrode_file="electrode.stl", sphere_radius=0.01, intermediate_ratio=0.75, output_path="head_with_electrodes_pointing_center.stl"):
+# Default concentric ring layout, as (radius ratio of the outer radius, electrode count, skip bottom).
+# The outer ring leaves out electrodes where the z component would be strongly negative.
+DEFAULT_RINGS = ((0.3, 4, False), (0.55, 8, False), (0.8, 7, True))
+
+# Distance the electrodes are moved outward from the scalp, and the central target above the center.
+DEFAULT_OUTWARD_OFFSET = 0.02
+DEFAULT_CENTRAL_OFFSET = 0.025
+
+def load_electrode_template(electrode_file="electrode.stl"):
     """
-    Creates a symmetric electrode layout with a central electrode and concentric rings of electrodes.
-    All peripheral electrodes are oriented to point towards the central electrode.
-    Original landmarks are hidden but used to define the head boundary.
-    
-    Parameters:
-    xyz_file_path (str): Path to the .xyz file containing the landmark points
-    head_mesh_file (str): Path to the head mesh file
-    electrode_file (str): Path to the electrode STL file to use
-    sphere_radius (float): Radius of the spheres representing landmarks (default: 0.01)
-    intermediate_ratio (float): Determines position of intermediate landmarks between 
-                               original landmarks and center (0.75 = 75% toward center)
-    output_path (str): File path to save the resulting STL file
-    
-    Returns:
-    str: Path to the saved STL file
+    Load the unscaled electrode model. Use scale_electrode_template to size it.
     """
-    try:
-        # Read the xyz file as a single line of text
-        with open(xyz_file_path, 'r') as f:
-            content = f.read().strip()
-        
-        # Parse the coordinates - Extract all floating point numbers
-        coords = re.findall(r'-?\d+\.\d+e[+-]\d+|\d+\.\d+', content)
-        
-        # Convert to floats
-        coords = [float(x) for x in coords]
-        
-        # We expect exactly 12 values (4 points × 3 coordinates)
-        if len(coords) != 12:
-            raise ValueError(f"Expected 12 coordinate values (4 points × 3 coordinates). Found {len(coords)}")
-            
-        # Reshape into 4 points with 3 coordinates each
-        original_points = np.array(coords).reshape(4, 3)
-        
-        print(f"Successfully loaded 4 landmark points from {xyz_file_path}")
-        print("Original landmarks (will be hidden):")
-        for i, point in enumerate(original_points):
-            print(f"Point {i+1}: {point}")
-        
-    except Exception as e:
-        print(f"Error loading XYZ file: {e}")
-        raise
-    
-    # Load the head mesh
-    try:
-        head_mesh = trimesh.load(head_mesh_file)
-        print(f"Successfully loaded head mesh from {head_mesh_file}")
-    except Exception as e:
-        print(f"Error loading head mesh: {e}")
-        raise
-    
-    # Load the electrode model
     try:
         electrode_mesh = trimesh.load(electrode_file)
         print(f"Successfully loaded electrode model from {electrode_file}")
-        
-        # Scale the electrode to an appropriate size
-        # Calculate the bounding box of the electrode
-        electrode_extents = electrode_mesh.bounding_box.extents
-        # Set a target size for the longest dimension
-        target_size = sphere_radius * 1.5
-        # Calculate scale factor
-        scale_factor = target_size / max(electrode_extents)
-        # Apply scaling to the electrode mesh
-        electrode_mesh.apply_scale(scale_factor)
-        
     except Exception as e:
         print(f"Error loading electrode model: {e}")
         raise
-    
-    # Calculate the central point (centroid) of all original landmarks
-    center_point = np.mean(original_points, axis=0)
-    print(f"Calculated center point: {center_point}")
-    
-    # Compute distances from center to establish the outer radius
-    distances = [np.linalg.norm(point - center_point) for point in original_points]
-    outer_radius = np.mean(distances)
-    
-    # Create a symmetrical electrode layout with multiple concentric rings
+    return electrode_mesh
+
+_electrode_templates = {}
+
+def cached_electrode_template(electrode_file="electrode.stl"):
+    """
+    Load the electrode model once per process and share it. Callers must not modify
+    the returned mesh; scale_electrode_template works on a copy.
+    """
+    if electrode_file not in _electrode_templates:
+        _electrode_templates[electrode_file] = load_electrode_template(electrode_file)
+    return _electrode_templates[electrode_file]
+
+def scale_electrode_template(electrode_template, sphere_radius=0.01):
+    """
+    Return a copy of the electrode model scaled so its longest dimension is 1.5 * sphere_radius.
+    """
+    electrode_mesh = electrode_template.copy()
+
+    # Calculate the bounding box of the electrode
+    electrode_extents = electrode_mesh.bounding_box.extents
+    # Set a target size for the longest dimension
+    target_size = sphere_radius * 1.5
+    # Calculate scale factor
+    scale_factor = target_size / max(electrode_extents)
+    # Apply scaling to the electrode mesh
+    electrode_mesh.apply_scale(scale_factor)
+    return electrode_mesh
+
+def ring_points(center_point, outer_radius, rings=DEFAULT_RINGS):
+    """
+    Lay out concentric rings of points in the xz-plane around center_point.
+
+    Parameters:
+    center_point (array): Center of the layout
+    outer_radius (float): Mean distance of the reference points from the center
+    rings (sequence): (radius ratio, count, skip bottom) for each ring, innermost first
+
+    Returns:
+    list: Points of all rings, innermost ring first
+    """
     all_points = []
-    
-    # Inner ring (closest to center) - 4 electrodes at 90° intervals
-    inner_ring_radius = outer_radius * 0.3
-    inner_ring_points = []
-    for i in range(4):
-        angle = 2 * np.pi * i / 4
-        x_offset = inner_ring_radius * np.cos(angle)
-        z_offset = inner_ring_radius * np.sin(angle)
-        new_point = center_point + np.array([x_offset, 0, z_offset])
-        inner_ring_points.append(new_point)
-    all_points.extend(inner_ring_points)
-    
-    # Middle ring - 8 electrodes at 45° intervals
-    middle_ring_radius = outer_radius * 0.55
-    middle_ring_points = []
-    for i in range(8):
-        angle = 2 * np.pi * i / 8
-        x_offset = middle_ring_radius * np.cos(angle)
-        z_offset = middle_ring_radius * np.sin(angle)
-        new_point = center_point + np.array([x_offset, 0, z_offset])
-        middle_ring_points.append(new_point)
-    all_points.extend(middle_ring_points)
-    
-    # Outer ring - 8 electrodes at 45° intervals but none at the bottom
-    outer_ring_radius = outer_radius * 0.8
-    outer_ring_points = []
-    for i in range(7):  # Reduced from 8 to 7 to avoid placing one at the bottom
-        angle = 2 * np.pi * i / 7  # Adjusted divisor to ensure even spacing
-        
-        # Skip any angles that would place an electrode at the bottom
-        # This is roughly where z component would be strongly negative
-        if -0.5 < np.sin(angle) < 0.9:  # Only place electrodes where z isn't too negative
-            x_offset = outer_ring_radius * np.cos(angle)
-            z_offset = outer_ring_radius * np.sin(angle)
-            new_point = center_point + np.array([x_offset, 0, z_offset])
-            outer_ring_points.append(new_point)
-    
-    all_points.extend(outer_ring_points)
-    
-    print(f"Created a total of {len(all_points)} electrode points in a symmetric arrangement (excluding central target)")
-    
-    # Function to shift a point along the Y-axis until it reaches the mesh
-    def shift_along_y_until_intersection(point):
-        # Create a ray starting from the point in the positive Y-direction
-        ray_origin = point
-        ray_direction = np.array([0.0, 1.0, 0.0])  # Positive Y-direction
-        
-        # Use trimesh's ray-mesh intersection
-        intersections, index_ray, index_tri = head_mesh.ray.intersects_location(
-            ray_origins=[ray_origin],
-            ray_directions=[ray_direction]
-        )
-        
-        if len(intersections) > 0:
-            # Calculate distances from origin to each intersection
-            distances = np.linalg.norm(intersections - ray_origin, axis=1)
-            # Get the closest intersection (in case there are multiple)
-            closest_idx = np.argmin(distances)
-            return intersections[closest_idx]
-        else:
-            # If no intersection found, return original point
-            print(f"Warning: No intersection found for point {point} when projecting along Y-axis. Keeping original position.")
-            return point
-    
-    # Shift each point along Y-axis until it intersects the mesh
+    for radius_ratio, count, skip_bottom in rings:
+        ring_radius = outer_radius * radius_ratio
+        for i in range(count):
+            angle = 2 * np.pi * i / count
+
+            # Only place electrodes where z isn't too negative
+            if skip_bottom and not (-0.5 < np.sin(angle) < 0.9):
+                continue
+
+            x_offset = ring_radius * np.cos(angle)
+            z_offset = ring_radius * np.sin(angle)
+            all_points.append(center_point + np.array([x_offset, 0, z_offset]))
+    return all_points
+
+def closest_ray_hits(head_mesh, origins, direction=(0.0, 1.0, 0.0)):
+    """
+    Cast one ray per origin along direction in a single batched query and keep the
+    closest intersection of each ray.
+
+    Parameters:
+    head_mesh (CompactMesh or trimesh.Trimesh): Mesh to intersect, its ray index is built once and reused
+    origins (array): (n, 3) ray origins
+    direction (array): Shared ray direction
+
+    Returns:
+    tuple: (hits (n, 3), hit_mask (n,)). Rays that miss keep their origin.
+    """
+    if isinstance(head_mesh, CompactMesh):
+        return head_mesh.first_hits(origins, direction)
+
+    origins = np.asarray(origins, dtype=float).reshape(-1, 3)
+    directions = np.tile(np.asarray(direction, dtype=float), (len(origins), 1))
+
+    hits = origins.copy()
+    hit_mask = np.zeros(len(origins), dtype=bool)
+    if len(origins) == 0:
+        return hits, hit_mask
+
+    locations, index_ray, _ = head_mesh.ray.intersects_location(
+        ray_origins=origins,
+        ray_directions=directions
+    )
+
+    if len(locations) > 0:
+        # Sort the hits by ray, then by distance, and keep the first hit of each ray.
+        distances = np.linalg.norm(locations - origins[index_ray], axis=1)
+        order = np.lexsort((distances, index_ray))
+        first = np.unique(index_ray[order], return_index=True)[1]
+        closest = order[first]
+        hits[index_ray[closest]] = locations[closest]
+        hit_mask[index_ray[closest]] = True
+
+    return hits, hit_mask
+
+def offset_electrode_points(hits, center_point, outward_offset=DEFAULT_OUTWARD_OFFSET):
+    """
+    Move surface hits outward from the center and drop an electrode that sits far below the rest.
+
+    Parameters:
+    hits (array): (n, 3) points on the head surface
+    center_point (array): Center of the layout
+    outward_offset (float): Distance to move each electrode outward from the surface
+
+    Returns:
+    list: Electrode positions
+    """
     shifted_points = []
-    for i, point in enumerate(all_points):
-        shifted = shift_along_y_until_intersection(point)
-        
+    for shifted in hits:
         # Calculate direction from center to shifted point (outward direction)
         direction_from_center = shifted - center_point
         if np.linalg.norm(direction_from_center) > 1e-6:
             direction_from_center = direction_from_center / np.linalg.norm(direction_from_center)
             
             # Move the point outward from the head surface
-            outward_offset = 0.02  # Amount to move outward from surface
             shifted = shifted + direction_from_center * outward_offset
         
         shifted_points.append(shifted)
-        if i < 4:
-            print(f"Shifted inner ring point {i+1}: {shifted}")
-        elif i < 12:
-            print(f"Shifted middle ring point {i-3}: {shifted}")
-        else:
-            print(f"Shifted outer ring point {i-11}: {shifted}")
     
     # Filter out any electrodes that are positioned too low
     # First, sort the shifted points by their z-coordinate (lowest first)
@@ -277,96 +224,432 @@ def shift_centered_with_central_target(xyz_file_path, head_mesh_file, electrode_
         shifted_points = [p for i, p in enumerate(shifted_points) if i != sorted_indices[0]]
     
     print(f"After filtering, {len(shifted_points)} electrodes remain")
-            
-    # Adjust the central target electrode position to stick out more
-    central_electrode_outward_offset = 0.025
-    central_target_position = center_point + np.array([0, central_electrode_outward_offset, 0])
+
+    return shifted_points
+
+# Surface refinement of the aligned reference points. align_points only matches the
+# nasion and inion to the nose and back of the head, so the preauricular points (and
+# often the others) float off the scalp. A few ICP iterations fit a similarity
+# transform of the four points to their nearest head vertices, then each point is
+# projected onto the closest point of the faces around its SNAP_NEIGHBOURS nearest
+# vertices, so coarse scans do not quantize the points to their vertex spacing. The
+# KD-tree over the head vertices above the neck is built once per head mesh.
+
+# The head region is the vertices above the neck, or all vertices if fewer than this
+MIN_HEAD_REGION_VERTICES = 100
+# Bounds on the scale change a refinement may apply
+MAX_REFINE_SCALE_CHANGE = 0.2
+# Nearest vertices whose faces are searched for the closest surface point
+SNAP_NEIGHBOURS = 8
+
+_head_trees = weakref.WeakKeyDictionary()
+
+def head_region_tree(head_mesh, neck_height=None):
+    """
+    Return the cached KD-tree over the head vertices above neck_height, building it on first use.
+
+    Returns:
+    tuple: (KDTree, (k, 3) vertices it indexes)
+    """
+    return _head_region(head_mesh, neck_height)[:2]
+
+def _head_region(head_mesh, neck_height=None):
+    # (KDTree, vertices, their indices in the mesh), cached per mesh and neck height
+    trees = _head_trees.setdefault(head_mesh, {})
+    key = None if neck_height is None else float(neck_height)
+    if key not in trees:
+        vertices = np.asarray(head_mesh.vertices)
+        ids = np.arange(len(vertices))
+        if key is not None:
+            above_neck = np.flatnonzero(vertices[:, 1] > key)
+            if len(above_neck) >= MIN_HEAD_REGION_VERTICES:
+                ids = above_neck
+        region = np.asarray(vertices[ids], dtype=np.float64)
+        trees[key] = (KDTree(region), region, ids)
+    return trees[key]
+
+def closest_points_on_triangles(points, a, b, c):
+    """
+    Closest point of each triangle (a, b, c) to the matching point, all (k, 3) arrays
+    (Ericson, Real-Time Collision Detection 5.1.5). Degenerate triangles give a corner.
+    """
+    ab, ac = b - a, c - a
+    dot = lambda u, v: np.einsum('ij,ij->i', u, v)
+    ap, bp, cp = points - a, points - b, points - c
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+    va, vb, vc = d3 * d6 - d5 * d4, d5 * d2 - d1 * d6, d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        on_ab = a + ab * (d1 / (d1 - d3))[:, None]
+        on_ac = a + ac * (d2 / (d2 - d6))[:, None]
+        on_bc = b + (c - b) * ((d4 - d3) / ((d4 - d3) + (d5 - d6)))[:, None]
+        denominator = va + vb + vc
+        inside = a + ab * (vb / denominator)[:, None] + ac * (vc / denominator)[:, None]
+
+    # Voronoi regions of the corners, then the edges, then the face, first match wins
+    regions = [
+        (d1 <= 0) & (d2 <= 0),
+        (d3 >= 0) & (d4 <= d3),
+        (vc <= 0) & (d1 >= 0) & (d3 <= 0),
+        (d6 >= 0) & (d5 <= d6),
+        (vb <= 0) & (d2 >= 0) & (d6 <= 0),
+        (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0),
+    ]
+    closest = np.select([r[:, None] for r in regions], [a, b, on_ab, c, on_ac, on_bc], inside)
+    return np.where(np.isfinite(closest), closest, a)
+
+def _snap_to_surface(head_mesh, points, tree, ids):
+    # Closest point on the faces around the nearest vertices of each point
+    faces = np.asarray(head_mesh.faces)
+    vertices = np.asarray(head_mesh.vertices, dtype=np.float64)
+    neighbours = min(SNAP_NEIGHBOURS, tree.n)
+    _, nearest = tree.query(points, k=neighbours)
+    nearest = ids[np.asarray(nearest).reshape(len(points), neighbours)]
+    candidates = np.flatnonzero(np.isin(faces, nearest).any(axis=1))
+
+    snapped = np.empty_like(points)
+    for i, point in enumerate(points):
+        own = candidates[np.isin(faces[candidates], nearest[i]).any(axis=1)]
+        if not len(own):
+            snapped[i] = vertices[nearest[i, 0]]
+            continue
+        corners = vertices[faces[own]]
+        closest = closest_points_on_triangles(np.broadcast_to(point, (len(own), 3)),
+                                              corners[:, 0], corners[:, 1], corners[:, 2])
+        snapped[i] = closest[np.argmin(np.linalg.norm(closest - point, axis=1))]
+    return snapped
+
+def _similarity_transform(source, target, scale=True):
+    # Least-squares s, R, t with target ~ s * R @ source + t (Umeyama)
+    source_mean, target_mean = source.mean(axis=0), target.mean(axis=0)
+    X, Y = source - source_mean, target - target_mean
+    U, S, Vt = np.linalg.svd(Y.T @ X / len(source))
+    D = np.eye(3)
+    if np.linalg.det(U) * np.linalg.det(Vt) < 0:
+        D[2, 2] = -1
+    R = U @ D @ Vt
+    s = 1.0
+    variance = (X ** 2).sum() / len(source)
+    if scale and variance > 0:
+        s = np.clip(np.trace(np.diag(S) @ D) / variance, 1 - MAX_REFINE_SCALE_CHANGE, 1 + MAX_REFINE_SCALE_CHANGE)
+    return s, R, target_mean - s * R @ source_mean
+
+def refine_reference_points(head_mesh, points, neck_height=None, iterations=5, scale=True, tolerance=1e-6):
+    """
+    Fit the aligned reference points to the scalp and project them onto it.
+
+    Parameters:
+    head_mesh (CompactMesh): Oriented head mesh
+    points (PointSet or array): 4x3 aligned reference points (nasion, left/right preauricular, inion)
+    neck_height (float): Only vertices above it are matched, see head_region_tree
+    iterations (int): Maximum ICP iterations
+    scale (bool): Fit a similarity rather than a rigid transform
+    tolerance (float): Stop once no point moves more than this between iterations
+
+    Returns:
+    PointSet or array: 4x3 refined points on the head surface (the closest point of the
+                       faces around their nearest vertices), of the same type as points
+    """
+    point_set = points if isinstance(points, PointSet) else None
+    points = np.asarray(points, dtype=np.float64)
+    tree, vertices, ids = _head_region(head_mesh, neck_height)
+    start_distances, nearest = tree.query(points)
+
+    current, distances = points, start_distances
+    for _ in range(iterations):
+        s, R, t = _similarity_transform(points, vertices[nearest], scale=scale)
+        moved = s * points @ R.T + t
+        step = np.abs(moved - current).max()
+        current = moved
+        # One batched nearest-neighbour query per iteration
+        distances, nearest = tree.query(current)
+        if step < tolerance:
+            break
+
+    snapped = _snap_to_surface(head_mesh, current, tree, ids)
+    print(f"Reference points refined onto the scalp: mean distance {start_distances.mean():.4f} "
+          f"before, {distances.mean():.4f} after fitting, then projected")
+    if point_set is not None:
+        return point_set.with_points(snapped)
+    return snapped
+
+def layout_center(original_points):
+    """
+    Center of the layout (centroid of the reference points) and its outer radius
+    (mean distance of the reference points from the center).
+    """
+    # Calculate the central point (centroid) of all original landmarks
+    center_point = np.mean(original_points, axis=0)
+    print(f"Calculated center point: {center_point}")
     
-    # Create a scene to hold all our meshes
-    scene = trimesh.Scene()
+    # Compute distances from center to establish the outer radius
+    distances = [np.linalg.norm(point - center_point) for point in original_points]
+    outer_radius = np.mean(distances)
+    return center_point, outer_radius
+
+def layout_electrode_points(original_points, head_mesh, rings=DEFAULT_RINGS, outward_offset=DEFAULT_OUTWARD_OFFSET):
+    """
+    Compute the electrode positions on the head for a ring layout.
+
+    Parameters:
+    original_points (array): 4x3 aligned reference points
+    head_mesh (CompactMesh): Oriented head mesh
+    rings (sequence): Ring layout, see ring_points
+    outward_offset (float): Distance to move each electrode outward from the surface
+
+    Returns:
+    tuple: (shifted_points (list), center_point, outer_radius)
+    """
+    center_point, outer_radius = layout_center(original_points)
     
-    # Add the head mesh to the scene
-    scene.add_geometry(head_mesh)
-    
-    # Create a central target electrode (larger and distinct)
-    central_target_electrode = electrode_mesh.copy()
-    # Make it larger than regular electrodes
-    central_target_electrode.apply_scale(2.5)
-    # Position it at the offset center point
-    central_target_electrode.apply_translation(central_target_position)
-    # Set a distinctive color (purple)
-    central_target_electrode.visual.face_colors = [128, 0, 128, 255]  # Purple
-    scene.add_geometry(central_target_electrode)
-    
-    # Function to create an electrode at a point pointing towards the center
-    def create_electrode(point, center, color, name):
-        # Create a copy of the electrode mesh
-        electrode_copy = electrode_mesh.copy()
-        
-        # Calculate direction from point to center (this is where electrodes will point)
-        direction = center - point
-        direction = direction / np.linalg.norm(direction)
-        
-        # Default electrode orientation is along Y-axis
-        y_axis = np.array([0.0, 1.0, 0.0])
-        
-        # Calculate rotation axis and angle
-        rotation_axis = np.cross(y_axis, direction)
-        
-        # Check if rotation_axis is not near-zero
-        if np.linalg.norm(rotation_axis) > 1e-6:
-            rotation_axis = rotation_axis / np.linalg.norm(rotation_axis)
-            rotation_angle = np.arccos(np.clip(np.dot(y_axis, direction), -1.0, 1.0))
-            
-            # Create rotation matrix
-            rotation_matrix = trimesh.transformations.rotation_matrix(
-                angle=rotation_angle,
-                direction=rotation_axis,
-                point=[0, 0, 0]
-            )
-            
-            # Apply rotation
-            electrode_copy.apply_transform(rotation_matrix)
-        
-        # Then translate to the point
-        electrode_copy.apply_translation(point)
-        
-        # Color the electrode
-        electrode_copy.visual.face_colors = color
+    # Create a symmetrical electrode layout with multiple concentric rings
+    all_points = ring_points(center_point, outer_radius, rings)
+    
+    print(f"Created a total of {len(all_points)} electrode points in a symmetric arrangement (excluding central target)")
+    
+    # Shift every point along the Y-axis until it intersects the mesh, in one batch
+    hits, hit_mask = closest_ray_hits(head_mesh, all_points)
+    for point in np.asarray(all_points)[~hit_mask]:
+        print(f"Warning: No intersection found for point {point} when projecting along Y-axis. Keeping original position.")
+
+    shifted_points = offset_electrode_points(hits, center_point, outward_offset)
+
+    return shifted_points, center_point, outer_radius
+
+def electrode_transform(point, center):
+    """
+    4x4 transform that rotates the electrode's Y-axis to point from point towards center,
+    then translates it to point.
+    """
+    # Calculate direction from point to center (this is where electrodes will point)
+    direction = center - point
+    direction = direction / np.linalg.norm(direction)
+    
+    # Default electrode orientation is along Y-axis
+    y_axis = np.array([0.0, 1.0, 0.0])
+    
+    # Calculate rotation axis and angle
+    rotation_axis = np.cross(y_axis, direction)
+    
+    transform = np.eye(4)
+    # Check if rotation_axis is not near-zero
+    if np.linalg.norm(rotation_axis) > 1e-6:
+        rotation_axis = rotation_axis / np.linalg.norm(rotation_axis)
+        rotation_angle = np.arccos(np.clip(np.dot(y_axis, direction), -1.0, 1.0))
         
-        return electrode_copy
+        # Create rotation matrix
+        transform = trimesh.transformations.rotation_matrix(
+            angle=rotation_angle,
+            direction=rotation_axis,
+            point=[0, 0, 0]
+        )
+    elif np.dot(y_axis, direction) < 0:
+        # Straight down: no rotation axis, turn it over instead of leaving it pointing away
+        transform = trimesh.transformations.rotation_matrix(np.pi, [1.0, 0.0, 0.0])
     
-    # Color definitions
-    blue_color = [0, 0, 255, 255]       # Inner ring
-    green_color = [0, 255, 0, 255]      # Middle ring
-    orange_color = [255, 165, 0, 255]   # Outer ring
+    # Then translate to the point
+    transform[:3, 3] += point
+    return transform
+
+# Electrode colors
+CENTRAL_COLOR = [128, 0, 128, 255]  # Purple
+INNER_COLOR = [0, 0, 255, 255]      # Inner ring, blue
+MIDDLE_COLOR = [0, 255, 0, 255]     # Middle ring, green
+OUTER_COLOR = [255, 165, 0, 255]    # Outer ring, orange
+HEAD_FACE_COLOR = [102, 102, 102, 255]  # Head in combined meshes, trimesh's default grey
+
+# Index of the central target electrode in the instances of electrode_instances
+CENTRAL_INDEX = 0
+
+def electrode_instances(shifted_points, center_point, outer_radius, central_offset=DEFAULT_CENTRAL_OFFSET):
+    """
+    Placement of the central target electrode and of one electrode per point, all pointing
+    toward the center, as transforms of the (scaled) electrode model.
+
+    Returns:
+    list: (4x4 transform, RGBA color) pairs, central target first (CENTRAL_INDEX)
+    """
+    instances = []
+
+    # Adjust the central target electrode position to stick out more
+    central_target_position = center_point + np.array([0, central_offset, 0])
+
+    # Create a central target electrode (larger and distinct), made larger than regular
+    # electrodes and positioned at the offset center point
+    central_transform = np.diag([2.5, 2.5, 2.5, 1.0])
+    central_transform[:3, 3] = central_target_position
+    instances.append((central_transform, CENTRAL_COLOR))
     
     # Add electrodes for each valid point, all pointing toward the center
     # Use different colors for points based on their distance from center
-    for i, point in enumerate(shifted_points):
+    for point in shifted_points:
         # Calculate distance from center to determine color
         distance = np.linalg.norm(point - center_point)
         
         # Inner ring (closest)
         if distance < (outer_radius * 0.4):
-            color = blue_color
-            name = f"inner_ring_electrode_{i+1}"
+            color = INNER_COLOR
         # Middle ring
         elif distance < (outer_radius * 0.65):
-            color = green_color
-            name = f"middle_ring_electrode_{i+1}"
+            color = MIDDLE_COLOR
         # Outer ring
         else:
-            color = orange_color
-            name = f"outer_ring_electrode_{i+1}"
+            color = OUTER_COLOR
             
-        # Create and add electrode
-        electrode = create_electrode(point, center_point, color, name)
-        scene.add_geometry(electrode)
+        instances.append((electrode_transform(point, center_point), color))
+
+    return instances
+
+def instances_to_meshes(electrode_mesh, instances):
+    """
+    Copy the electrode model once per instance, transformed and colored.
+    """
+    meshes = []
+    for transform, color in instances:
+        electrode = electrode_mesh.copy()
+        electrode.apply_transform(transform)
+        electrode.visual.face_colors = color
+        meshes.append(electrode)
+    return meshes
+
+def build_electrode_meshes(shifted_points, center_point, outer_radius, electrode_mesh, central_offset=DEFAULT_CENTRAL_OFFSET):
+    """
+    Create the central target electrode and one electrode per point, all pointing toward the center.
+
+    Returns:
+    list: Colored trimesh electrodes, central target first
+    """
+    instances = electrode_instances(shifted_points, center_point, outer_radius, central_offset=central_offset)
+    return instances_to_meshes(electrode_mesh, instances)
+
+def combine_electrode_model(electrode_mesh, instances, head_mesh=None):
+    """
+    Concatenate the electrode instances, and the head if given, into one mesh.
+
+    Returns:
+    CompactMesh: Combined mesh, with the electrode colors per face and the head in HEAD_FACE_COLOR
+    """
+    electrode_vertices = np.asarray(electrode_mesh.vertices, dtype=float)
+    electrode_faces = np.asarray(electrode_mesh.faces)
+    vertices, faces, colors = [], [], []
+    n_vertices = 0
+    if head_mesh is not None:
+        vertices.append(np.asarray(head_mesh.vertices, dtype=np.float32))
+        faces.append(np.asarray(head_mesh.faces))
+        colors.append(np.tile(np.asarray(HEAD_FACE_COLOR, dtype=np.uint8), (len(head_mesh.faces), 1)))
+        n_vertices = len(head_mesh.vertices)
+    for transform, color in instances:
+        vertices.append((electrode_vertices @ transform[:3, :3].T + transform[:3, 3]).astype(np.float32))
+        faces.append(electrode_faces + n_vertices)
+        colors.append(np.tile(np.asarray(color, dtype=np.uint8), (len(electrode_faces), 1)))
+        n_vertices += len(electrode_vertices)
+    if not vertices:
+        return CompactMesh(np.empty((0, 3)), np.empty((0, 3)))
+    return CompactMesh(np.concatenate(vertices), np.concatenate(faces), np.concatenate(colors))
+
+def generate_electrode_layout(original_points, head_mesh, rings=DEFAULT_RINGS,
+                              outward_offset=DEFAULT_OUTWARD_OFFSET, central_offset=DEFAULT_CENTRAL_OFFSET):
+    """
+    Place a ring layout of electrodes on an already loaded head.
+
+    Returns:
+    list: (4x4 transform, RGBA color) electrode instances, see electrode_instances
+    """
+    shifted_points, center_point, outer_radius = layout_electrode_points(
+        original_points, head_mesh, rings=rings, outward_offset=outward_offset
+    )
+    return electrode_instances(shifted_points, center_point, outer_radius, central_offset=central_offset)
+
+def generate_electrode_model(original_points, head_mesh, electrode_mesh, rings=DEFAULT_RINGS,
+                             outward_offset=DEFAULT_OUTWARD_OFFSET, central_offset=DEFAULT_CENTRAL_OFFSET,
+                             include_head=True):
+    """
+    Place a ring layout of electrodes on an already loaded head.
+
+    Parameters:
+    original_points (array): 4x3 aligned reference points
+    head_mesh (CompactMesh): Oriented head mesh
+    electrode_mesh (trimesh.Trimesh): Electrode model, already scaled
+    rings (sequence): Ring layout, see ring_points
+    outward_offset (float): Distance to move each electrode outward from the surface
+    central_offset (float): Height of the central target electrode above the center
+    include_head (bool): Whether to include a copy of the head in the result
+
+    Returns:
+    CompactMesh: Combined mesh
+    """
+    instances = generate_electrode_layout(original_points, head_mesh, rings=rings,
+                                          outward_offset=outward_offset, central_offset=central_offset)
+    return combine_electrode_model(electrode_mesh, instances, head_mesh if include_head else None)
+
+def read_reference_points(xyz_file_path):
+    """
+    The 4 aligned reference points (nasion, left/right preauricular, inion), passed in
+    memory or read from a point set file.
+
+    Parameters:
+    xyz_file_path (str, PointSet or array): Point set file (.npz, or .xyz text rows), a
+                  PointSet holding the reference roles, or a 4x3 array
+
+    Returns:
+    PointSet: The reference points in the head frame
+    """
+    try:
+        original_points = as_reference_points(xyz_file_path)
+    except Exception as e:
+        print(f"Error loading reference points: {e}")
+        raise
+
+    for role, point in zip(original_points.roles, original_points.points):
+        print(f"{role}: {point}")
+    return original_points
+
+def shift_centered_with_central_target(xyz_file_path, head_mesh_file, electrode_file="electrode.stl", sphere_radius=0.01, intermediate_ratio=0.75, output_path="head_with_electrodes_pointing_center.stl",
+                                       rings=DEFAULT_RINGS, outward_offset=DEFAULT_OUTWARD_OFFSET):
+    """
+    Creates a symmetric electrode layout with a central electrode and concentric rings of electrodes.
+    All peripheral electrodes are oriented to point towards the central electrode.
+    Original landmarks are hidden but used to define the head boundary.
     
-    # Export the scene as an STL file
-    meshes = list(scene.geometry.values())
-    combined_mesh = trimesh.util.concatenate(meshes)
+    Parameters:
+    xyz_file_path (str or PointSet): Aligned reference points, or a point set file (.npz or .xyz) holding them
+    head_mesh_file (str, CompactMesh or trimesh.Trimesh): Path to the head mesh file, or an already loaded head mesh
+    electrode_file (str or trimesh.Trimesh): Path to the electrode STL file to use, or the unscaled electrode model
+    sphere_radius (float): Radius of the spheres representing landmarks (default: 0.01)
+    intermediate_ratio (float): Determines position of intermediate landmarks between 
+                               original landmarks and center (0.75 = 75% toward center)
+    output_path (str): File path to save the resulting STL file
+    rings (sequence): (radius ratio, count, skip bottom) for each ring, innermost first
+    outward_offset (float): Distance to move each electrode outward from the head surface
+    
+    Returns:
+    str: Path to the saved STL file
+    """
+    original_points = read_reference_points(xyz_file_path)
+    
+    # Load the head mesh
+    try:
+        if isinstance(head_mesh_file, (CompactMesh, trimesh.Trimesh)):
+            head_mesh = head_mesh_file
+        else:
+            head_mesh = CompactMesh.from_trimesh(trimesh.load(head_mesh_file))
+            print(f"Successfully loaded head mesh from {head_mesh_file}")
+    except Exception as e:
+        print(f"Error loading head mesh: {e}")
+        raise
+    
+    # Load the electrode model and scale it to an appropriate size
+    if isinstance(electrode_file, trimesh.Trimesh):
+        electrode_template = electrode_file
+    else:
+        electrode_template = load_electrode_template(electrode_file)
+    electrode_mesh = scale_electrode_template(electrode_template, sphere_radius)
+    
+    # Export the head and electrodes as an STL file
+    combined_mesh = generate_electrode_model(original_points, head_mesh, electrode_mesh,
+                                             rings=rings, outward_offset=outward_offset)
     combined_mesh.export(output_path)
     
     print(f"Final STL file with head model and symmetric electrodes pointing to central target saved to: {output_path}")
@@ -375,7 +658,7 @@ def shift_centered_with_central_target(xyz_file_path, head_mesh_file, electrode_
 
 # # Example usage
 # central_electrode_stl = shift_centered_with_central_target(
-#     xyz_file_path="aligned_points.xyz",
+#     xyz_file_path="aligned_points.npz",
 #     head_mesh_file="head_model.stl",
 #     electrode_file="electrode.stl",
 #     sphere_radius=0.01,
@@ -385,7 +668,7 @@ def shift_centered_with_central_target(xyz_file_path, head_mesh_file, electrode_
 
 # Example usage of landmarks-only function
 # landmarks_only_stl = display_landmarks_only(
-#     xyz_file_path="aligned_points.xyz",
+#     xyz_file_path="aligned_points.npz",
 #     sphere_radius=0.01,
 #     intermediate_ratio=0.75,  # Controls how close intermediate points are to center
 #     output_path="landmarks_only.stl"
@@ -0,0 +1,304 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+from model_generation import electrode_transform, combine_electrode_model, DEFAULT_OUTWARD_OFFSET, INNER_COLOR
+
+# 10-20 / 10-10 / 10-5 montage placement on the head mesh.
+#
+# Every site is defined by percentages along scalp arcs: its fraction u along the
+# nasion-inion arc and its fraction v along the left-right preauricular arc. On the
+# mesh these are the geodesic ratios
+#     u = d_nasion / (d_nasion + d_inion),   v = d_left / (d_left + d_right)
+# so one distance field per reference point (4 Dijkstra runs over a cached edge graph)
+# locates a whole montage, instead of one ray per site.
+#
+# The target (u, v) of each site comes from the standard construction on an ideal
+# sphere (Oostenveld & Praamstra, 2001): rows cross the midline at 5% steps of the
+# nasion-inion arc, start on the 10% contour through Fpz, T7, Oz and T8, and are
+# divided into eighths towards the midline; the 9/10 columns continue down to the
+# 0% contour through Nz, LPA and Iz.
+#
+# Building the edge graph and KD-tree costs more than the four Dijkstra runs on a large
+# scan. Solvers are kept per mesh cache key (mesh_cache.glb_cache_key) for the last
+# MAX_SOLVERS heads, so the requests of a server worker reusing an uploaded head share
+# one; heads without a key only share it while the same mesh object is in use.
+
+# All montage electrodes share one color.
+MONTAGE_COLOR = INNER_COLOR
+
+# Geodesic solvers kept per mesh cache key
+MAX_SOLVERS = int(os.environ.get("EEG_MONTAGE_SOLVERS", 4))
+
+# Row prefixes by fraction of the nasion-inion arc, in percent.
+ROWS = {10: "Fp", 15: "AFp", 20: "AF", 25: "AFF", 30: "F", 35: "FFC", 40: "FC", 45: "FCC", 50: "C",
+        55: "CCP", 60: "CP", 65: "CPP", 70: "P", 75: "PPO", 80: "PO", 85: "POO", 90: "O"}
+
+# Left columns by position along the row. Positions 0..1 run from the 10% contour to
+# the midline, negative positions run down from the 10% contour to the 0% contour.
+COLUMNS = {-1.0: "9", -0.5: "9h", 0.0: "7", 0.125: "7h", 0.25: "5", 0.375: "5h",
+           0.5: "3", 0.625: "3h", 0.75: "1", 0.875: "1h", 1.0: "z"}
+
+# Rows and columns that make up each system.
+SYSTEMS = {
+    "10-20": {"rows": (10, 30, 50, 70, 90), "columns": (0.0, 0.5, 1.0), "poles": False},
+    "10-10": {"rows": tuple(range(10, 91, 10)), "columns": (-1.0, 0.0, 0.25, 0.5, 0.75, 1.0), "poles": True},
+    "10-5": {"rows": tuple(range(10, 91, 5)), "columns": tuple(sorted(COLUMNS)), "poles": True},
+}
+
+def _site_name(row, column, right):
+    prefix = ROWS[row]
+    label = COLUMNS[column]
+    if label == "z":
+        return prefix + "z"
+
+    number, half = (label[:-1], "h") if label.endswith("h") else (label, "")
+    if right:
+        number = str(int(number) + 1)
+
+    # Frontopolar and occipital rows only hold the contour sites, named 1 and 2,
+    # and in the 10-5 system the sites halfway to the midline (1h and 2h).
+    if prefix in ("Fp", "O"):
+        number = "2" if right else "1"
+        half = "h" if column == 0.5 else ""
+    # Temporal columns replace the central C in the row name with a T (FC7 -> FT7, C7 -> T7).
+    elif column <= 0.125 and "C" in prefix:
+        prefix = prefix.replace("C", "T")
+    return prefix + number + half
+
+def _slerp(a, b, t):
+    # Great-circle interpolation between unit vectors
+    angle = np.arccos(np.clip(np.dot(a, b), -1.0, 1.0))
+    if angle < 1e-9:
+        return a
+    return (np.sin((1 - t) * angle) * a + np.sin(t * angle) * b) / np.sin(angle)
+
+def _circle_arc(a, m, t):
+    # Point at fraction t along the arc of the small circle through a, m and the mirror of a
+    # (in z), going from a (t=0) to m (t=1).
+    b = a * np.array([1, 1, -1])
+    normal = np.cross(a - m, b - m)
+    if np.linalg.norm(normal) < 1e-12:
+        return _slerp(a, m, t)
+    normal /= np.linalg.norm(normal)
+    center = np.dot(normal, m) * normal
+    ra, rm = a - center, m - center
+    radius = np.linalg.norm(ra)
+    ra, rm = ra / radius, rm / np.linalg.norm(rm)
+    angle = np.arccos(np.clip(np.dot(ra, rm), -1.0, 1.0))
+    ortho = rm - np.dot(rm, ra) * ra
+    ortho /= np.linalg.norm(ortho)
+    return center + radius * (np.cos(t * angle) * ra + np.sin(t * angle) * ortho)
+
+def sphere_site(row, column):
+    """
+    Position of a left or midline site on the ideal unit sphere, with the nasion at +x,
+    the vertex at +y and the left preauricular point at +z.
+    """
+    f = row / 100.0
+    elevation = np.radians(18.0)  # the 10% contour
+    azimuth = np.pi * f
+    if row in (10, 90):
+        # The frontopolar and occipital contour sites sit 5% of the circumference from the midline
+        azimuth = np.radians(18.0) if row == 10 else np.radians(162.0)
+
+    midline = np.array([np.cos(np.pi * f), np.sin(np.pi * f), 0.0])
+    contour = np.array([np.cos(elevation) * np.cos(azimuth), np.sin(elevation), np.cos(elevation) * np.sin(azimuth)])
+    if column < 0:
+        equator = np.array([np.cos(azimuth), 0.0, np.sin(azimuth)])
+        return _slerp(contour, equator, -column)
+    if row in (10, 90):
+        return _slerp(contour, midline, column)
+    return _circle_arc(contour, midline, column)
+
+def montage_sites(system="10-20"):
+    """
+    Names and target arc fractions of every site of a montage.
+
+    Returns:
+    tuple: (names (list), targets (n, 2) array of (u, v) nasion-inion / left-right fractions)
+    """
+    if system not in SYSTEMS:
+        raise ValueError(f"Unknown montage system {system!r}, expected one of {sorted(SYSTEMS)}")
+    spec = SYSTEMS[system]
+
+    names, points = [], []
+    for row in spec["rows"]:
+        for column in spec["columns"]:
+            # The 9/10 columns only exist between the AF and PO rows.
+            if column < 0 and not 20 <= row <= 80:
+                continue
+            # The frontopolar and occipital rows only hold the contour, halfway and midline sites.
+            if row in (10, 90) and column not in (0.0, 0.5, 1.0):
+                continue
+            if row in (10, 90) and column == 0.5 and system != "10-5":
+                continue
+            point = sphere_site(row, column)
+            names.append(_site_name(row, column, right=False))
+            points.append(point)
+            if column != 1.0:
+                names.append(_site_name(row, column, right=True))
+                points.append(point * np.array([1, 1, -1]))
+
+    if spec["poles"]:
+        names += ["Nz", "Iz"]
+        points += [np.array([1.0, 0.0, 0.0]), np.array([-1.0, 0.0, 0.0])]
+
+    # Geodesic fractions on the unit sphere are angle fractions of a half turn.
+    points = np.array(points)
+    u = np.arccos(np.clip(points[:, 0], -1, 1)) / np.pi
+    v = np.arccos(np.clip(points[:, 2], -1, 1)) / np.pi
+    return names, np.column_stack([u, v])
+
+class GeodesicSolver:
+    """
+    Edge-graph geodesic distances over a head mesh. The sparse
+    graph and the vertex KD-tree are built once and reused for every distance field.
+
+    Besides the mesh edges, the graph links the two vertices opposite each interior edge
+    (the other diagonal of the quad the two faces form). Paths along the mesh edges alone
+    zig-zag in the direction the scan's quads were split, which bends left and right
+    fractions apart by centimetres; the extra diagonals make the graph close to symmetric.
+    """
+
+    def __init__(self, vertices, faces):
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        faces = np.asarray(faces, dtype=np.int64)
+
+        edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+        opposite = np.concatenate([faces[:, 2], faces[:, 0], faces[:, 1]])
+        order = np.lexsort((edges[:, 1], edges[:, 0]))
+        edges, opposite = edges[order], opposite[order]
+        # Consecutive equal edges after sorting are shared by two faces
+        shared = (edges[1:] == edges[:-1]).all(axis=1)
+        across = np.sort(np.column_stack([opposite[:-1][shared], opposite[1:][shared]]), axis=1)
+        edges = np.unique(np.concatenate([edges, across]), axis=0)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        lengths = np.linalg.norm(self.vertices[edges[:, 0]] - self.vertices[edges[:, 1]], axis=1)
+        n = len(self.vertices)
+        self.graph = coo_matrix((lengths, (edges[:, 0], edges[:, 1])), shape=(n, n)).tocsr()
+        self.tree = cKDTree(self.vertices)
+
+    def nearest_vertices(self, points):
+        return self.tree.query(np.asarray(points, dtype=np.float64))[1]
+
+    def distance_fields(self, source_vertices):
+        """
+        One distance field per source vertex, computed in a single multi-source call.
+
+        Returns:
+        array: (len(source_vertices), n_vertices) distances, inf where unreachable
+        """
+        return dijkstra(self.graph, directed=False, indices=np.asarray(source_vertices))
+
+# Solvers by mesh cache key, least recently used first, and by mesh object for heads
+# without a key
+_keyed_solvers = OrderedDict()
+_solvers = weakref.WeakKeyDictionary()
+_solvers_lock = threading.Lock()
+
+def geodesic_solver(head_mesh, mesh_key=None):
+    """
+    Return the cached GeodesicSolver of a head mesh, building it on first use.
+
+    Parameters:
+    head_mesh (CompactMesh): Oriented head mesh
+    mesh_key (str): Mesh cache key of the head; meshes loaded from the same entry then
+                    share the solver, otherwise only this mesh object does
+    """
+    with _solvers_lock:
+        if mesh_key is not None and mesh_key in _keyed_solvers:
+            _keyed_solvers.move_to_end(mesh_key)
+            return _keyed_solvers[mesh_key]
+        solver = _solvers.get(head_mesh)
+    if solver is None:
+        solver = GeodesicSolver(head_mesh.vertices, head_mesh.faces)
+
+    with _solvers_lock:
+        if mesh_key is None:
+            _solvers[head_mesh] = solver
+        elif MAX_SOLVERS > 0:
+            _keyed_solvers[mesh_key] = solver
+            while len(_keyed_solvers) > MAX_SOLVERS:
+                _keyed_solvers.popitem(last=False)
+    return solver
+
+def place_montage(head_mesh, reference_points, system="10-20", mesh_key=None):
+    """
+    Place a 10-20, 10-10 or 10-5 montage on an oriented head mesh.
+
+    Parameters:
+    head_mesh (CompactMesh): Oriented head mesh (nose towards +x, top towards +y)
+    reference_points (array): 4x3 nasion, left preauricular, right preauricular, inion
+    system (str): "10-20", "10-10" or "10-5"
+    mesh_key (str): Mesh cache key of the head, see geodesic_solver
+
+    Returns:
+    tuple: (names (list), positions (n, 3) array of scalp vertices, normals (n, 3) array)
+    """
+    solver = geodesic_solver(head_mesh, mesh_key)
+    names, targets = montage_sites(system)
+
+    # Snap the reference points to the scalp and compute one distance field for each.
+    nasion, left, right, inion = solver.nearest_vertices(reference_points)
+    d_nasion, d_left, d_right, d_inion = solver.distance_fields([nasion, left, right, inion])
+
+    # Sites lie above the plane of the reference points, which also separates the two
+    # (u, v) solutions on either side of it.
+    anchors = solver.vertices[[nasion, left, right, inion]]
+    normal = np.cross(anchors[3] - anchors[0], anchors[2] - anchors[1])
+    normal /= np.linalg.norm(normal)
+    if normal[1] < 0:
+        normal = -normal
+    height = (solver.vertices - anchors.mean(axis=0)) @ normal
+    tolerance = 0.02 * np.linalg.norm(anchors[3] - anchors[0])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u = d_nasion / (d_nasion + d_inion)
+        v = d_left / (d_left + d_right)
+    scalp = np.flatnonzero((height > -tolerance) & np.isfinite(u) & np.isfinite(v))
+    if len(scalp) == 0:
+        raise ValueError("No scalp vertices reachable from all four reference points")
+
+    # Match every site to the scalp vertex with the closest arc fractions in one query.
+    _, match = cKDTree(np.column_stack([u[scalp], v[scalp]])).query(targets)
+    site_vertices = scalp[match]
+
+    print(f"Placed {len(names)} {system} sites on the head mesh")
+    return names, solver.vertices[site_vertices], np.asarray(head_mesh.vertex_normals)[site_vertices]
+
+def montage_instances(head_mesh, reference_points, system="10-20", outward_offset=DEFAULT_OUTWARD_OFFSET,
+                      mesh_key=None):
+    """
+    Electrode placement for a montage: each site is moved outward along the surface normal
+    and the electrode points towards the center of the reference points.
+
+    Returns:
+    tuple: ((4x4 transform, RGBA color) instances, names, electrode positions)
+    """
+    names, positions, normals = place_montage(head_mesh, reference_points, system, mesh_key)
+    center = np.mean(reference_points, axis=0)
+
+    # Make sure the normals point away from the center of the head
+    flip = np.einsum('ij,ij->i', normals, positions - center) < 0
+    normals = np.where(flip[:, None], -normals, normals)
+    positions = positions + normals * outward_offset
+
+    instances = [(electrode_transform(point, center), MONTAGE_COLOR) for point in positions]
+    return instances, names, positions
+
+def montage_electrode_model(head_mesh, reference_points, electrode_mesh, system="10-20",
+                            outward_offset=DEFAULT_OUTWARD_OFFSET, include_head=True, mesh_key=None):
+    """
+    Build the electrodes of a montage as one mesh, see montage_instances.
+
+    Returns:
+    tuple: (CompactMesh combined mesh, names, electrode positions)
+    """
+    instances, names, positions = montage_instances(head_mesh, reference_points, system, outward_offset, mesh_key)
+    combined = combine_electrode_model(electrode_mesh, instances, head_mesh if include_head else None)
+    return combined, names, positions
@@ -1,16 +1,40 @@
 # High level controller for the data pipeline
+import os
+import time
+from compact_mesh import CompactMesh
 from glb_to_stl import convert_glb_to_stl
-from landmarks import find_landmarks
-from reference_points import find_reference_points
-from reference_point_scaling import get_scaled_reference_points
+from landmarks import find_landmarks, LANDMARK_MODEL_VERSION
+from landmark_cache import image_cache_key, load_landmarks, store_landmarks
+from reference_points import find_reference_points, REFERENCE_POINTS_VERSION
+from reference_point_scaling import prepare_head_mesh, scale_reference_points
+from mesh_cache import glb_cache_key, load_head_mesh, store_head_mesh, MESH_CACHE_VERSION
 from electrode_modelling import place_electrodes
-from model_generation import shift_centered_with_central_target
+from model_generation import (generate_electrode_layout, combine_electrode_model, cached_electrode_template,
+                              refine_reference_points,
+                              load_electrode_template, scale_electrode_template, DEFAULT_RINGS,
+                              DEFAULT_OUTWARD_OFFSET, DEFAULT_CENTRAL_OFFSET, CENTRAL_INDEX)
+from montage import montage_instances
+from point_sets import PointSet
+from electrode_checks import check_electrode_layout
+from admission import check_memory_budget, stl_face_count
+from stage_timing import StageTimings
+from stage_graph import Stage, StageGraph, MemoryBackend, DiskBackend
 # Jeremy's final part
 
-def create_electrodes_stl(glb_file_path, image_file_path):
+def detect_landmarks(image_file_path):
+    """
+    Find the facial landmarks of a photo and the 10-20 reference points derived from them,
+    reusing the results of photos processed before.
 
-    # Convert the GLB File to STL Format
-    stl_file_path = convert_glb_to_stl(glb_file_path)
+    Returns:
+    tuple: (PointSet of the 68 landmarks, PointSet of the reference points), in the image frame
+    """
+    # Reuse the landmarks of a photo we have already processed.
+    landmark_key = image_cache_key(image_file_path, LANDMARK_MODEL_VERSION, REFERENCE_POINTS_VERSION)
+    cached = load_landmarks(landmark_key)
+    if cached is not None:
+        landmarks, ref_points = cached
+        return PointSet.landmarks(landmarks), PointSet.reference(ref_points)
 
     # Get facial landmarks from the image,
     landmarks = find_landmarks(image_file_path)
@@ -18,18 +42,123 @@ def create_electrodes_stl(glb_file_path, image_file_path):
     # Based on the landmarks, find the 4 reference points of the 10-20 system.
     ref_points = find_reference_points(landmarks)
 
-    # Scale the reference points to the size of the head in the STL file
-    final_stl_file_path, scaled_ref_points = get_scaled_reference_points(stl_file_path, ref_points)
+    store_landmarks(landmark_key, landmarks[0], ref_points)
+    return PointSet.landmarks(landmarks[0]), ref_points
 
-    # Generate the electrode STL files based on the scaled reference points and the STL file
-    central_electrode_stl = shift_centered_with_central_target(
-        xyz_file_path="aligned_points.xyz",
-        head_mesh_file=final_stl_file_path,
-        electrode_file="electrode.stl",
-        sphere_radius=0.01,
-        intermediate_ratio=0.5,
-        output_path="final_electrode_model.stl"
-    )
+def orient_head(glb_file_path, rotated_path=None, memory_budget=None, timings=None, content_addressed=False):
+    """
+    Convert and orient a GLB scan, reusing the oriented geometry of scans processed before.
+
+    Parameters:
+    rotated_path (str): Where to save the rotated STL on a cache miss, None to skip it
+    memory_budget (int): Bytes, see admission.check_memory_budget
+    timings (StageTimings): Records the convert and orient stages on a cache miss
+    content_addressed (bool): The GLB is named by its contents (artifact_store), so an STL
+                              conversion already beside it is reused
+
+    Returns:
+    tuple: (head dict as from prepare_head_mesh, its mesh cache key, True on a cache hit)
+    """
+    if timings is None:
+        timings = StageTimings()
+
+    # A cache hit counts as the orient stage
+    start = time.perf_counter()
+    mesh_key = glb_cache_key(glb_file_path)
+    head = load_head_mesh(mesh_key)
+    if head is not None:
+        check_memory_budget(len(head["vertices"]), len(head["faces"]), memory_budget)
+        timings.add("orient", time.perf_counter() - start)
+        return head, mesh_key, True
+
+    with timings.stage("convert"):
+        # Convert the GLB File to STL Format
+        stl_file_path = convert_glb_to_stl(glb_file_path, reuse=content_addressed)
+
+        # A closed triangle mesh has about half as many vertices as faces
+        n_faces = stl_face_count(stl_file_path)
+        check_memory_budget(n_faces // 2, n_faces, memory_budget)
+
+    with timings.stage("orient"):
+        # Orient the head so the nose faces +x and the top of the head +y
+        head = prepare_head_mesh(stl_file_path, rotated_path=rotated_path)
+        store_head_mesh(mesh_key, head)
+    return head, mesh_key, False
+
+def run_pipeline(glb_file_path, image_file_path, montage=None, write_files=True, memory_budget=None,
+                 timings=None, content_addressed=False):
+    """
+    Run the full pipeline and keep the intermediate state needed for re-layouts.
+
+    If montage is "10-20", "10-10" or "10-5", the electrodes are placed on that montage
+    instead of the concentric ring layout. With write_files=False the result meshes are
+    only returned in memory and no STL files are written. memory_budget (bytes) rejects
+    meshes too large for one run with admission.MemoryBudgetExceeded before orientation.
+    The duration of each stage (landmarks, convert, orient, align, layout, export) is
+    recorded in timings (a stage_timing.StageTimings), whose listener is told as each
+    stage finishes. content_addressed marks a GLB named by its contents, see orient_head.
+
+    Returns:
+    dict: person_stl and electrode_stl paths (None when not written), the oriented
+          head_mesh, the scaled electrode_mesh and its electrode_instances ((transform, color)
+          pairs), the aligned_points (PointSet), the unscaled electrode_template and the mesh_key of
+          the head in the mesh cache, and the stage timings
+    """
+
+    if timings is None:
+        timings = StageTimings()
+
+    # Landmarks come first: a photo without a face stops the run (landmarks.NoFaceDetected)
+    # before the scan is converted or oriented.
+    with timings.stage("landmarks"):
+        landmarks, ref_points = detect_landmarks(image_file_path)
+
+    head, mesh_key, cache_hit = orient_head(glb_file_path,
+                                            rotated_path="output_stl/rotated_model.stl" if write_files else None,
+                                            memory_budget=memory_budget, timings=timings,
+                                            content_addressed=content_addressed)
+    # Memory-mapped cache entries are used in place, without a float64 copy
+    head_mesh = CompactMesh(head["vertices"], head["faces"])
+    final_stl_file_path = None
+    if not cache_hit:
+        final_stl_file_path = head["path"]
+    elif write_files:
+        with timings.stage("export"):
+            # The cached mesh is already oriented, write it out for the response. Not
+            # beside the GLB: that name holds the unrotated conversion, which may be reused.
+            final_stl_file_path = "output_stl/rotated_model.stl"
+            os.makedirs(os.path.dirname(final_stl_file_path), exist_ok=True)
+            head_mesh.export(final_stl_file_path)
+
+    with timings.stage("align"):
+        # Scale the reference points to the size of the head in the STL file, then fit them onto the scalp
+        scaled_ref_points = refine_reference_points(head_mesh, scale_reference_points(head, ref_points),
+                                                    neck_height=head["neck_height"])
+        if write_files:
+            landmarks.save("landmarks.npz")
+            scaled_ref_points.save("aligned_points.npz")
+
+    with timings.stage("layout"):
+        # Generate the electrode STL files based on the scaled reference points and the STL file
+        electrode_template = cached_electrode_template("electrode.stl")
+        electrode_mesh = scale_electrode_template(electrode_template, sphere_radius=0.01)
+        if montage is not None:
+            electrode_instances, _, _ = montage_instances(head_mesh, scaled_ref_points, system=montage,
+                                                          mesh_key=mesh_key)
+            central = None
+        else:
+            electrode_instances = generate_electrode_layout(scaled_ref_points, head_mesh)
+            central = CENTRAL_INDEX
+        # Push electrodes that reach into the scalp outward, report overlaps
+        electrode_instances, _ = check_electrode_layout(head_mesh, electrode_mesh, electrode_instances,
+                                                        central=central)
+
+    central_electrode_stl = None
+    if write_files:
+        with timings.stage("export"):
+            central_electrode_stl = "final_electrode_model.stl"
+            combine_electrode_model(electrode_mesh, electrode_instances, head_mesh).export(central_electrode_stl)
+            print(f"Final STL file with head model and electrodes saved to: {central_electrode_stl}")
 
     # invisible_head_stl = shift_centered_with_invisible_head(
     # xyz_file_path="aligned_points.xyz",
@@ -42,8 +171,147 @@ def create_electrodes_stl(glb_file_path, image_file_path):
 
     print("End of Pipeline Reached")
 
+    return {
+        "person_stl": final_stl_file_path,
+        "electrode_stl": central_electrode_stl,
+        "head_mesh": head_mesh,
+        "electrode_mesh": electrode_mesh,
+        "electrode_instances": electrode_instances,
+        "aligned_points": scaled_ref_points,
+        "electrode_template": electrode_template,
+        "mesh_key": mesh_key,
+        "timings": timings,
+    }
+
+# The pipeline as a memoized stage graph, for scripts and notebooks that rerun it with
+# different parameters. Landmarks and oriented heads already have their own disk caches
+# (landmark_cache, mesh_cache), so those stages and the cheap ones are only kept in memory.
+
+def _head_mesh_stage(head):
+    return CompactMesh(head["vertices"], head["faces"])
+
+def _aligned_points_stage(head, head_mesh, reference_points):
+    return refine_reference_points(head_mesh, scale_reference_points(head, reference_points),
+                                   neck_height=head["neck_height"])
+
+def _electrode_instances_stage(head_mesh, aligned_points, montage, rings, outward_offset, central_offset):
+    if montage is not None:
+        return montage_instances(head_mesh, aligned_points, system=montage)[0]
+    return generate_electrode_layout(aligned_points, head_mesh, rings=rings, outward_offset=outward_offset,
+                                     central_offset=central_offset)
+
+def _checked_instances_stage(head_mesh, electrode_mesh, electrode_instances, montage, min_clearance):
+    # Montages have no central target electrode
+    central = None if montage is not None else CENTRAL_INDEX
+    return check_electrode_layout(head_mesh, electrode_mesh, electrode_instances, central=central,
+                                  min_clearance=min_clearance)[0]
+
+def _electrode_model_stage(electrode_mesh, checked_instances, head_mesh, include_head):
+    return combine_electrode_model(electrode_mesh, checked_instances, head_mesh if include_head else None)
+
+# Stage keys chain through their inputs, so the versions of the first stages follow the
+# caches behind them: a new landmark model, reference-point derivation or orientation
+# changes every key downstream. Bump the version of a persisted stage when its own
+# code changes (electrode_instances: ray hits and layout).
+PIPELINE_GRAPH = StageGraph([
+    Stage("detection", lambda image_file: detect_landmarks(image_file), inputs=("image_file",),
+          version=f"{LANDMARK_MODEL_VERSION}-{REFERENCE_POINTS_VERSION}", persist=False),
+    Stage("landmarks", lambda detection: detection[0], inputs=("detection",), persist=False),
+    Stage("reference_points", lambda detection: detection[1], inputs=("detection",), persist=False),
+    Stage("head", lambda glb_file: orient_head(glb_file)[0], inputs=("glb_file",), version=MESH_CACHE_VERSION,
+          persist=False),
+    Stage("head_mesh", _head_mesh_stage, inputs=("head",), persist=False),
+    Stage("aligned_points", _aligned_points_stage, inputs=("head", "head_mesh", "reference_points"), version=3),
+    Stage("electrode_template", load_electrode_template, inputs=("electrode_file",), persist=False),
+    Stage("electrode_mesh", scale_electrode_template, inputs=("electrode_template",), params=("sphere_radius",),
+          persist=False),
+    Stage("electrode_instances", _electrode_instances_stage, inputs=("head_mesh", "aligned_points"),
+          params=("montage", "rings", "outward_offset", "central_offset"), version=3),
+    Stage("checked_instances", _checked_instances_stage, inputs=("head_mesh", "electrode_mesh", "electrode_instances"),
+          params=("montage", "min_clearance"), persist=False),
+    Stage("electrode_model", _electrode_model_stage, inputs=("electrode_mesh", "checked_instances", "head_mesh"),
+          params=("include_head",), persist=False),
+], file_sources=("glb_file", "image_file", "electrode_file"))
+
+# intermediate_ratio is accepted for parity with shift_centered_with_central_target but
+# no stage depends on it, so changing it recomputes nothing.
+DEFAULT_PIPELINE_PARAMS = {
+    "montage": None,
+    "sphere_radius": 0.01,
+    "intermediate_ratio": 0.75,
+    "rings": DEFAULT_RINGS,
+    "outward_offset": DEFAULT_OUTWARD_OFFSET,
+    "central_offset": DEFAULT_CENTRAL_OFFSET,
+    "min_clearance": 0.0,
+    "include_head": True,
+}
+
+# Results of earlier runs in this process and on disk
+stage_backends = (MemoryBackend(), DiskBackend())
+
+def create_electrodes_stl(glb_file_path, image_file_path, montage=None, electrode_file="electrode.stl",
+                          backends=stage_backends, **params):
+    """
+    Run the pipeline through PIPELINE_GRAPH and write the head and electrode STL files,
+    and the landmarks and aligned reference points (landmarks.npz, aligned_points.npz).
+    Only the stages affected by what changed since an earlier run are recomputed.
+
+    Parameters:
+    montage (str): "10-20", "10-10" or "10-5", or None for the ring layout
+    backends (sequence): Stage result backends, () to recompute everything
+    params: Overrides of DEFAULT_PIPELINE_PARAMS (sphere_radius, rings, outward_offset, ...)
+
+    Returns:
+    tuple: (head STL path, electrode STL path)
+    """
+    unknown = set(params) - set(DEFAULT_PIPELINE_PARAMS)
+    if unknown:
+        raise TypeError(f"Unknown pipeline parameters: {', '.join(sorted(unknown))}")
+    params = {**DEFAULT_PIPELINE_PARAMS, **params, "montage": montage}
+    sources = {"glb_file": glb_file_path, "image_file": image_file_path, "electrode_file": electrode_file}
+
+    outputs, statuses = PIPELINE_GRAPH.run(sources, params, ["head_mesh", "electrode_model", "landmarks",
+                                                             "aligned_points"], backends=backends)
+    print("Stages:", ", ".join(f"{name} ({status})" for name, status in statuses.items()))
+
+    # The same point set files as run_pipeline, read by visualize.py, electrode_modelling.py and sweep.py
+    outputs["landmarks"].save("landmarks.npz")
+    outputs["aligned_points"].save("aligned_points.npz")
+
+    # Where run_pipeline writes it too. Not beside the GLB: that name holds the unrotated
+    # conversion, which may be reused (and is a tracked file for the sample inputs).
+    person_stl = "output_stl/rotated_model.stl"
+    os.makedirs(os.path.dirname(person_stl), exist_ok=True)
+    outputs["head_mesh"].export(person_stl)
+    electrode_stl = "final_electrode_model.stl"
+    outputs["electrode_model"].export(electrode_stl)
+    print(f"Final STL file with head model and electrodes saved to: {electrode_stl}")
+
     # Return the path to the electrode STL File.
-    return final_stl_file_path, "final_electrode_model.stl"
+    return person_stl, electrode_stl
 
 if __name__ == "__main__":
-    create_electrodes_stl("input_gltf/peter_test.glb", "input_png/000002.jpg")
\ No newline at end of file
+    import argparse
+    from request_profiling import RequestProfiler, PROFILE_MODES
+
+    parser = argparse.ArgumentParser(description="Run the pipeline on one scan and photo")
+    parser.add_argument("glb", nargs="?", default="input_gltf/peter_test.glb", help="GLB scan")
+    parser.add_argument("image", nargs="?", default="input_png/000002.jpg", help="Face photo")
+    parser.add_argument("--montage", choices=("10-20", "10-10", "10-5"), help="Montage instead of the ring layout")
+    parser.add_argument("--profile", choices=PROFILE_MODES,
+                        help="Run under cProfile (pstats file) or the sampling profiler (collapsed stacks)")
+    parser.add_argument("--profile-output", help="Profile file (default: a new file under cache/profiles)")
+    args = parser.parse_args()
+
+    if args.profile is None:
+        create_electrodes_stl(args.glb, args.image, montage=args.montage)
+    else:
+        profiler = RequestProfiler(args.profile)
+        try:
+            with profiler:
+                create_electrodes_stl(args.glb, args.image, montage=args.montage)
+        finally:
+            if args.profile_output:
+                print(f"Profile saved to {profiler.write(args.profile_output)}")
+            else:
+                profiler.save()
@@ -0,0 +1,154 @@
+import os
+import tempfile
+import numpy as np
+
+# Landmark and reference-point sets passed between the pipeline stages. A PointSet
+# keeps the coordinates as one float64 array together with the role of every point and
+# the frame they are in, so stages hand each other the object instead of writing and
+# parsing text files. It converts to its (n, 3) array wherever numpy expects one, and
+# indexing by role name or by position both work.
+#
+# Frames:
+#   "image"  coordinates of the face-alignment model (landmarks, reference points)
+#   "head"   coordinates of the oriented head mesh (aligned reference points)
+#
+# Persistence is an optional .npz of the points, roles and frame, written atomically.
+# load_point_set also reads the plain-text .xyz files of earlier runs (np.loadtxt, so
+# any float format and sign is read correctly).
+
+REFERENCE_ROLES = ("nasion", "left_preauricular", "right_preauricular", "inion")
+N_LANDMARKS = 68
+
+class PointSet:
+    """
+    Points with named roles in a named frame.
+
+    Parameters:
+    points (array): (n, 3) coordinates
+    roles (sequence): n distinct role names, one per point
+    frame (str): Coordinate frame, "image" or "head"
+    """
+
+    __slots__ = ("points", "roles", "frame", "_index")
+
+    def __init__(self, points, roles, frame="image"):
+        self.points = np.array(points, dtype=np.float64).reshape(-1, 3)
+        self.roles = tuple(str(role) for role in roles)
+        self.frame = str(frame)
+        if len(self.roles) != len(self.points):
+            raise ValueError(f"{len(self.points)} points but {len(self.roles)} roles")
+        self._index = {role: i for i, role in enumerate(self.roles)}
+        if len(self._index) != len(self.roles):
+            raise ValueError("Point roles must be distinct")
+
+    @classmethod
+    def reference(cls, points, frame="image"):
+        """
+        The 4 reference points, given in REFERENCE_ROLES order.
+        """
+        return cls(points, REFERENCE_ROLES, frame)
+
+    @classmethod
+    def landmarks(cls, points, frame="image"):
+        """
+        The 68 facial landmarks, roles landmark_1 to landmark_68.
+        """
+        return cls(points, [f"landmark_{i + 1}" for i in range(len(points))], frame)
+
+    def with_points(self, points, frame=None):
+        """
+        Same roles with new coordinates, e.g. after a transform.
+        """
+        return PointSet(points, self.roles, self.frame if frame is None else frame)
+
+    def select(self, roles):
+        """
+        The points of the given roles, in that order.
+        """
+        return PointSet(self.points[[self._index[role] for role in roles]], roles, self.frame)
+
+    def reference_points(self):
+        """
+        (4, 3) array of the reference points in REFERENCE_ROLES order.
+        """
+        return self.select(REFERENCE_ROLES).points
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.points[self._index[key]]
+        return self.points[key]
+
+    def __contains__(self, role):
+        return role in self._index
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None or np.dtype(dtype) == self.points.dtype:
+            return self.points.copy() if copy else self.points
+        return self.points.astype(dtype)
+
+    def __repr__(self):
+        roles = ", ".join(self.roles[:4]) + (", ..." if len(self) > 4 else "")
+        return f"PointSet({len(self)} points in the {self.frame} frame: {roles})"
+
+    def save(self, path):
+        """
+        Write the set to an .npz file, through a hidden temporary file so readers never
+        see a partial one.
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".npz", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, points=self.points, roles=np.array(self.roles), frame=np.array(self.frame))
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+def load_point_set(path, frame="head"):
+    """
+    Read a point set saved by PointSet.save, or a plain-text file of x y z rows.
+
+    Parameters:
+    path (str): .npz file, or text file (.xyz) as written by np.savetxt
+    frame (str): Frame of text files, which do not record one
+
+    Returns:
+    PointSet: Text files of 4 points get the reference roles, of 68 the landmark roles,
+              otherwise point_1, point_2, ...
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return PointSet(data["points"], data["roles"].tolist(), data["frame"].item())
+
+    points = np.loadtxt(path, dtype=np.float64, ndmin=2)
+    if points.shape[1] != 3:
+        raise ValueError(f"Expected rows of 3 coordinates in {path}, found {points.shape[1]}")
+    if len(points) == len(REFERENCE_ROLES):
+        return PointSet.reference(points, frame)
+    if len(points) == N_LANDMARKS:
+        return PointSet.landmarks(points, frame)
+    return PointSet(points, [f"point_{i + 1}" for i in range(len(points))], frame)
+
+def as_reference_points(points, frame="head"):
+    """
+    The reference points of a PointSet, a saved point set file or a 4x3 array, as a
+    PointSet with the reference roles.
+    """
+    if isinstance(points, str):
+        points = load_point_set(points, frame)
+    if isinstance(points, PointSet):
+        return points if points.roles == REFERENCE_ROLES else points.select(REFERENCE_ROLES)
+    points = np.asarray(points, dtype=np.float64)
+    if points.shape != (len(REFERENCE_ROLES), 3):
+        raise ValueError(f"Expected 4x3 reference points, got shape {points.shape}")
+    return PointSet.reference(points, frame)
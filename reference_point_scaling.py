@@ -1,31 +1,34 @@
+import os
 import open3d as o3d
 import numpy as np
 import pyvista as pv
 import stl_reader
-import numpy as np
-
-# Find the z-level of the neck.
+from compact_mesh import CompactMesh
+from point_sets import as_reference_points
+from head_profile import (PROFILE_SLICES, sample_vertices, cross_section_profile, transform_profile, neck_level,
+                          shoulder_axis, anatomy_levels)
+
+# Approximate orientation. The neck level and shoulder axis are read off the
+# cross-section profile (head_profile) of a stratified, area-weighted sample of
+# ORIENT_SAMPLE_SIZE vertices (fixed seed, so a scan always gets the same answer), so
+# their cost stays nearly constant as scans grow. Each decision reports a margin in
+# [0, 1]; when either is below ORIENT_MIN_MARGIN, both are redone on the profile of all
+# vertices. A sample size of 0 always uses all vertices. The profile, turned along with
+# the mesh, gives the chin, top of the head and ear band, and is returned with the head
+# so later stages do not rescan the vertices. The nose and back of the head feed the
+# reference point alignment, so they are still found on all vertices.
+ORIENT_SAMPLE_SIZE = int(os.environ.get("EEG_ORIENT_SAMPLE_SIZE", 50000))
+ORIENT_MIN_MARGIN = float(os.environ.get("EEG_ORIENT_MIN_MARGIN", 0.15))
+ORIENT_SEED = 0
+# Profiles of a sample get fewer slices, so that each slice holds about this many points
+ORIENT_POINTS_PER_SLICE = 100
+
+# Find the y-level of the neck.
 # We can do this by finding the level with the smallest area.
-def find_neck_y(vertices):
-
-    y_values = vertices[:, 1]  # Extract all y coordinates
-    sorted_vertices_y = vertices[vertices[:, 2].argsort()]
-
-    min_x_diff = 1000000000
-    min_x_diff_index = -1
-    # Loop through blocks of vertices.
-    block_size = 10
-    for i in range(0, len(sorted_vertices_y), block_size):
-        # Find the largest and smallest x_value in that block
-        largest_x = np.max(sorted_vertices_y[i:i+block_size, 0])
-        smallest_x = np.min(sorted_vertices_y[i:i+block_size, 0])
-        print(largest_x, smallest_x)
-        # Find the difference in x values
-        x_diff = abs(largest_x - smallest_x)
-        if x_diff < min_x_diff:
-            min_x_diff = x_diff
-            min_x_diff_index = i
-    return sorted_vertices_y[min_x_diff_index][2]
+def find_neck_y(vertices, profile=None):
+    if profile is None:
+        profile = cross_section_profile(vertices)
+    return neck_level(profile)[0]
 
 def find_nose_and_back_of_head(vertices, neck_height, midline_tolerance=0.2, visualize=True):
     """
@@ -182,62 +185,161 @@ def align_points(original_pts, ref_A, ref_B):
     
     return (M_extra @ np.column_stack([transformed, np.ones(4)]).T).T[:, :3]
 
-def get_scaled_reference_points(stl_file, original_pts):
-    stl_file = stl_file
-    final_path = stl_file
+def rotation_about_y(angle_degrees, center):
+    """
+    4x4 homogeneous rotation about the y-axis through center, matching pyvista's rotate_y.
+    """
+    theta = np.radians(angle_degrees)
+    c, s = np.cos(theta), np.sin(theta)
+    R = np.eye(4)
+    R[:3, :3] = [[c, 0, s],
+                 [0, 1, 0],
+                 [-s, 0, c]]
+    T1 = np.eye(4); T1[:3, 3] = -np.asarray(center, dtype=float)
+    T2 = np.eye(4); T2[:3, 3] = np.asarray(center, dtype=float)
+    return T2 @ R @ T1
+
+def apply_transform(vertices, transform):
+    # Apply a 4x4 homogeneous transform to an (n, 3) vertex array, keeping its dtype.
+    transformed = vertices @ transform[:3, :3].T + transform[:3, 3]
+    return transformed.astype(vertices.dtype, copy=False)
+
+def bounds_center(vertices):
+    # Centre of the axis-aligned bounding box (pyvista's mesh.center).
+    return (vertices.min(axis=0) + vertices.max(axis=0)) / 2
+
+def orientation_profile(vertices, faces=None, sample_size=ORIENT_SAMPLE_SIZE, min_margin=ORIENT_MIN_MARGIN):
+    """
+    Neck level and shoulder axis, decided on the profile of a vertex sample, or of all
+    vertices when a margin on the sample is below min_margin.
 
-    # Step 1: Read the STL file
-    try:
-        vertices, indices = stl_reader.read(stl_file)
-    except Exception as e:
-        print(f"Error reading STL file: {e}")
+    Returns:
+    tuple: (profile, neck level, True if the shoulders lie along z)
+    """
+    def decide(points):
+        slices = PROFILE_SLICES if points is vertices else min(PROFILE_SLICES, len(points) // ORIENT_POINTS_PER_SLICE)
+        profile = cross_section_profile(points, slices=max(slices, 16))
+        return (profile,) + neck_level(profile) + shoulder_axis(profile)
+
+    sample = vertices if faces is None else sample_vertices(vertices, faces, sample_size, ORIENT_SEED)
+    profile, neck_height, neck_margin, along_z, axis_margin = decide(sample)
+    if sample is not vertices and min(neck_margin, axis_margin) < min_margin:
+        print(f"Orientation: margins {neck_margin:.2f} (neck) and {axis_margin:.2f} (shoulders) on "
+              f"{len(sample)} sampled vertices, below {min_margin}, using all vertices")
+        sample = vertices
+        profile, neck_height, neck_margin, along_z, axis_margin = decide(vertices)
+    print(f"Orientation: from {len(sample)} vertices, neck level {neck_height:.4f} (margin {neck_margin:.2f}), "
+          f"shoulders along {'z' if along_z else 'x'} (margin {axis_margin:.2f})")
+    return profile, neck_height, along_z
+
+def orient_vertices(vertices, faces=None, sample_size=ORIENT_SAMPLE_SIZE, min_margin=ORIENT_MIN_MARGIN):
+    """
+    Turn a head-and-shoulders scan about the y-axis so that the shoulders lie along z and
+    the nasion faces the positive x-axis. A scan already facing that way is left as is.
 
-    print(vertices)    
-    
-    neck_height = find_neck_y(vertices)
+    Parameters:
+    vertices (array): (n, 3) vertices, top of the head towards the positive y-axis
+    faces (array): (m, 3) faces, to decide on a vertex sample; None to use all vertices
+    sample_size (int): Vertices sampled for the neck and shoulder decisions, 0 for all
+    min_margin (float): Decisions with a smaller margin on the sample are redone on all vertices
+
+    Returns:
+    dict: vertices (oriented), transform (4x4, original -> oriented), neck_height, nose,
+          back_head, profile (cross-section profile of the oriented vertices) and anatomy
+          (see head_profile.anatomy_levels)
+    """
+    profile, neck_height, along_z = orientation_profile(vertices, faces, sample_size, min_margin)
+    transform = np.eye(4)
 
     #Now we want to reorient the model so that the nasion is facing towards the postiive x-axis
     #and the inion is facing towards the negative x-axis.
 
     # We can determine which axis is shoulder-left-to-right by finding the extremeities distances.
-    if not shoulder_along_z(vertices):
-        # Rotate the model so that the nasion is facing towards postive/negative x-axis
-        mesh = pv.read(final_path)
-        
-        # Determine the center point to rotate around
-        center = mesh.center
-        
-        #Rotate the model 90 degrees around the y-axis
-        rotated_mesh = mesh.rotate_y(90, point=center, inplace=False)
-
-        rotated_mesh.save("output_stl/rotated_model.stl")
-        final_path = "output_stl/rotated_model.stl"
+    if not along_z:
+        #Rotate the model 90 degrees around the y-axis, about its center
+        rotation = rotation_about_y(90, bounds_center(vertices))
+        vertices = apply_transform(vertices, rotation)
+        transform = rotation @ transform
 
-        vertices = rotated_mesh.points
-
-    
     nose, back_head = find_nose_and_back_of_head(vertices, neck_height)
 
     # If the user is facing forward, the nose should lie below, so if the nose is above the back of the head, we should rotate the model 180.
     if nose[1] > back_head[1]:
-        # Rotate the model so that the nasion is facing towards postive/negative x-axis
-        mesh = pv.read(final_path)
-        
-        # Determine the center point to rotate around
-        center = mesh.center
-        
-        #Rotate the model 180 degrees around the y-axis
-        rotated_mesh = mesh.rotate_y(180, point=center, inplace=False)
+        #Rotate the model 180 degrees around the y-axis, about its center
+        rotation = rotation_about_y(180, bounds_center(vertices))
+        vertices = apply_transform(vertices, rotation)
+        transform = rotation @ transform
+
+        print("MODEL ROTATED 180 DEGREES")
 
-        rotated_mesh.save("output_stl/rotated_model.stl")
-        final_path = "output_stl/rotated_model.stl"
+    profile = transform_profile(profile, transform)
+    anatomy = anatomy_levels(profile, neck_height)
+    print(f"Anatomy: chin {anatomy['chin']:.4f}, top {anatomy['head_top']:.4f}, "
+          f"ear band {anatomy['ear_band'][0]:.4f}-{anatomy['ear_band'][1]:.4f}")
+
+    return {
+        "vertices": vertices,
+        "neck_height": float(neck_height),
+        "transform": transform,
+        "nose": nose,
+        "back_head": back_head,
+        "profile": profile,
+        "anatomy": anatomy,
+    }
+
+def prepare_head_mesh(stl_file, rotated_path="output_stl/rotated_model.stl"):
+    """
+    Read the head STL and orient it so that the nasion faces the positive x-axis
+    and the top of the head points towards the positive y-axis.
 
-        vertices = rotated_mesh.points
+    Parameters:
+    stl_file (str): Path to the STL file of the scan
+    rotated_path (str): Where to save the mesh if it had to be rotated, None to keep it in memory only
 
-        print("MODEL ROTATED 180 DEGREES")
+    Returns:
+    dict: vertices, faces, neck_height, transform (4x4, original -> oriented),
+          nose, back_head, profile (cross-section profile of the oriented mesh),
+          anatomy (see head_profile.anatomy_levels) and path (STL file holding the
+          oriented mesh, None if not saved)
+    """
+    final_path = stl_file
+
+    # Step 1: Read the STL file
+    try:
+        vertices, indices = stl_reader.read(stl_file)
+    except Exception as e:
+        print(f"Error reading STL file: {e}")
+        raise
+
+    print(vertices)    
+
+    oriented = orient_vertices(vertices, indices)
+    vertices, transform = oriented["vertices"], oriented["transform"]
+
+    if not np.allclose(transform, np.eye(4)):
+        final_path = rotated_path
+        if rotated_path is not None:
+            os.makedirs(os.path.dirname(rotated_path) or ".", exist_ok=True)
+            CompactMesh(vertices, indices).export(rotated_path)
     
     print("Nose, back of head found, moving on")   
 
+    return dict(oriented, faces=indices, path=final_path)
+
+def scale_reference_points(head, original_pts):
+    """
+    Align the image-derived reference points to the nose and back of the head of a
+    prepared head mesh.
+
+    Parameters:
+    head (dict): Output of prepare_head_mesh (or the mesh cache)
+    original_pts (PointSet or array): Nasion, left/right preauricular and inion
+
+    Returns:
+    PointSet: Aligned reference points in the head frame
+    """
+    nose, back_head = head["nose"], head["back_head"]
+
     if nose is not None and back_head is not None:
         print(f"Nose point: {nose}")
         print(f"Back of head point: {back_head}")
@@ -251,12 +353,16 @@ def get_scaled_reference_points(stl_file, original_pts):
     ref_D = back_head
 
     # Align the points to the reference positions
-    new_pts = align_points(original_pts, ref_A, ref_D)
+    original_pts = as_reference_points(original_pts, frame="image")
+    new_pts = original_pts.with_points(align_points(original_pts.points, ref_A, ref_D), frame="head")
 
-    print("Points Scaled, saving to aligned_points.xyz")
+    print("Points Scaled")
 
-    # Save the aligned points
-    np.savetxt("aligned_points.xyz", new_pts)
+    return new_pts
+
+def get_scaled_reference_points(stl_file, original_pts):
+    head = prepare_head_mesh(stl_file)
+    new_pts = scale_reference_points(head, original_pts)
 
     # VISUALIZATION -----------------------------------------------------------
 
@@ -288,35 +394,15 @@ def get_scaled_reference_points(stl_file, original_pts):
     # plotter.show()
 
     # ---------------------------------------------------------------------------
-    return final_path, new_pts
+    return head["path"], new_pts
 
 
 # Determine whether the shoulders are along the z-axis
-def shoulder_along_z(vertices):
+def shoulder_along_z(vertices, profile=None):
     # We can check this by finding the distance along z and seeing if the maximum is larger than the distance along x.
-    
-    #First, sort the vertices by y
-    sorted_vertices_y = vertices[vertices[:, 1].argsort()]
-    
-    #Now, in blocks, find the z and x distance between points.
-    max_x_diff = 0
-    max_z_diff = 0
-    block_size = 10
-    for i in range(0, len(sorted_vertices_y), block_size):
-        # Find the largest and smallest x_value in that block
-        largest_x = np.max(sorted_vertices_y[i:i+block_size, 0])
-        smallest_x = np.min(sorted_vertices_y[i:i+block_size, 0])
-        largest_z = np.max(sorted_vertices_y[i:i+block_size, 2])
-        smallest_z = np.min(sorted_vertices_y[i:i+block_size, 2])
-        # Find the difference in x values
-        x_diff = abs(largest_x - smallest_x)
-        if x_diff > max_x_diff:
-            max_x_diff = x_diff
-        z_diff = abs(largest_z - smallest_z)
-        if z_diff > max_z_diff:
-            max_z_diff = z_diff
-    
-    if max_z_diff > max_x_diff:
+    if profile is None:
+        profile = cross_section_profile(vertices)
+    if shoulder_axis(profile)[0]:
         print("SHOULDERS ALIGNED ALONG Z-AXIS -> MUST ROTATE MODEL")
         return True
     else:
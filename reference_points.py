@@ -1,5 +1,10 @@
 import numpy as np
 import open3d as o3d
+from point_sets import PointSet
+
+# Bump when find_reference_points changes, so points cached with the landmarks
+# (landmark_cache) are not reused.
+REFERENCE_POINTS_VERSION = 1
 
 def find_reference_points(xyz_data):
     xyz_data = xyz_data[0]
@@ -24,7 +29,7 @@ def find_reference_points(xyz_data):
     inion = nasion + nasion_midpoint_vec * 1.8
 
     # Therefore, our reference points are.....
-    reference_points = np.array([nasion, left_preauricular, right_preauricular, inion])
+    reference_points = PointSet.reference([nasion, left_preauricular, right_preauricular, inion])
 
     reference_points_dictionary = {"Nasion": nasion, "Left Preauricular": left_preauricular, "Right Preauricular": right_preauricular, "Inion": inion}
 
@@ -32,10 +37,7 @@ def find_reference_points(xyz_data):
     labels = create_labels(reference_points_dictionary, scale=0.5, offset=5)
 
     #o3d.visualization.draw_geometries([pcd] + labels, mesh_show_back_face=True)
-    print(reference_points.shape)
-
-    save_to_xyz(reference_points, "reference_points.xyz")
-    #In order of Nasion, Left Preauricular, Right Preauricular, Inion
+    print(reference_points)
 
     return reference_points
 
@@ -64,10 +66,4 @@ def create_labels(points, scale=0.5, offset=5):
 
         # Convert to legacy format for visualization
         labels.append(label_legacy)
-    return labels
-
-def save_to_xyz(preds, filename="reference_points.xyz"):
-    single_face_landmarks = []
-    for point in preds:
-        single_face_landmarks.append(point)
-    np.savetxt(filename, single_face_landmarks, fmt="%.6f")
\ No newline at end of file
+    return labels
\ No newline at end of file
@@ -0,0 +1,170 @@
+import cProfile
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from cache_utils import evict_lru
+
+# On-demand profiling of single requests. A request flagged with ?profile=<mode> or an
+# X-Profile: <mode> header (or the pipeline CLI's --profile) runs under one of:
+#   cprofile  deterministic, every Python call, saved as a pstats file
+#             (python -m pstats <file>, snakeviz, ...)
+#   sample    a thread samples the request thread's stack every SAMPLE_INTERVAL
+#             seconds, saved as collapsed stacks ("outer;inner count" per line, the
+#             input of flamegraph.pl and speedscope)
+# Unflagged requests run no profiler and pay nothing. cProfile hooks the interpreter,
+# so only one deterministic profile runs at a time; a second flagged request meanwhile
+# is sampled instead.
+
+PROFILE_DIR = "cache/profiles"
+MAX_PROFILES = 64
+PROFILE_MODES = ("cprofile", "sample")
+PROFILE_SUFFIXES = {"cprofile": ".pstats", "sample": ".collapsed"}
+SAMPLE_INTERVAL = float(os.environ.get("EEG_PROFILE_INTERVAL", 0.005))
+
+# Flag values that select the deterministic profiler
+_DEFAULT_MODE_VALUES = ("1", "true", "yes", "on")
+
+_deterministic_lock = threading.Lock()
+
+def parse_profile_flag(value):
+    """
+    Profiling mode of a request flag.
+
+    Parameters:
+    value (str): Flag value, "cprofile", "sample", a true value (cprofile), or empty
+
+    Returns:
+    str or None: "cprofile", "sample", or None to run without profiling
+    """
+    value = (value or "").strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    if value in _DEFAULT_MODE_VALUES:
+        return "cprofile"
+    if value not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode {value}, expected one of {', '.join(PROFILE_MODES)}")
+    return value
+
+class RequestProfiler:
+    """
+    Profiles the thread that starts it until it is stopped.
+
+    Usage:
+        with RequestProfiler("sample") as profiler:
+            ...
+        path = profiler.save()
+    """
+
+    def __init__(self, mode="cprofile", interval=SAMPLE_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode}")
+        self.mode = mode
+        self.interval = interval
+        self._profile = None
+        self._holds_lock = False
+        self._samples = Counter()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._id = uuid.uuid4().hex
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        if self.mode == "cprofile":
+            if _deterministic_lock.acquire(blocking=False):
+                self._holds_lock = True
+                self._profile = cProfile.Profile()
+                self._profile.enable()
+                return
+            print("Profiling: another request is under cProfile, sampling this one instead")
+            self.mode = "sample"
+        self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),),
+                                         name="profile-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+            if self._holds_lock:
+                self._holds_lock = False
+                _deterministic_lock.release()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self._samples[";".join(reversed(stack))] += 1
+            del frame
+
+    @property
+    def suffix(self):
+        return PROFILE_SUFFIXES[self.mode]
+
+    @property
+    def name(self):
+        # File name save() writes to, settled once the profiler has started (a cprofile
+        # request may be sampled instead), so it can be linked before the profile is saved
+        return self._id + self.suffix
+
+    def write(self, path):
+        """
+        Write the profile to path, through a hidden temporary file in the same directory.
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".", dir=directory)
+        try:
+            if self.mode == "cprofile":
+                os.close(fd)
+                self._profile.dump_stats(tmp_path)
+            else:
+                with os.fdopen(fd, 'w') as f:
+                    for stack, count in self._samples.most_common():
+                        f.write(f"{stack} {count}\n")
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def save(self, profile_dir=PROFILE_DIR, max_profiles=MAX_PROFILES):
+        """
+        Write the profile under its name in profile_dir, then evict the least recently
+        written profiles beyond max_profiles.
+
+        Returns:
+        str: File name of the profile in profile_dir
+        """
+        name = self.name
+        self.write(os.path.join(profile_dir, name))
+        evict_lru(profile_dir, max_profiles)
+        print(f"Profiling: {self.mode} profile saved to {os.path.join(profile_dir, name)}")
+        return name
+
+def profile_path(name, profile_dir=PROFILE_DIR):
+    """
+    Path of a saved profile, or None if the name is not one save could have produced.
+    """
+    stem, suffix = os.path.splitext(name)
+    if suffix not in PROFILE_SUFFIXES.values() or len(stem) != 32 or not all(c in "0123456789abcdef" for c in stem):
+        return None
+    path = os.path.join(profile_dir, name)
+    return path if os.path.isfile(path) else None
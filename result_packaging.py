@@ -0,0 +1,123 @@
+import io
+import struct
+import zipfile
+import zlib
+import numpy as np
+
+# Streaming packaging of pipeline results. Meshes are serialized to binary STL in
+# chunks straight from their vertex/face arrays and written into a zip archive that
+# is yielded piece by piece, so the response starts before the archive is complete
+# and never touches the filesystem.
+
+STL_CHUNK_FACES = 1 << 16
+
+# Binary STL triangle record: normal, three vertices, attribute byte count
+_STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attr', '<u2')])
+
+def iter_binary_stl(vertices, faces, chunk_faces=STL_CHUNK_FACES, header=b"EEG_Model_Generator"):
+    """
+    Serialize a triangle mesh as binary STL, chunk_faces triangles at a time.
+
+    Parameters:
+    vertices (array): (n, 3) vertex positions
+    faces (array): (m, 3) vertex indices
+
+    Yields:
+    bytes: The header, then the triangle records
+    """
+    vertices = np.asarray(vertices)
+    faces = np.asarray(faces)
+    yield header[:80].ljust(80, b'\0') + struct.pack('<I', len(faces))
+
+    for start in range(0, len(faces), chunk_faces):
+        triangles = vertices[faces[start:start + chunk_faces]].astype(np.float32)
+        normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+        records = np.zeros(len(triangles), dtype=_STL_RECORD)
+        records['normal'] = normals
+        records['vertices'] = triangles
+        yield records.tobytes()
+
+class _StreamBuffer(io.RawIOBase):
+    # Unseekable sink for zipfile. The bytes written so far are collected with drain().
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(entries, compression=zipfile.ZIP_DEFLATED, compresslevel=6):
+    """
+    Build a zip archive incrementally.
+
+    Parameters:
+    entries (list): (archive name, iterable of bytes chunks) pairs
+    compression (int): zipfile.ZIP_DEFLATED or zipfile.ZIP_STORED
+
+    Yields:
+    bytes: Archive data as soon as it is produced
+    """
+    sink = _StreamBuffer()
+    with zipfile.ZipFile(sink, 'w', compression=compression, compresslevel=compresslevel) as zf:
+        for name, chunks in entries:
+            with zf.open(name, 'w') as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+def gzip_stream(chunks, compresslevel=6):
+    """
+    Gzip an iterable of bytes chunks on the fly (for Content-Encoding: gzip).
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_entries_zip(entries, gzip_encoding=False):
+    """
+    Stream a zip of files given as chunk iterables.
+
+    When the client accepts gzip, the archive entries are stored uncompressed and the
+    whole stream is gzipped instead, so HTTP clients decompress it transparently. Either
+    way the data is compressed exactly once.
+
+    Parameters:
+    entries (list): (archive name, iterable of bytes chunks) pairs
+    gzip_encoding (bool): Whether the response is sent with Content-Encoding: gzip
+
+    Returns:
+    iterator: Bytes chunks of the response body
+    """
+    if gzip_encoding:
+        return gzip_stream(stream_zip(entries, compression=zipfile.ZIP_STORED))
+    return stream_zip(entries)
+
+def stream_meshes_zip(meshes, gzip_encoding=False):
+    """
+    Stream a zip of meshes as binary STL files, see stream_entries_zip.
+
+    Parameters:
+    meshes (list): (archive name, mesh) pairs, meshes with vertices and faces arrays
+    """
+    entries = [(name, iter_binary_stl(mesh.vertices, mesh.faces)) for name, mesh in meshes]
+    return stream_entries_zip(entries, gzip_encoding=gzip_encoding)
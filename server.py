@@ -1,67 +1,278 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file
+from flask import (Flask, render_template, request, redirect, url_for, jsonify, Response, stream_with_context,
+                   send_file)
 import os
 import signal
 import sys
+import threading
+import time
+import traceback
+from contextlib import nullcontext
 from flask_cors import CORS
-from pipeline import create_electrodes_stl
-import zipfile
-import io
-
-request_number = 0
+from pipeline import run_pipeline
+from sessions import SessionStore, SPILL_DIR, relayout, parse_relayout_params, parse_output_params
+from montage import SYSTEMS
+from result_packaging import stream_entries_zip
+from export_formats import FORMATS, export_entries
+from admission import AdmissionController, Overloaded, MemoryBudgetExceeded, check_memory_budget
+from input_validation import InvalidInput, validate_uploads
+from landmarks import NoFaceDetected, landmark_model
+from model_generation import cached_electrode_template
+from stage_timing import StageTimings
+from jobs import Job, JobCancelled, JOB_DIR, TERMINAL_EVENTS, iter_sse
+from artifact_store import ArtifactStore, ARTIFACT_DIR
+from request_profiling import RequestProfiler, PROFILE_DIR, parse_profile_flag, profile_path
+from werkzeug.exceptions import RequestEntityTooLarge
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Session-Id", "Server-Timing", "X-Profile"])
+
+# Largest accepted request body (GLB + image), rejected with 413 by Flask
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get("EEG_MAX_UPLOAD_MB", 200)) * 2**20)
+
+# Concurrent pipeline runs, requests allowed to wait for one, and the per-run memory budget
+admission = AdmissionController(
+    max_concurrent=int(os.environ.get("EEG_MAX_CONCURRENT_RUNS", 2)),
+    max_queue=int(os.environ.get("EEG_MAX_QUEUE", 8)),
+    queue_timeout=float(os.environ.get("EEG_QUEUE_TIMEOUT", 30)),
+)
+run_memory_budget = int(float(os.environ.get("EEG_RUN_MEMORY_BUDGET_MB", 4096)) * 2**20)
+# Largest accepted photo, in pixels
+max_image_pixels = int(float(os.environ.get("EEG_MAX_IMAGE_MEGAPIXELS", 40)) * 10**6)
+
+# Oriented head meshes and aligned points of recent uploads, for /sessions/<id>/relayout
+sessions = SessionStore(
+    max_sessions=int(os.environ.get("EEG_MAX_SESSIONS", 16)),
+    ttl_seconds=float(os.environ.get("EEG_SESSION_TTL", 30 * 60)),
+    # Shared by all worker processes so any of them can serve a relayout
+    spill_dir=os.environ.get("EEG_SESSION_DIR", SPILL_DIR),
+)
+
+# Uploaded scans and photos, named by content hash and kept within a disk budget
+artifacts = ArtifactStore(
+    root=os.environ.get("EEG_ARTIFACT_DIR", ARTIFACT_DIR),
+    max_bytes=int(float(os.environ.get("EEG_ARTIFACT_BUDGET_MB", 2048)) * 2**20),
+    ttl_seconds=float(os.environ.get("EEG_ARTIFACT_TTL", 24 * 60 * 60)),
+)
+
+# Background jobs, shared by all worker processes like the sessions
+job_dir = os.environ.get("EEG_JOB_DIR", JOB_DIR)
 
-# Handle SIGINT (CTRL+C) gracefully
-def signal_handler(sig, frame):
-    print('\nShutting down the server...')
+# Requests flagged with ?profile= or X-Profile run under a profiler, see request_profiling.
+# A profiled run is slower and its profile names the server's files and functions, so
+# the flag is ignored unless EEG_ALLOW_PROFILING=1.
+allow_profiling = os.environ.get("EEG_ALLOW_PROFILING", "0").lower() in ('1', 'true', 'yes', 'on')
+profile_dir = os.environ.get("EEG_PROFILE_DIR", PROFILE_DIR)
+
+# Seconds running pipelines get to finish on shutdown
+drain_timeout = float(os.environ.get("EEG_DRAIN_TIMEOUT", 120))
+
+def warm_up(load_model=True):
+    """
+    Load the electrode template and the landmark model so the first request does not
+    pay for them. Called before forking by gunicorn.conf.py so workers share them.
+    """
+    cached_electrode_template("electrode.stl")
+    if load_model:
+        landmark_model()
+
+def drain_and_exit(sig, frame):
+    # Finish the running pipelines, turn new and waiting requests away with 503, then exit.
+    print(f'\nShutting down the server, waiting up to {drain_timeout:.0f}s for running requests...')
+    if not admission.drain(timeout=drain_timeout):
+        print('Drain timed out, exiting with requests still running')
     sys.exit(0)
 
-signal.signal(signal.SIGINT, signal_handler)
+def install_signal_handlers():
+    # Only for the development server, gunicorn drains its workers itself
+    signal.signal(signal.SIGTERM, drain_and_exit)
+    signal.signal(signal.SIGINT, drain_and_exit)
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    response = jsonify(error=str(e))
+    response.status_code = e.status
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+@app.errorhandler(MemoryBudgetExceeded)
+def handle_memory_budget(e):
+    return jsonify(error=str(e)), 413
+
+@app.errorhandler(InvalidInput)
+def handle_invalid_input(e):
+    return jsonify(error=str(e)), 400
+
+@app.errorhandler(NoFaceDetected)
+def handle_no_face(e):
+    return jsonify(error=str(e)), 422
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_too_large(e):
+    return jsonify(error=f"Upload larger than {app.config['MAX_CONTENT_LENGTH'] // 2**20} MiB"), 413
 
 @app.route('/')
 def home():
     return render_template('index.html')
 
+def error_status(e):
+    # HTTP status the error handlers answer an exception from an upload with
+    if isinstance(e, Overloaded):
+        return e.status
+    if isinstance(e, MemoryBudgetExceeded):
+        return 413
+    if isinstance(e, InvalidInput):
+        return 400
+    if isinstance(e, NoFaceDetected):
+        return 422
+    return 500
+
+def upload_options(form):
+    """
+    Read the optional fields of an upload form.
+
+    Returns:
+    dict: montage (None for the ring layout), format and electrodes_only
+    """
+    # Optional 10-20 / 10-10 / 10-5 montage instead of the ring layout
+    montage = form.get('montage') or None
+    if montage is not None and montage not in SYSTEMS:
+        raise InvalidInput(f"Unknown montage {montage}, expected one of {', '.join(SYSTEMS)}")
+    # Output format (stl, glb, ply, ply16) and whether to leave the head out of the electrode file
+    output_format = form.get('format') or "stl"
+    if output_format not in FORMATS:
+        raise InvalidInput(f"Unknown format {output_format}, expected one of {', '.join(FORMATS)}")
+    electrodes_only = form.get('electrodes_only', '').lower() in ('1', 'true', 'yes', 'on')
+    return {"montage": montage, "format": output_format, "electrodes_only": electrodes_only}
+
+def request_profiler():
+    """
+    A RequestProfiler if the request asks to be profiled, otherwise None.
+    """
+    if not allow_profiling:
+        return None
+    try:
+        mode = parse_profile_flag(request.args.get('profile') or request.headers.get('X-Profile'))
+    except ValueError as e:
+        raise InvalidInput(str(e))
+    return RequestProfiler(mode) if mode is not None else None
+
+def save_upload(file_glb, file_png, timings):
+    """
+    Validate the uploaded scan and photo and save them for the pipeline.
+
+    Returns:
+    tuple: (GLB path, image path)
+    """
+    # Probe the GLB header and JSON chunk and the image header, and check the
+    # declared mesh size against the memory budget, before anything is saved or run
+    with timings.stage("validate"):
+        glb_info, image_info = validate_uploads(file_glb.stream, file_png.stream, max_image_pixels=max_image_pixels)
+        check_memory_budget(glb_info["vertices"], glb_info["faces"], run_memory_budget)
+
+    with timings.stage("save"):
+        # Identical uploads map to the same files, so their STL conversions are reused too
+        filename_glb = artifacts.put_stream(file_glb.stream, ".glb")
+        filename_png = artifacts.put_stream(file_png.stream, ".jpg" if image_info["format"] == "jpeg" else ".png")
+    return filename_glb, filename_png
+
+def admit_run(timings):
+    """
+    Wait for a run slot, timed as the "queue" stage. Only a limited number of runs
+    execute at once, the rest wait or are turned away. The slot covers the pipeline, the
+    export and the streaming of the result, so the caller releases it once the response
+    is written; it also works as a context manager.
+    """
+    queued = time.perf_counter()
+    slot = admission.admit().acquire()
+    try:
+        # A job's stage listener raises JobCancelled here if the job was cancelled while
+        # it waited, and the caller never gets the slot to release
+        timings.add("queue", time.perf_counter() - queued)
+    except BaseException:
+        slot.release()
+        raise
+    return slot
+
+def process_upload(filename_glb, filename_png, options, timings):
+    """
+    Run the pipeline on a saved upload and prepare the files to return. The caller holds
+    a run slot (admit_run) until the entries have been written out.
+
+    Returns:
+    tuple: (session id, (archive name, chunks) entries from export_entries)
+    """
+    # Call the pipeline function, keeping the result meshes in memory
+    result = run_pipeline(filename_glb, filename_png, montage=options["montage"], write_files=False,
+                          memory_budget=run_memory_budget, timings=timings, content_addressed=True)
+
+    # Keep the head in memory so the layout can be tweaked without re-uploading
+    session_id = sessions.create(result["head_mesh"], result["aligned_points"], result["electrode_template"],
+                                 mesh_key=result["mesh_key"])
+
+    entries = export_entries(options["format"], result["head_mesh"], result["electrode_mesh"],
+                             result["electrode_instances"], electrodes_only=options["electrodes_only"])
+    print("Returning", " and ".join(name for name, _ in entries))
+    return session_id, entries
+
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_file():
-    global request_number
     if request.method == 'POST':
+        # Turn the request away before reading the upload if there is no room for it
+        admission.check_capacity()
         if 'file_glb' not in request.files or 'file_png' not in request.files:
             return redirect(request.url)
         file_glb = request.files['file_glb']
         file_png = request.files['file_png']
         if file_glb.filename == '' or file_png.filename == '':
             return redirect(request.url)
+        options = upload_options(request.form)
+        profiler = request_profiler()
         if file_glb and file_png:
-            filename_glb = "input_gltf/request_" + str(request_number) + ".glb"
-            filename_png = "input_png/request_" + str(request_number) + ".png"
-            file_glb.save(filename_glb)
-            file_png.save(filename_png)
-            request_number += 1
-
-            # Call the pipeline function
-            stl_file_path_person, stl_file_path_electrode = create_electrodes_stl(filename_glb, filename_png)
-
-
-            print("Returning STL file:", stl_file_path_person, "and, ", stl_file_path_electrode)
-
-            # Create a zip file in memory
-            memory_file = io.BytesIO()
-            with zipfile.ZipFile(memory_file, 'w') as zf:
-                zf.write(stl_file_path_person, "person.stl")
-                zf.write(stl_file_path_electrode, "electrode.stl")
-
-            # Reset the memory file pointer
-            memory_file.seek(0)
-
-            # Return the zip file
-            return send_file(
-                memory_file,
-                mimetype='application/zip',
-                as_attachment=True,
-                download_name='stl_files.zip'
-            )
+            timings = StageTimings()
+            slot = None
+
+            def finish():
+                # Runs once the body has been written, or as soon as the run fails: the
+                # profile covers the export and the streaming too, and failed runs are
+                # often the interesting ones, so their profile is kept as well
+                try:
+                    if profiler is not None:
+                        profiler.stop()
+                        profiler.save(profile_dir)
+                finally:
+                    if slot is not None:
+                        slot.release()
+
+            if profiler is not None:
+                profiler.start()
+            try:
+                filename_glb, filename_png = save_upload(file_glb, file_png, timings)
+                slot = admit_run(timings)
+                session_id, entries = process_upload(filename_glb, filename_png, options, timings)
+            except Exception:
+                finish()
+                raise
+
+            # Stream a compressed zip built straight from the meshes. Clients that accept
+            # gzip get it as the transfer encoding, everyone else gets deflated entries.
+            gzip_encoding = request.accept_encodings['gzip'] > 0
+            body = stream_entries_zip(entries, gzip_encoding=gzip_encoding)
+
+            response = Response(stream_with_context(body), mimetype='application/zip')
+            response.headers["Content-Disposition"] = "attachment; filename=stl_files.zip"
+            response.headers["Vary"] = "Accept-Encoding"
+            if gzip_encoding:
+                response.headers["Content-Encoding"] = "gzip"
+            response.headers["X-Session-Id"] = session_id
+            # Per-stage durations up to the start of the response, read by load_test.py
+            response.headers["Server-Timing"] = timings.server_timing()
+            if profiler is not None:
+                # Saved under this name once the body has been written
+                response.headers["X-Profile"] = url_for('get_profile', name=profiler.name)
+            # The zip is built while it is sent, so the profiler runs and the run slot is
+            # held until the body has been written (or the client went away)
+            response.call_on_close(finish)
+            return response
         
     return '''
     <!doctype html>
@@ -74,14 +285,178 @@ def upload_file():
     </form>
     '''
 
+def run_job(job, filename_glb, filename_png, options, timings, profiler=None):
+    # Body of a background job: every finished stage is reported through the job's
+    # events, and a cancelled job stops at the next stage boundary. A profiled job
+    # links its profile from the final event.
+    try:
+        with profiler or nullcontext(), admit_run(timings):
+            session_id, entries = process_upload(filename_glb, filename_png, options, timings)
+            with timings.stage("export"):
+                job.write_result(stream_entries_zip(entries))
+        stage_seconds = {name: round(seconds, 3) for name, seconds in timings.as_dict().items()}
+        job.emit("done", session_id=session_id, result=f"/jobs/{job.id}/result", timings=stage_seconds,
+                 **_job_profile(job, profiler))
+    except JobCancelled:
+        print(f"Job {job.id} cancelled")
+        job.emit("cancelled", **_job_profile(job, profiler))
+    except Exception as e:
+        status = error_status(e)
+        if status == 500:
+            traceback.print_exc()
+        job.emit("error", status=status, error=str(e), **_job_profile(job, profiler))
+
+def _job_profile(job, profiler):
+    # Event field linking the saved profile of a job
+    if profiler is None:
+        return {}
+    job.write_profile(profiler)
+    return {"profile": f"/jobs/{job.id}/profile"}
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    # Same form as /upload, but the pipeline runs in the background. The answer points
+    # to an event stream with the progress of each stage and, once done, the result zip.
+    admission.check_capacity()
+    file_glb = request.files.get('file_glb')
+    file_png = request.files.get('file_png')
+    if not file_glb or not file_png:
+        raise InvalidInput("Both file_glb and file_png are required")
+    options = upload_options(request.form)
+    profiler = request_profiler()
+
+    job = Job.create(job_dir=job_dir)
+    timings = StageTimings(listener=job.stage_listener)
+    try:
+        filename_glb, filename_png = save_upload(file_glb, file_png, timings)
+    except Exception:
+        job.remove()
+        raise
+
+    # Not a daemon thread, so a shutting down worker lets the job finish
+    threading.Thread(target=run_job, args=(job, filename_glb, filename_png, options, timings, profiler),
+                     name=f"job-{job.id}").start()
+
+    response = jsonify(job_id=job.id, events=f"/jobs/{job.id}/events", result=f"/jobs/{job.id}/result")
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = Job.open(job_id, job_dir)
+    if job is None:
+        return jsonify(error="Unknown or expired job"), 404
+    return jsonify(job_id=job.id, status=job.status())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    # Server-Sent Events: started, stage (with its label and duration), then done, error
+    # or cancelled. Reconnecting clients resume after their Last-Event-ID.
+    job = Job.open(job_id, job_dir)
+    if job is None:
+        return jsonify(error="Unknown or expired job"), 404
+    events = iter_sse(job, last_event_id=request.headers.get("Last-Event-ID"))
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers["Cache-Control"] = "no-cache"
+    # Keep nginx from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = Job.open(job_id, job_dir)
+    if job is None:
+        return jsonify(error="Unknown or expired job"), 404
+    if not os.path.isfile(job.result_path):
+        return jsonify(error="Job has no result", status=job.status()), 409
+    return send_file(os.path.abspath(job.result_path), mimetype='application/zip', as_attachment=True,
+                     download_name="stl_files.zip")
+
+@app.route('/jobs/<job_id>/profile', methods=['GET'])
+def job_profile(job_id):
+    job = Job.open(job_id, job_dir)
+    if job is None:
+        return jsonify(error="Unknown or expired job"), 404
+    path = job.profile_path
+    if path is None:
+        return jsonify(error="Job was not profiled or has not finished", status=job.status()), 409
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f"job_{job.id}{os.path.splitext(path)[1]}")
+
+@app.route('/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    # Profiles of requests to /upload, linked from their X-Profile header and saved once
+    # the response body has been written
+    path = profile_path(name, profile_dir)
+    if path is None:
+        return jsonify(error="Unknown or expired profile"), 404
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream', as_attachment=True,
+                     download_name=name)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    # Cancel a running job at its next stage, or remove a finished one
+    job = Job.open(job_id, job_dir)
+    if job is None:
+        return jsonify(error="Unknown or expired job"), 404
+    status = job.status()
+    if status is not None and status["event"] in TERMINAL_EVENTS:
+        job.remove()
+        return '', 204
+    job.cancel()
+    return jsonify(job_id=job.id, cancelling=True), 202
+
+@app.route('/sessions/<session_id>/relayout', methods=['POST'])
+def relayout_session(session_id):
+    # Re-place the electrodes of a previous upload with new layout parameters.
+    # The JSON body may set sphere_radius, outward_offset, rings
+    # ([[radius_ratio, count, skip_bottom], ...]), format and include_head.
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify(error="Unknown or expired session"), 404
+
+    body = request.get_json(silent=True)
+    try:
+        params = parse_relayout_params(body)
+        output_format, include_head = parse_output_params(body)
+    except (ValueError, TypeError) as e:
+        return jsonify(error=str(e)), 400
+
+    # Layout and export take a run slot like an upload, held until the file has been sent
+    slot = admission.admit().acquire()
+    try:
+        electrode_mesh, instances = relayout(session, **params)
+        name, chunks = export_entries(output_format, session["head_mesh"], electrode_mesh, instances,
+                                      electrodes_only=not include_head)[1]
+    except Exception:
+        slot.release()
+        raise
+
+    response = Response(stream_with_context(chunks), mimetype='application/octet-stream')
+    response.headers["Content-Disposition"] = f"attachment; filename={name}"
+    response.call_on_close(slot.release)
+    return response
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.delete(session_id):
+        return jsonify(error="Unknown or expired session"), 404
+    return '', 204
+
 @app.route('/shutdown', methods=['GET'])
 def shutdown():
-    func = request.environ.get('werkzeug.server.shutdown')
-    if func is None:
-        raise RuntimeError('Not running with the Werkzeug Server')
-    func()
+    # Graceful shutdown of the whole server, only from the machine it runs on. Under
+    # gunicorn the master process is signalled (EEG_SERVER_PID, set in gunicorn.conf.py)
+    # and drains all workers, otherwise this process drains and exits.
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify(error="Shutdown is only allowed from localhost"), 403
+    os.kill(int(os.environ.get("EEG_SERVER_PID", os.getpid())), signal.SIGTERM)
     return 'Server shutting down...'
 
 
 if __name__ == '__main__':
+    # Development server. For production use gunicorn -c gunicorn.conf.py server:app
+    install_signal_handlers()
+    warm_up()
     app.run(port=8080)
\ No newline at end of file
@@ -0,0 +1,255 @@
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import numpy as np
+from compact_mesh import CompactMesh
+from point_sets import PointSet
+from model_generation import (DEFAULT_RINGS, DEFAULT_OUTWARD_OFFSET, generate_electrode_layout,
+                              scale_electrode_template, cached_electrode_template, CENTRAL_INDEX)
+from export_formats import FORMATS
+from electrode_checks import check_electrode_layout
+from mesh_cache import load_head_mesh
+from input_validation import InvalidInput
+from cache_utils import touch, evict_lru
+
+# In-memory store of per-patient state kept after a pipeline run, so technicians can
+# re-layout electrodes without re-uploading. Each session keeps the oriented head mesh
+# (a CompactMesh, with its ray index built on first use), the aligned reference
+# points and the unscaled electrode template.
+#
+# With several server worker processes a relayout may reach a worker that did not run
+# the upload. Sessions are therefore also written to spill_dir as a small JSON record
+# (mesh cache key, aligned points) from which any worker can restore them, reopening
+# the oriented head from the mesh cache.
+
+DEFAULT_MAX_SESSIONS = 16
+DEFAULT_TTL_SECONDS = 30 * 60
+SPILL_DIR = "cache/sessions"
+
+# Every electrode of a relayout is ray-cast and collision-checked, so requests are capped
+MAX_RING_COUNT = 128
+MAX_RELAYOUT_ELECTRODES = 512
+
+class SessionStore:
+    """
+    Thread-safe LRU store of sessions with a time-to-live since last access.
+    """
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS, ttl_seconds=DEFAULT_TTL_SECONDS, spill_dir=None,
+                 max_spilled=None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        # Directory shared by all worker processes, None to keep sessions in this process only
+        self.spill_dir = spill_dir
+        self.max_spilled = max_spilled if max_spilled is not None else 8 * max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, head_mesh, aligned_points, electrode_template, mesh_key=None, electrode_file="electrode.stl"):
+        """
+        Register the state of a finished pipeline run.
+
+        Parameters:
+        mesh_key (str): Mesh cache key of the head, needed to restore the session in another process
+        electrode_file (str): Path of the electrode template, reloaded on restore
+
+        Returns:
+        str: The new session id
+        """
+        session_id = uuid.uuid4().hex
+        session = _new_session(head_mesh, aligned_points, electrode_template)
+        with self._lock:
+            self._sessions[session_id] = session
+            self._evict()
+        if self.spill_dir is not None and mesh_key is not None:
+            self._spill(session_id, mesh_key, aligned_points, electrode_file)
+        return session_id
+
+    def get(self, session_id):
+        """
+        Return the session and mark it as recently used, or None if it is unknown or expired.
+        """
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session["last_access"] = time.monotonic()
+                self._sessions.move_to_end(session_id)
+                if self.spill_dir is not None:
+                    touch(self._spill_path(session_id))
+                return session
+
+        # Created by another worker process, or evicted here but still on disk
+        session = self._restore(session_id)
+        if session is None:
+            return None
+        with self._lock:
+            session = self._sessions.setdefault(session_id, session)
+            self._evict()
+        return session
+
+    def delete(self, session_id):
+        removed = False
+        path = self._spill_path(session_id)
+        if path is not None:
+            try:
+                os.remove(path)
+                removed = True
+            except OSError:
+                pass
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None or removed
+
+    def _spill_path(self, session_id):
+        # Session ids are uuid hex strings, anything else never names a file
+        if self.spill_dir is None or not session_id or not all(c in "0123456789abcdef" for c in session_id):
+            return None
+        return os.path.join(self.spill_dir, session_id + ".json")
+
+    def _spill(self, session_id, mesh_key, aligned_points, electrode_file):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        record = {"mesh_key": mesh_key, "electrode_file": electrode_file,
+                  "aligned_points": np.asarray(aligned_points, dtype=float).tolist()}
+        # Write to a hidden file and rename it into place so readers never see half a record
+        fd, tmp_path = tempfile.mkstemp(prefix=".", dir=self.spill_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._spill_path(session_id))
+        evict_lru(self.spill_dir, self.max_spilled)
+
+    def _restore(self, session_id):
+        path = self._spill_path(session_id)
+        if path is None:
+            return None
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        head = load_head_mesh(record["mesh_key"])
+        if head is None:
+            # The head mesh was evicted from the mesh cache
+            return None
+        touch(path)
+        head_mesh = CompactMesh(head["vertices"], head["faces"])
+        return _new_session(head_mesh, PointSet.reference(record["aligned_points"], frame="head"),
+                            cached_electrode_template(record["electrode_file"]))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _evict(self):
+        # Caller holds self._lock. Drop expired sessions, then the least recently used.
+        now = time.monotonic()
+        expired = [sid for sid, s in self._sessions.items() if now - s["last_access"] > self.ttl_seconds]
+        for sid in expired:
+            del self._sessions[sid]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+def _new_session(head_mesh, aligned_points, electrode_template):
+    return {
+        "head_mesh": head_mesh,
+        "aligned_points": aligned_points,
+        "electrode_template": electrode_template,
+        "last_access": time.monotonic(),
+        # Relayouts of one session share the head mesh and its ray index.
+        "lock": threading.Lock(),
+    }
+
+def relayout(session, sphere_radius=0.01, rings=DEFAULT_RINGS, outward_offset=DEFAULT_OUTWARD_OFFSET):
+    """
+    Place a new electrode layout on the head of a session.
+
+    Parameters:
+    session (dict): Session from SessionStore.get
+    sphere_radius (float): Electrode size, see scale_electrode_template
+    rings (sequence): (radius ratio, count, skip bottom) for each ring
+    outward_offset (float): Distance to move each electrode outward from the surface
+
+    Returns:
+    tuple: (scaled electrode mesh, (4x4 transform, RGBA color) electrode instances)
+    """
+    electrode_mesh = scale_electrode_template(session["electrode_template"], sphere_radius)
+    with session["lock"]:
+        instances = generate_electrode_layout(session["aligned_points"], session["head_mesh"],
+                                              rings=rings, outward_offset=outward_offset)
+        instances, _ = check_electrode_layout(session["head_mesh"], electrode_mesh, instances, central=CENTRAL_INDEX)
+    return electrode_mesh, instances
+
+def _json_object(params):
+    # A missing body means the defaults; any other JSON value than an object is rejected
+    if params is None:
+        return {}
+    if not isinstance(params, dict):
+        raise InvalidInput("The request body must be a JSON object")
+    return params
+
+def parse_relayout_params(params):
+    """
+    Validate the JSON body of a relayout request.
+
+    Returns:
+    dict: Keyword arguments for relayout
+
+    Raises:
+    ValueError: If the body is not an object or a parameter is missing its expected type or range
+    """
+    params = _json_object(params)
+    kwargs = {}
+
+    # The ring layout has no intermediate landmarks, so the ratio would silently do nothing
+    if "intermediate_ratio" in params:
+        raise InvalidInput("intermediate_ratio does not apply to the ring layout")
+
+    for name in ("sphere_radius", "outward_offset"):
+        if name in params:
+            value = params[name]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError(f"{name} must be a finite number")
+            kwargs[name] = float(value)
+
+    if kwargs.get("sphere_radius", 1.0) <= 0:
+        raise ValueError("sphere_radius must be positive")
+
+    if "rings" in params:
+        if not isinstance(params["rings"], (list, tuple)):
+            raise ValueError("rings must be a list of rings")
+        rings = []
+        for ring in params["rings"]:
+            if not isinstance(ring, (list, tuple)) or len(ring) not in (2, 3):
+                raise ValueError("each ring must be [radius_ratio, count] or [radius_ratio, count, skip_bottom]")
+            radius_ratio, count = float(ring[0]), int(ring[1])
+            if not math.isfinite(radius_ratio) or radius_ratio <= 0 or not 1 <= count <= MAX_RING_COUNT:
+                raise ValueError(f"ring radius_ratio must be a positive finite number and count between 1 and "
+                                 f"{MAX_RING_COUNT}")
+            rings.append((radius_ratio, count, bool(ring[2]) if len(ring) == 3 else False))
+        # The central electrode is placed in addition to the rings
+        if sum(count for _, count, _ in rings) + 1 > MAX_RELAYOUT_ELECTRODES:
+            raise ValueError(f"a layout may have at most {MAX_RELAYOUT_ELECTRODES} electrodes")
+        kwargs["rings"] = tuple(rings)
+
+    return kwargs
+
+def parse_output_params(params):
+    """
+    Output options of a relayout request: format (one of export_formats.FORMATS) and include_head.
+
+    Returns:
+    tuple: (format, include_head)
+    """
+    params = _json_object(params)
+    fmt = params.get("format", "stl")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    return fmt, bool(params.get("include_head", False))
@@ -0,0 +1,135 @@
+import os
+import uuid
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+from compact_mesh import CompactMesh
+
+# Head meshes shared with worker processes without copying. share_mesh places the
+# vertex and face arrays of a mesh in one multiprocessing.shared_memory segment and
+# yields a SharedMeshHandle, a few names and numbers that pickle in microseconds. The
+# workers of a pool attach the handle and get a CompactMesh whose arrays view the
+# segment, so every worker reads the one copy of the scan (run_sweep's workers check
+# each variant's electrodes against it this way).
+#
+# Segment layout:
+#   [0, 12n)           (n, 3) float32 vertices
+#   [12n, 12n + 12m)   (m, 3) int32 faces
+#
+# The process that shared the mesh owns the segment: it is removed when share_mesh's
+# block exits, by which time the pool using it has shut down. If the owner dies instead,
+# the multiprocessing resource tracker, which the workers share with it, removes the
+# segment once they have all exited. Segments outliving even the tracker (the whole
+# process group killed) carry the owner's pid in their name, and the next share_mesh
+# removes those whose owner is gone.
+#
+# Usage:
+#   with share_mesh(head_mesh) as handle, ProcessPoolExecutor(initializer=init, initargs=(handle,)) as pool:
+#       ...                               # in init: head_mesh = handle.attach()
+
+SEGMENT_PREFIX = "eeg_mesh_"
+# Where POSIX shared memory segments show up as files, None where they do not
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Segments attached by this process, kept open while their arrays may be in use
+_attached = {}
+
+class SharedMeshHandle:
+    """
+    Picklable reference to a mesh in shared memory, see share_mesh.
+    """
+
+    def __init__(self, name, n_vertices, n_faces):
+        self.name = name
+        self.n_vertices = n_vertices
+        self.n_faces = n_faces
+
+    def __repr__(self):
+        return f"SharedMeshHandle({self.name!r}, {self.n_vertices} vertices, {self.n_faces} faces)"
+
+    @property
+    def nbytes(self):
+        return 12 * self.n_vertices + 12 * self.n_faces
+
+    def attach(self):
+        """
+        The shared mesh as a CompactMesh with read-only arrays viewing the segment. The
+        segment stays mapped in this process until it exits, so the mesh can be kept for
+        the life of a worker.
+        """
+        segment = _attached.get(self.name)
+        if segment is None:
+            try:
+                segment = shared_memory.SharedMemory(name=self.name)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Shared mesh {self.name} was already removed") from None
+            _attached[self.name] = segment
+        vertices = np.ndarray((self.n_vertices, 3), dtype=np.float32, buffer=segment.buf)
+        faces = np.ndarray((self.n_faces, 3), dtype=np.int32, buffer=segment.buf, offset=vertices.nbytes)
+        vertices.flags.writeable = False
+        faces.flags.writeable = False
+        return CompactMesh(vertices, faces)
+
+def _segment_name():
+    return f"{SEGMENT_PREFIX}{os.getpid()}_{uuid.uuid4().hex[:16]}"
+
+@contextmanager
+def share_mesh(mesh):
+    """
+    Copy the vertices and faces of a mesh into a new shared memory segment, removed
+    when the block exits.
+
+    Parameters:
+    mesh: CompactMesh, trimesh or anything with vertices and faces arrays
+
+    Yields:
+    SharedMeshHandle: Handle for the worker processes, see SharedMeshHandle.attach
+    """
+    remove_stale_segments()
+    vertices = np.ascontiguousarray(mesh.vertices, dtype=np.float32)
+    faces = np.ascontiguousarray(mesh.faces, dtype=np.int32)
+    handle = SharedMeshHandle(_segment_name(), len(vertices), len(faces))
+
+    # Segments cannot be empty
+    segment = shared_memory.SharedMemory(name=handle.name, create=True, size=max(handle.nbytes, 1))
+    try:
+        segment.buf[:vertices.nbytes] = vertices.tobytes()
+        segment.buf[vertices.nbytes:handle.nbytes] = faces.tobytes()
+        yield handle
+    finally:
+        segment.close()
+        segment.unlink()
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def remove_stale_segments(shm_dir=SHM_DIR):
+    """
+    Remove the shared meshes whose owning process no longer exists. Only possible where
+    segments are visible as files (Linux); elsewhere the resource tracker is relied on.
+
+    Returns:
+    list: Names of the removed segments
+    """
+    if shm_dir is None or not os.path.isdir(shm_dir):
+        return []
+    removed = []
+    for name in os.listdir(shm_dir):
+        if not name.startswith(SEGMENT_PREFIX):
+            continue
+        owner = name[len(SEGMENT_PREFIX):].split("_", 1)[0]
+        if not owner.isdigit() or _process_exists(int(owner)):
+            continue
+        try:
+            os.remove(os.path.join(shm_dir, name))
+            removed.append(name)
+        except OSError:
+            # Removed by another process meanwhile
+            continue
+    return removed
@@ -0,0 +1,236 @@
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from cache_utils import file_sha256, cache_key, touch, evict_lru
+
+# Memoized graph of pipeline stages. Each stage declares the values it reads (sources
+# or outputs of other stages) and the parameters it depends on. A stage's result is
+# stored under a key derived from its name, version, parameter values and the keys of
+# its inputs, so changing a parameter or an input file only recomputes the stages that
+# depend on it. Results are kept in pluggable backends, looked up in order:
+#
+#   MemoryBackend  LRU of live objects in this process
+#   DiskBackend    pickled results under cache/stages, shared between processes
+#
+# Stages marked persist=False (cheap to rebuild, or already cached on disk elsewhere)
+# are only kept in backends that are not persistent.
+
+class _Missing:
+    def __repr__(self):
+        return "MISSING"
+
+MISSING = _Missing()
+
+class Stage:
+    """
+    One node of a StageGraph.
+
+    Parameters:
+    name (str): Name of the stage and of its output
+    func (callable): Called with the inputs and parameters as keyword arguments
+    inputs (tuple): Names of the sources or stage outputs the stage reads
+    params (tuple): Names of the parameters the stage depends on
+    version (int or str): Bump when the stage's code changes so stale results are not reused
+    persist (bool): Whether the result may be stored in persistent backends
+    """
+
+    def __init__(self, name, func, inputs=(), params=(), version=1, persist=True):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = tuple(params)
+        self.version = version
+        self.persist = persist
+
+class MemoryBackend:
+    """
+    In-process LRU of stage results. Results are shared, not copied, so stages must not
+    modify their inputs.
+    """
+
+    persistent = False
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return MISSING
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class DiskBackend:
+    """
+    Stage results pickled to files named by their key, with LRU eviction.
+    """
+
+    persistent = True
+
+    def __init__(self, cache_dir="cache/stages", max_entries=256):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def get(self, key):
+        path = os.path.join(self.cache_dir, key + ".pkl")
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return MISSING
+        touch(path)
+        return value
+
+    def put(self, key, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write to a hidden file and rename it into place so readers never see half a result
+        fd, tmp_path = tempfile.mkstemp(prefix=".", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, os.path.join(self.cache_dir, key + ".pkl"))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        evict_lru(self.cache_dir, self.max_entries)
+
+def _value_key(value):
+    # Key of a source or parameter value. Values must have a stable JSON or repr form.
+    try:
+        return json.dumps(value, sort_keys=True)
+    except TypeError:
+        return repr(value)
+
+class StageGraph:
+    """
+    A set of stages, run lazily for the outputs that are asked for.
+
+    Parameters:
+    stages (list): Stage objects, in any order
+    file_sources (tuple): Sources that are file paths, keyed by their contents rather than their name
+    """
+
+    def __init__(self, stages, file_sources=()):
+        self.stages = {stage.name: stage for stage in stages}
+        self.file_sources = set(file_sources)
+        for stage in stages:
+            if stage.name in self.file_sources:
+                raise ValueError(f"Stage {stage.name} has the name of a source")
+
+    def _needed(self, targets):
+        # Stages the targets depend on, dependencies first
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order or name not in self.stages:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage graph has a cycle through {name}")
+            visiting.add(name)
+            for input_name in self.stages[name].inputs:
+                visit(input_name)
+            visiting.discard(name)
+            order.append(name)
+
+        for target in targets:
+            if target not in self.stages:
+                raise KeyError(f"Unknown stage {target}")
+            visit(target)
+        return order
+
+    def keys(self, sources, params, targets):
+        """
+        Cache keys of the targets and the stages they depend on. Computing them reads
+        the source files but runs no stage.
+
+        Returns:
+        dict: Name -> key, for the sources and stages involved
+        """
+        keys = {}
+        for name in self._needed(targets):
+            stage = self.stages[name]
+            input_keys = []
+            for input_name in stage.inputs:
+                if input_name not in keys:
+                    if input_name not in sources:
+                        raise KeyError(f"Stage {name} needs {input_name}, which is neither a stage nor a source")
+                    value = sources[input_name]
+                    keys[input_name] = (file_sha256(value) if input_name in self.file_sources
+                                        else cache_key(_value_key(value)))
+                input_keys.append(keys[input_name])
+            missing = [p for p in stage.params if p not in params]
+            if missing:
+                raise KeyError(f"Stage {name} needs the parameters {', '.join(missing)}")
+            param_key = _value_key({p: params[p] for p in stage.params})
+            keys[name] = cache_key(name, stage.version, param_key, *input_keys)
+        return keys
+
+    def run(self, sources, params, targets, backends=(), timings=None):
+        """
+        Produce the targets, reusing every stage result found in the backends.
+
+        Parameters:
+        sources (dict): Source values (file paths for file_sources)
+        params (dict): Parameter values, each stage reads the ones it declares
+        targets (list): Names of the stage outputs wanted
+        backends (sequence): Backends to look results up in and store them to, fastest first
+        timings (stage_timing.StageTimings): Records the duration of each stage that runs
+
+        Returns:
+        tuple: (dict of target name -> value, dict of stage name -> "computed" or the
+                class name of the backend it came from, for the stages visited)
+        """
+        keys = self.keys(sources, params, targets)
+        values = {}
+        statuses = {}
+
+        def resolve(name):
+            if name in values:
+                return values[name]
+            if name not in self.stages:
+                return sources[name]
+            stage = self.stages[name]
+            usable = [b for b in backends if stage.persist or not b.persistent]
+
+            for i, backend in enumerate(usable):
+                value = backend.get(keys[name])
+                if value is not MISSING:
+                    # Promote the result to the faster backends
+                    for faster in usable[:i]:
+                        faster.put(keys[name], value)
+                    statuses[name] = type(backend).__name__
+                    values[name] = value
+                    return value
+
+            kwargs = {input_name: resolve(input_name) for input_name in stage.inputs}
+            kwargs.update({p: params[p] for p in stage.params})
+            if timings is not None:
+                with timings.stage(name):
+                    value = stage.func(**kwargs)
+            else:
+                value = stage.func(**kwargs)
+            for backend in usable:
+                backend.put(keys[name], value)
+            statuses[name] = "computed"
+            values[name] = value
+            return value
+
+        outputs = {target: resolve(target) for target in targets}
+        return outputs, statuses
@@ -0,0 +1,63 @@
+import time
+from contextlib import contextmanager
+
+# Wall-clock timings of the pipeline stages of one request. The server reports them in
+# a Server-Timing response header, which the load-test harness (load_test.py) collects,
+# and as progress events of background jobs (jobs.py).
+
+class StageTimings:
+    """
+    Ordered (stage name, seconds) records of one run. If given, listener(name, seconds)
+    is called as each stage finishes; an exception it raises aborts the run.
+
+    Usage:
+        timings = StageTimings()
+        with timings.stage("landmarks"):
+            ...
+    """
+
+    def __init__(self, listener=None):
+        self.stages = []
+        self.listener = listener
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+        if self.listener is not None:
+            self.listener(name, seconds)
+
+    def as_dict(self):
+        # Stages that ran more than once are summed
+        totals = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def server_timing(self):
+        """
+        Format the timings as a Server-Timing header value, durations in milliseconds.
+        """
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.as_dict().items())
+
+def parse_server_timing(value):
+    """
+    Parse a Server-Timing header value into stage name -> seconds.
+    """
+    timings = {}
+    for metric in (value or "").split(","):
+        parts = [p.strip() for p in metric.split(";")]
+        if not parts[0]:
+            continue
+        for param in parts[1:]:
+            key, _, number = param.partition("=")
+            if key.strip() == "dur":
+                try:
+                    timings[parts[0]] = float(number) / 1000.0
+                except ValueError:
+                    pass
+    return timings
@@ -0,0 +1,197 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import trimesh
+from model_generation import (DEFAULT_RINGS, DEFAULT_OUTWARD_OFFSET, DEFAULT_CENTRAL_OFFSET,
+                              read_reference_points, load_electrode_template, scale_electrode_template,
+                              layout_center, ring_points, closest_ray_hits, offset_electrode_points,
+                              electrode_instances, combine_electrode_model, CENTRAL_INDEX)
+from electrode_checks import check_electrode_layout
+from compact_mesh import CompactMesh
+from shared_mesh import share_mesh
+
+# Parameter sweeps of the concentric ring layout for fitting studies.
+# The reference points, head mesh and electrode template are loaded once, the rays of
+# every variant are cast against the head in one batch, and the per-variant electrodes
+# are checked against the head (as the pipeline and relayouts do, see electrode_checks)
+# and exported in parallel across cores. The workers read the head from shared memory
+# (shared_mesh).
+
+def expand_grid(grid):
+    """
+    Expand a grid of parameter values into a list of parameter sets.
+
+    Parameters:
+    grid (dict): Parameter name -> list of values, e.g.
+                 {"sphere_radius": [0.01, 0.015], "outward_offset": [0.01, 0.02]}
+
+    Returns:
+    list: One dict per combination, in itertools.product order
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def _variant_rings(params):
+    # Rings as hashable tuples of (radius ratio, count, skip bottom)
+    rings = params.get("rings", DEFAULT_RINGS)
+    return tuple((float(r[0]), int(r[1]), bool(r[2]) if len(r) > 2 else False) for r in rings)
+
+def sweep_positions(original_points, head_mesh, param_sets):
+    """
+    Compute the electrode positions of every parameter set with a single ray query.
+
+    Parameters:
+    original_points (array): 4x3 aligned reference points
+    head_mesh (CompactMesh): Oriented head mesh
+    param_sets (list): Dicts with any of rings, outward_offset (sphere_radius and
+                       intermediate_ratio do not move the electrodes)
+
+    Returns:
+    tuple: (positions (list of (k, 3) arrays, one per parameter set), center_point, outer_radius)
+    """
+    center_point, outer_radius = layout_center(original_points)
+
+    # Variants that share a ring layout share their rays, so only cast the distinct ones.
+    ring_layouts = {}
+    for params in param_sets:
+        rings = _variant_rings(params)
+        if rings not in ring_layouts:
+            ring_layouts[rings] = ring_points(center_point, outer_radius, rings)
+
+    origins = [p for points in ring_layouts.values() for p in points]
+    print(f"Casting {len(origins)} rays for {len(ring_layouts)} ring layouts and {len(param_sets)} variants")
+    hits, hit_mask = closest_ray_hits(head_mesh, origins)
+    if not hit_mask.all():
+        print(f"Warning: {np.count_nonzero(~hit_mask)} rays did not hit the head. Keeping original positions.")
+
+    layout_hits = {}
+    start = 0
+    for rings, points in ring_layouts.items():
+        layout_hits[rings] = hits[start:start + len(points)]
+        start += len(points)
+
+    positions = []
+    for params in param_sets:
+        outward_offset = params.get("outward_offset", DEFAULT_OUTWARD_OFFSET)
+        shifted = offset_electrode_points(layout_hits[_variant_rings(params)], center_point, outward_offset)
+        positions.append(np.array(shifted).reshape(-1, 3))
+
+    return positions, center_point, outer_radius
+
+# Electrode template and head shared by the worker processes, set once per worker. The
+# head is attached from shared memory, so the workers do not each get a copy of the scan.
+_worker_template = None
+_worker_head = None
+
+def _init_worker(electrode_template, head_handle):
+    global _worker_template, _worker_head
+    _worker_template = electrode_template
+    _worker_head = head_handle.attach()
+
+def _export_variant(job):
+    # Check one variant's electrodes against the head and export them (unless
+    # output_path is None). Returns the checked electrode positions, central one excluded.
+    index, points, center_point, outer_radius, sphere_radius, central_offset, output_path = job
+    electrode_mesh = scale_electrode_template(_worker_template, sphere_radius)
+    instances = electrode_instances(list(points), center_point, outer_radius, central_offset=central_offset)
+    instances, _ = check_electrode_layout(_worker_head, electrode_mesh, instances, central=CENTRAL_INDEX)
+    if output_path is not None:
+        combine_electrode_model(electrode_mesh, instances).export(output_path)
+    checked = np.array([transform[:3, 3] for i, (transform, _) in enumerate(instances) if i != CENTRAL_INDEX])
+    return index, checked.reshape(-1, 3), output_path
+
+def write_summary(summary_path, param_sets, positions):
+    """
+    Write one row per electrode of every variant: variant, electrode, x, y, z and the variant's parameters.
+    """
+    param_names = sorted({name for params in param_sets for name in params})
+    with open(summary_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["variant", "electrode", "x", "y", "z"] + param_names)
+        for index, (params, points) in enumerate(zip(param_sets, positions)):
+            values = [json.dumps(params[n]) if n in params else "" for n in param_names]
+            for electrode, point in enumerate(points):
+                writer.writerow([index, electrode, *(f"{c:.6f}" for c in point)] + values)
+    return summary_path
+
+def run_sweep(xyz_file_path, head_mesh_file, param_sets, electrode_file="electrode.stl",
+              output_dir="sweep_output", summary_only=False, workers=None):
+    """
+    Run a parameter sweep of the ring layout.
+
+    Parameters:
+    xyz_file_path (str or PointSet): Aligned reference points, or a point set file (.npz or .xyz) holding them
+    head_mesh_file (str, CompactMesh or trimesh.Trimesh): Oriented head mesh
+    param_sets (list): Parameter dicts (sphere_radius, intermediate_ratio, rings, outward_offset,
+                       central_offset), see expand_grid
+    electrode_file (str): Path to the electrode STL file
+    output_dir (str): Directory for summary.csv and one electrodes STL per variant
+    summary_only (bool): Only write the summary table of positions
+    workers (int): Worker processes for the checks and the export, defaults to the number of cores
+
+    Returns:
+    dict: summary path and the list of variant STL paths (empty when summary_only)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    original_points = read_reference_points(xyz_file_path)
+    if isinstance(head_mesh_file, CompactMesh):
+        head_mesh = head_mesh_file
+    elif isinstance(head_mesh_file, trimesh.Trimesh):
+        head_mesh = CompactMesh.from_trimesh(head_mesh_file)
+    else:
+        head_mesh = CompactMesh.from_trimesh(trimesh.load(head_mesh_file))
+
+    positions, center_point, outer_radius = sweep_positions(original_points, head_mesh, param_sets)
+
+    jobs = []
+    for index, (params, points) in enumerate(zip(param_sets, positions)):
+        jobs.append((index, points, center_point, outer_radius,
+                     params.get("sphere_radius", 0.01),
+                     params.get("central_offset", DEFAULT_CENTRAL_OFFSET),
+                     None if summary_only else os.path.join(output_dir, f"variant_{index}.stl")))
+
+    # Electrodes too close to the scalp are pushed outward, so the summary lists the
+    # checked positions, the ones /upload or a relayout with the same parameters returns
+    variant_paths = [None] * len(jobs)
+    checked_positions = [None] * len(jobs)
+    electrode_template = load_electrode_template(electrode_file)
+    with share_mesh(head_mesh) as head_handle, \
+            ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                initializer=_init_worker, initargs=(electrode_template, head_handle)) as pool:
+        for index, checked, path in pool.map(_export_variant, jobs):
+            checked_positions[index] = checked
+            variant_paths[index] = path
+
+    summary_path = write_summary(os.path.join(output_dir, "summary.csv"), param_sets, checked_positions)
+    print(f"Sweep summary of {len(param_sets)} variants saved to: {summary_path}")
+
+    if summary_only:
+        return {"summary": summary_path, "variants": []}
+    print(f"Saved {len(variant_paths)} electrode layouts to: {output_dir}")
+    return {"summary": summary_path, "variants": variant_paths}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep electrode layout parameters over one head")
+    parser.add_argument("grid", help="JSON file with a list of parameter sets, or a dict of parameter -> list of values")
+    parser.add_argument("--xyz", default="aligned_points.npz", help="Aligned reference points (.npz or .xyz)")
+    # No default: the oriented head is only at output_stl/rotated_model.stl when the scan
+    # had to be turned, otherwise it is the conversion beside the GLB (the person_stl of
+    # run_pipeline), so a default path could silently pick up another scan's head
+    parser.add_argument("--head", required=True, help="Oriented head mesh, the person STL written by the pipeline")
+    parser.add_argument("--electrode", default="electrode.stl", help="Electrode STL")
+    parser.add_argument("-o", "--output", default="sweep_output", help="Output directory")
+    parser.add_argument("--summary-only", action="store_true", help="Only write summary.csv")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        grid = json.load(f)
+    param_sets = grid if isinstance(grid, list) else expand_grid(grid)
+
+    run_sweep(args.xyz, args.head, param_sets, electrode_file=args.electrode, output_dir=args.output,
+              summary_only=args.summary_only, workers=args.workers)
@@ -0,0 +1,18 @@
+import pytest
+from admission import AdmissionController, Overloaded
+
+def test_slot_is_held_until_released_once():
+    controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=0.01)
+    slot = controller.admit().acquire()
+    assert controller.running == 1
+    with pytest.raises(Overloaded):
+        controller.admit().acquire()
+    slot.release()
+    slot.release()
+    assert controller.running == 0
+
+def test_acquired_slot_works_as_context_manager():
+    controller = AdmissionController(max_concurrent=1)
+    with controller.admit().acquire():
+        assert controller.running == 1
+    assert controller.running == 0
@@ -0,0 +1,64 @@
+import hashlib
+import io
+import os
+import time
+from artifact_store import ArtifactStore
+
+def put(store, data, suffix=".glb"):
+    return store.put_stream(io.BytesIO(data), suffix, chunk_size=7)
+
+def age(path, seconds):
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+def test_uploads_are_stored_once_by_content(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=None, ttl_seconds=None)
+    first = put(store, b"scan data")
+    assert os.path.basename(first) == hashlib.sha256(b"scan data").hexdigest() + ".glb"
+    age(first, 100)
+    assert put(store, b"scan data") == first
+    # The repeated upload marks the file as used, and leaves no hidden file behind
+    assert time.time() - os.path.getmtime(first) < 10
+    assert os.listdir(tmp_path) == [os.path.basename(first)]
+    assert store.usage() == (1, len(b"scan data"))
+
+def test_files_past_the_ttl_are_removed(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=None, ttl_seconds=3600, min_age_seconds=60)
+    stale, recent = put(store, b"stale"), put(store, b"recent")
+    age(stale, 7200)
+    age(recent, 1800)
+    put(store, b"new")
+    assert not os.path.exists(stale)
+    assert os.path.exists(recent)
+    assert store.usage()[0] == 2
+
+def test_least_recently_used_files_go_over_budget(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=250, ttl_seconds=None, min_age_seconds=60)
+    paths = [put(store, bytes([i]) * 100) for i in range(2)]
+    age(paths[0], 600)
+    age(paths[1], 300)
+    newest = put(store, b"\xff" * 100)
+
+    assert not os.path.exists(paths[0])
+    assert os.path.exists(paths[1]) and os.path.exists(newest)
+    assert store.usage() == (2, 200)
+
+def test_recently_used_files_are_kept_over_budget(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=150, ttl_seconds=10, min_age_seconds=60)
+    paths = [put(store, bytes([i]) * 100) for i in range(3)]
+    # All in use by queued or running pipelines: nothing is evicted yet
+    assert all(os.path.exists(path) for path in paths)
+    assert store.usage() == (3, 300)
+
+    for path in paths:
+        age(path, 120)
+    assert sorted(store.evict()) == sorted(paths)
+    assert store.usage() == (0, 0)
+
+def test_partial_uploads_are_never_evicted(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=0, ttl_seconds=0, min_age_seconds=0)
+    partial = tmp_path / ".upload"
+    partial.write_bytes(b"x" * 100)
+    age(partial, 3600)
+    store.evict()
+    assert partial.exists()
@@ -0,0 +1,113 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import batch
+
+@pytest.fixture
+def inputs(tmp_path):
+    glb_dir, image_dir = tmp_path / "glb", tmp_path / "png"
+    glb_dir.mkdir()
+    image_dir.mkdir()
+    for name in ("a", "b", "c"):
+        (glb_dir / f"{name}.glb").write_bytes(f"scan {name}".encode())
+        (image_dir / f"{name}.png").write_bytes(f"photo {name}".encode())
+    return batch.find_input_pairs(str(glb_dir), str(image_dir))
+
+@pytest.fixture
+def runs(monkeypatch):
+    # Items run in threads of this process with a stand-in for the pipeline. Items
+    # named in interrupt_at stop the whole run, like a Ctrl-C or a killed batch.
+    runs = {"processed": [], "interrupt_at": set(), "saved": {}}
+    save_manifest = batch.save_manifest
+
+    def recording_save(manifest, manifest_path):
+        save_manifest(manifest, manifest_path)
+        runs["saved"] = {name: item["status"] for name, item in manifest["items"].items()}
+
+    def process_item(glb_path, image_path, item_dir, montage=None, output_format="stl", electrodes_only=False):
+        name = os.path.basename(item_dir)
+        if name in runs["interrupt_at"]:
+            # Once the items before it are in the manifest, so the interruption is not
+            # reported before their results
+            deadline = time.monotonic() + 5
+            while any(runs["saved"].get(done) != "done" for done in runs["processed"]) and \
+                    time.monotonic() < deadline:
+                time.sleep(0.01)
+            raise KeyboardInterrupt
+        runs["processed"].append(name)
+        os.makedirs(item_dir, exist_ok=True)
+        path = os.path.join(item_dir, "electrodes.stl")
+        with open(path, 'wb') as f:
+            f.write(b"solid")
+        return {"status": "done", "outputs": [path], "timings": {}, "seconds": 0.0}
+
+    monkeypatch.setattr(batch, "process_item", process_item)
+    monkeypatch.setattr(batch, "save_manifest", recording_save)
+    monkeypatch.setattr(batch, "ProcessPoolExecutor", ThreadPoolExecutor)
+    return runs
+
+def statuses(manifest_path):
+    with open(manifest_path) as f:
+        return {name: item["status"] for name, item in json.load(f)["items"].items()}
+
+def test_pairs_are_matched_by_name(inputs):
+    assert [tuple(os.path.basename(p) for p in pair) for pair in inputs] == \
+        [("a.glb", "a.png"), ("b.glb", "b.png"), ("c.glb", "c.png")]
+
+def test_interrupted_run_resumes_with_the_remaining_items(tmp_path, inputs, runs):
+    output_dir = str(tmp_path / "out")
+    manifest_path = os.path.join(output_dir, batch.MANIFEST_NAME)
+
+    runs["interrupt_at"] = {"b"}
+    with pytest.raises(KeyboardInterrupt):
+        batch.run_batch(inputs, output_dir=output_dir, workers=1)
+    # The manifest on disk records what finished before the interruption
+    assert statuses(manifest_path) == {"a": "done", "b": "pending", "c": "pending"}
+
+    runs["interrupt_at"] = set()
+    runs["processed"].clear()
+    manifest = batch.run_batch(inputs, output_dir=output_dir, workers=1)
+    assert runs["processed"] == ["b", "c"]
+    assert statuses(manifest_path) == {"a": "done", "b": "done", "c": "done"}
+    assert all(os.path.isfile(path) for item in manifest["items"].values() for path in item["outputs"])
+
+    # Nothing left to do
+    runs["processed"].clear()
+    batch.run_batch(inputs, output_dir=output_dir, workers=1)
+    assert runs["processed"] == []
+
+def test_changed_inputs_and_missing_outputs_are_rerun(tmp_path, inputs, runs):
+    output_dir = str(tmp_path / "out")
+    manifest = batch.run_batch(inputs, output_dir=output_dir, workers=1)
+
+    with open(inputs[0][1], 'ab') as f:
+        f.write(b" retaken")
+    os.remove(manifest["items"]["b"]["outputs"][0])
+    runs["processed"].clear()
+    batch.run_batch(inputs, output_dir=output_dir, workers=1)
+    assert sorted(runs["processed"]) == ["a", "b"]
+
+    runs["processed"].clear()
+    batch.run_batch(inputs, output_dir=output_dir, workers=1, force=True)
+    assert sorted(runs["processed"]) == ["a", "b", "c"]
+
+def test_failed_items_are_recorded_and_retried(tmp_path, inputs, runs, monkeypatch):
+    output_dir = str(tmp_path / "out")
+    done = batch.process_item
+
+    def flaky(glb_path, image_path, item_dir, *args):
+        if os.path.basename(item_dir) == "c":
+            return {"status": "failed", "error": "NoFaceDetected: no face"}
+        return done(glb_path, image_path, item_dir, *args)
+
+    monkeypatch.setattr(batch, "process_item", flaky)
+    manifest = batch.run_batch(inputs, output_dir=output_dir, workers=2)
+    assert manifest["items"]["c"]["status"] == "failed"
+    assert "NoFaceDetected" in manifest["items"]["c"]["error"]
+
+    monkeypatch.setattr(batch, "process_item", done)
+    runs["processed"].clear()
+    batch.run_batch(inputs, output_dir=output_dir, workers=2)
+    assert runs["processed"] == ["c"]
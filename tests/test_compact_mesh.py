@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from benchmark_kernels import synthetic_head
+from compact_mesh import CompactMesh, WALK_DIVISIONS
+
+@pytest.fixture(scope="module")
+def head():
+    return synthetic_head(60_000)
+
+@pytest.mark.parametrize("direction", [(0.0, 1.0, 0.0), (1.0, 0.0, 0.0), (0.3, -0.8, 0.5)])
+def test_multires_hits_match_single_level(head, direction):
+    vertices, faces = head
+    origins = np.random.default_rng(0).uniform(vertices.min(axis=0), vertices.max(axis=0), (3000, 3))
+
+    coarse_hits, coarse_mask = CompactMesh(vertices, faces).first_hits(origins, direction, multires=True)
+    hits, hit_mask = CompactMesh(vertices, faces).first_hits(origins, direction, multires=False)
+
+    assert hit_mask.any()
+    np.testing.assert_array_equal(coarse_mask, hit_mask)
+    np.testing.assert_allclose(coarse_hits, hits, atol=1e-9)
+
+def test_first_hits_from_inside_reach_the_scalp(head):
+    # The head part of synthetic_head is an ellipsoid with radii (0.10, 0.12, 0.08) at y = 0.27
+    vertices, faces = head
+    origins = np.array([[0.0, 0.27, 0.0], [0.02, 0.27, -0.03]])
+    hits, hit_mask = CompactMesh(vertices, faces).first_hits(origins, multires=True)
+    assert hit_mask.all()
+    scalp = 0.27 + 0.12 * np.sqrt(1 - (origins[:, 0] / 0.10) ** 2 - (origins[:, 2] / 0.08) ** 2)
+    np.testing.assert_allclose(hits[:, 1], scalp, atol=1e-3)
+
+def test_simplified_is_coarser_and_stays_on_the_surface(head):
+    mesh = CompactMesh(*head)
+    coarse = mesh.simplified()
+    assert 0 < len(coarse.faces) < len(mesh.faces) / 4
+    cell = mesh.extents.max() / 64
+    np.testing.assert_allclose(coarse.bounds, mesh.bounds, atol=np.sqrt(3) * cell)
+
+def test_long_faces_do_not_widen_the_walk(head):
+    vertices, faces = head
+    # A sliver across the whole mesh and a long thin face over a few dozen cells
+    low, high = vertices.min(axis=0), vertices.max(axis=0)
+    extra = np.array([low, high, high + [0, 0, 1e-4], low + [0.05, 0, 0], low + [0.05, 0.06, 0],
+                      low + [0.05, 0.06, 0.001]], dtype=np.float32)
+    vertices = np.concatenate([vertices, extra])
+    n = len(vertices)
+    faces = np.concatenate([faces, [[n - 6, n - 5, n - 4], [n - 3, n - 2, n - 1]]]).astype(np.int32)
+    mesh = CompactMesh(vertices, faces)
+
+    # Samples only see the faces of their neighbouring cells, plus the sliver
+    near = mesh._faces_near(np.array([[0.0, 0.27, 0.0]]), WALK_DIVISIONS)
+    assert len(near) < 200 and len(faces) - 2 in near
+    thin = mesh._faces_near(low + [0.05, 0.03, 0.0005], WALK_DIVISIONS)
+    assert len(faces) - 1 in thin
+
+    origins = np.random.default_rng(1).uniform(low, high, (2000, 3))
+    coarse_hits, coarse_mask = mesh.first_hits(origins, (0.3, -0.8, 0.5), multires=True)
+    hits, hit_mask = CompactMesh(vertices, faces).first_hits(origins, (0.3, -0.8, 0.5), multires=False)
+    np.testing.assert_array_equal(coarse_mask, hit_mask)
+    np.testing.assert_allclose(coarse_hits, hits, atol=1e-9)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import electrode_checks
+from benchmark_kernels import synthetic_head
+from compact_mesh import CompactMesh
+from electrode_checks import check_electrode_layout, MAX_ADJUST_ROUNDS
+from model_generation import electrode_transform, CENTRAL_COLOR, OUTER_COLOR
+
+# Head ellipsoid of synthetic_head
+HEAD_CENTER = np.array([0.0, 0.27, 0.0])
+HEAD_RADII = np.array([0.10, 0.12, 0.08])
+
+@pytest.fixture(scope="module")
+def head():
+    return CompactMesh(*synthetic_head(100_000))
+
+@pytest.fixture(scope="module")
+def electrode():
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=float) * 0.003
+    faces = np.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+                      [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+    return CompactMesh(corners, faces)
+
+def on_scalp(direction, height):
+    # Point at height above (positive) or below the scalp along a direction from the head center
+    direction = np.asarray(direction, dtype=float) / np.linalg.norm(direction)
+    surface = HEAD_CENTER + direction / np.linalg.norm(direction / HEAD_RADII)
+    return surface + direction * height
+
+def instance(direction, height, color=OUTER_COLOR):
+    return (electrode_transform(on_scalp(direction, height), HEAD_CENTER), color)
+
+def test_valid_layout_is_left_unchanged(head, electrode):
+    instances = [instance((0.3, 1, 0), 0.01), instance((-0.3, 1, 0.3), 0.01), instance((0, 1, -0.4), 0.01)]
+    checked, report = check_electrode_layout(head, electrode, instances)
+    assert report["adjusted"] == [] and report["too_close"] == [] and report["overlapping"] == []
+    for (before, _), (after, _) in zip(instances, checked):
+        np.testing.assert_array_equal(before, after)
+    assert all(clearance > 0 for clearance in report["clearance"].values())
+
+def test_electrode_inside_the_head_is_pushed_out_along_minus_y(head, electrode):
+    instances = [instance((0.3, 1, 0), 0.01), instance((0.2, 1, 0.2), -0.01)]
+    checked, report = check_electrode_layout(head, electrode, instances)
+    assert report["adjusted"] == [1] and report["too_close"] == []
+    before, after = instances[1][0], checked[1][0]
+    moved = after[:3, 3] - before[:3, 3]
+    # Outward is the electrode's -y, away from the layout center
+    np.testing.assert_allclose(moved / np.linalg.norm(moved), -before[:3, 1], atol=1e-9)
+    np.testing.assert_array_equal(after[:3, :3], before[:3, :3])
+    assert report["clearance"][1] >= -1e-3
+
+def test_electrode_straight_above_the_center_is_pushed_up(head, electrode):
+    transform, _ = instance((0, 1, 0), -0.01)
+    np.testing.assert_allclose(transform[:3, 1], [0, -1, 0], atol=1e-12)
+    checked, report = check_electrode_layout(head, electrode, [(transform, OUTER_COLOR)])
+    assert report["adjusted"] == [0]
+    assert checked[0][0][1, 3] > transform[1, 3]
+
+def test_pushing_stops_after_the_round_limit(head, electrode, monkeypatch):
+    calls = []
+    def always_inside(head_mesh, probes, transforms):
+        calls.append(len(transforms))
+        return np.full(len(transforms), -0.01)
+    monkeypatch.setattr(electrode_checks, "electrode_clearances", always_inside)
+    _, report = check_electrode_layout(head, electrode, [instance((0.2, 1, 0.2), -0.01)])
+    assert len(calls) == 1 + MAX_ADJUST_ROUNDS
+    assert report["adjusted"] == [0] and report["too_close"] == [0]
+
+def test_overlapping_electrodes_are_reported(head, electrode):
+    instances = [instance((0.3, 1, 0), 0.01), instance((0.3, 1, 0.01), 0.01), instance((-0.3, 1, 0), 0.01)]
+    _, report = check_electrode_layout(head, electrode, instances)
+    assert report["overlapping"] == [(0, 1)]
+
+def test_only_the_named_central_electrode_is_skipped(head, electrode):
+    central = (electrode_transform(HEAD_CENTER + [0, 0.05, 0], HEAD_CENTER), CENTRAL_COLOR)
+    reused_color = instance((0.2, 1, 0.2), -0.01, color=CENTRAL_COLOR)
+    checked, report = check_electrode_layout(head, electrode, [central, reused_color], central=0)
+    assert 0 not in report["clearance"]
+    np.testing.assert_array_equal(checked[0][0], central[0])
+    assert report["adjusted"] == [1]
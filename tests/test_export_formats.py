@@ -0,0 +1,74 @@
+import json
+import struct
+import numpy as np
+import pytest
+from benchmark_kernels import synthetic_head
+from compact_mesh import CompactMesh
+from export_formats import iter_glb, iter_ply, read_ply, export_entries
+from model_generation import HEAD_FACE_COLOR, CENTRAL_COLOR, OUTER_COLOR
+
+@pytest.fixture(scope="module")
+def head():
+    return CompactMesh(*synthetic_head(4000))
+
+@pytest.fixture(scope="module")
+def electrode():
+    vertices = np.array([[0, 0, 0], [0.01, 0, 0], [0, 0.01, 0], [0, 0, 0.01]], dtype=float)
+    faces = np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+    return CompactMesh(vertices, faces)
+
+def instances():
+    shifted = np.eye(4)
+    shifted[:3, 3] = (0.05, 0.3, 0.0)
+    return [(np.eye(4), CENTRAL_COLOR), (shifted, OUTER_COLOR)]
+
+def test_ply_round_trip(head):
+    colors = np.random.default_rng(0).integers(0, 256, (len(head.faces), 3), dtype=np.uint8)
+    vertices, faces, read_colors = read_ply(b"".join(iter_ply(head.vertices, head.faces, colors, chunk_faces=1000)))
+    np.testing.assert_allclose(vertices, head.vertices, atol=1e-6)
+    np.testing.assert_array_equal(faces, head.faces)
+    np.testing.assert_array_equal(read_colors, colors)
+
+def test_quantized_ply_round_trip_within_one_step(head):
+    vertices, faces, colors = read_ply(b"".join(iter_ply(head.vertices, head.faces, quantize=True)))
+    step = (head.vertices.max(axis=0) - head.vertices.min(axis=0)) / 65535
+    assert np.all(np.abs(vertices - head.vertices) <= step / 2 + 1e-9)
+    np.testing.assert_array_equal(faces, head.faces)
+    assert colors is None
+
+def test_electrode_ply_keeps_head_and_ring_colors(head, electrode):
+    entries = dict(export_entries("ply", head, electrode, instances()))
+    vertices, faces, colors = read_ply(b"".join(entries["electrode.ply"]))
+    assert len(faces) == len(head.faces) + 2 * len(electrode.faces)
+    np.testing.assert_array_equal(colors[:len(head.faces)], np.tile(HEAD_FACE_COLOR[:3], (len(head.faces), 1)))
+    np.testing.assert_array_equal(colors[-1], OUTER_COLOR[:3])
+
+def test_glb_instances_electrodes_and_colors_the_head_like_the_other_formats(head, electrode):
+    data = b"".join(iter_glb(head, electrode, instances()))
+    magic, version, total = struct.unpack_from('<III', data, 0)
+    assert (magic, version, total) == (0x46546C67, 2, len(data))
+    json_length, = struct.unpack_from('<I', data, 12)
+    gltf = json.loads(data[20:20 + json_length])
+
+    assert [node.get("name") for node in gltf["nodes"]] == ["head", "electrode_0", "electrode_1"]
+    # The electrode geometry is stored once: head and electrode positions and indices
+    assert len(gltf["accessors"]) == 4
+    head_material = gltf["materials"][gltf["meshes"][0]["primitives"][0]["material"]]
+    assert head_material["pbrMetallicRoughness"]["baseColorFactor"] == [c / 255.0 for c in HEAD_FACE_COLOR]
+    assert gltf["nodes"][2]["matrix"][12:15] == [0.05, 0.3, 0.0]
+
+    bin_offset = 20 + json_length
+    bin_length, _ = struct.unpack_from('<II', data, bin_offset)
+    assert bin_offset + 8 + bin_length == len(data)
+    view = gltf["bufferViews"][gltf["accessors"][0]["bufferView"]]
+    positions = np.frombuffer(data, dtype='<f4', count=view["byteLength"] // 4,
+                              offset=bin_offset + 8 + view["byteOffset"]).reshape(-1, 3)
+    np.testing.assert_allclose(positions, head.vertices, atol=1e-6)
+
+def test_stl_entries_hold_every_face(head, electrode):
+    entries = dict(export_entries("stl", head, electrode, instances(), electrodes_only=True))
+    person = b"".join(entries["person.stl"])
+    assert struct.unpack_from('<I', person, 80)[0] == len(head.faces)
+    assert len(person) == 84 + 50 * len(head.faces)
+    electrodes = b"".join(entries["electrode.stl"])
+    assert struct.unpack_from('<I', electrodes, 80)[0] == 2 * len(electrode.faces)
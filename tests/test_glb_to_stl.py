@@ -0,0 +1,20 @@
+import os
+import pytest
+
+trimesh = pytest.importorskip("trimesh")
+
+from glb_to_stl import convert_glb_to_stl
+
+def test_conversion_is_written_once_and_reused(tmp_path):
+    glb = str(tmp_path / "scan.glb")
+    trimesh.creation.icosphere().export(glb)
+
+    stl = convert_glb_to_stl(glb)
+    assert sorted(os.listdir(tmp_path)) == ["scan.glb", "scan.stl"]
+    assert len(trimesh.load(stl).faces) == len(trimesh.creation.icosphere().faces)
+
+    os.utime(stl, (0, 0))
+    assert convert_glb_to_stl(glb, reuse=True) == stl
+    assert os.path.getmtime(stl) == 0
+    convert_glb_to_stl(glb)
+    assert os.path.getmtime(stl) > 0
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from benchmark_kernels import synthetic_head
+from head_profile import (sample_vertices, cross_section_profile, transform_profile, neck_level,
+                          shoulder_axis, anatomy_levels)
+
+@pytest.fixture(scope="module")
+def head():
+    return synthetic_head(100_000)
+
+# Quarter turn about y, as prepare_head_mesh applies to a scan facing +z
+QUARTER_TURN = np.array([[0.0, 0.0, 1.0, 0.0], [0.0, 1.0, 0.0, 0.0], [-1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+
+def test_profile_measures_every_slice():
+    # Box of 0.2 x 1.0 x 0.1 with a gap between y = 0.4 and 0.6
+    rng = np.random.default_rng(0)
+    points = rng.uniform([-0.1, 0.0, -0.05], [0.1, 1.0, 0.05], (200_000, 3))
+    points = points[(points[:, 1] < 0.4) | (points[:, 1] > 0.6)]
+    profile = cross_section_profile(points, slices=10, grid=64)
+
+    assert profile["count"].sum() == len(points)
+    np.testing.assert_allclose(profile["levels"], points[:, 1].min() + (np.arange(10) + 0.5) * profile["slice_height"])
+    empty = profile["count"] == 0
+    assert empty[4] and empty[5] and not empty[[0, 3, 6, 9]].any()
+    assert np.isnan(profile["width"][empty]).all()
+    cell = 0.2 / 64
+    np.testing.assert_allclose(profile["width"][~empty], 0.2, atol=cell)
+    np.testing.assert_allclose(profile["depth"][~empty], 0.1, atol=cell)
+    np.testing.assert_allclose(profile["area"][~empty], np.pi / 4 * 0.2 * 0.1, rtol=0.05)
+
+def test_transform_profile_matches_the_profile_of_the_turned_mesh(head):
+    vertices = head[0].astype(float)
+    transform = QUARTER_TURN.copy()
+    transform[:3, 3] = (0.01, 0.02, 0.03)
+    turned = vertices @ transform[:3, :3].T + transform[:3, 3]
+
+    moved = transform_profile(cross_section_profile(vertices), transform)
+    measured = cross_section_profile(turned)
+    occupied = measured["count"] > 0
+    np.testing.assert_array_equal(moved["count"], measured["count"])
+    np.testing.assert_allclose(moved["levels"], measured["levels"], atol=1e-6)
+    cell = (vertices.max(axis=0) - vertices.min(axis=0))[[0, 2]].max() / 128
+    for key in ("x_min", "x_max", "z_min", "z_max", "width", "depth"):
+        np.testing.assert_allclose(moved[key][occupied], measured[key][occupied], atol=1e-6 + cell)
+
+def test_neck_is_between_the_shoulders_and_the_head(head):
+    # synthetic_head: shoulders reach up to y = 0.07, the head starts at y = 0.15
+    height, margin = neck_level(cross_section_profile(head[0]))
+    assert 0.07 <= height <= 0.16
+    assert margin > 0
+
+def test_shoulder_axis_follows_a_turn(head):
+    vertices = head[0].astype(float)
+    along_z, margin = shoulder_axis(cross_section_profile(vertices))
+    assert along_z and margin > 0.3
+    turned = vertices @ QUARTER_TURN[:3, :3].T
+    along_z, turned_margin = shoulder_axis(cross_section_profile(turned))
+    assert not along_z
+    assert turned_margin == pytest.approx(margin, abs=0.05)
+
+def test_anatomy_levels_are_ordered(head):
+    vertices = head[0]
+    anatomy = anatomy_levels(cross_section_profile(vertices))
+    low, high = anatomy["ear_band"]
+    assert anatomy["neck_height"] < anatomy["chin"] <= low <= high < anatomy["head_top"]
+    assert anatomy["head_top"] == pytest.approx(vertices[:, 1].max(), abs=1e-6)
+    # The ear band lies within the cranium, between the nose and the top of the head
+    assert 0.2 <= low and high <= 0.34
+
+def test_known_neck_height_is_kept(head):
+    anatomy = anatomy_levels(cross_section_profile(head[0]), neck_height=0.1)
+    assert anatomy["neck_height"] == 0.1
+
+def test_sample_is_deterministic_and_of_the_mesh(head):
+    vertices, faces = head
+    sample = sample_vertices(vertices, faces, 5000)
+    assert 0 < len(sample) <= 5000
+    np.testing.assert_array_equal(sample, sample_vertices(vertices, faces, 5000))
+    assert np.isin(sample.view([("", sample.dtype)] * 3), vertices.view([("", vertices.dtype)] * 3)).all()
+
+def test_sample_is_area_weighted(head):
+    # The nose is 5% of the vertices on a much smaller surface than the shoulders
+    vertices, faces = head
+    sample = sample_vertices(vertices, faces, 20000)
+    nose = lambda points: np.mean(np.linalg.norm((points - [0.10, 0.25, 0.0]) / [0.03, 0.02, 0.015], axis=1) < 1.01)
+    assert nose(sample) < nose(vertices) / 2
+
+def test_small_or_disabled_samples_return_all_vertices(head):
+    vertices, faces = head
+    assert sample_vertices(vertices, faces, 0) is vertices
+    assert sample_vertices(vertices, faces, len(vertices)) is vertices
@@ -0,0 +1,99 @@
+import io
+import json
+import struct
+import pytest
+from input_validation import (InvalidInput, probe_glb, probe_image, validate_uploads, MAX_GLB_JSON_BYTES)
+
+TRIANGLES = {"accessors": [{"count": 30}, {"count": 60}],
+             "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "indices": 1}]}]}
+
+def glb(gltf=TRIANGLES, magic=b"glTF", version=2, length=None, json_bytes=None):
+    chunk = json_bytes if json_bytes is not None else json.dumps(gltf).encode()
+    chunk += b" " * (-len(chunk) % 4)
+    body = struct.pack('<II', len(chunk), 0x4E4F534A) + chunk
+    return struct.pack('<4sII', magic, version, 12 + len(body) if length is None else length) + body
+
+def probe(data):
+    return probe_glb(io.BytesIO(data), len(data))
+
+def png(width, height):
+    return b"\x89PNG\r\n\x1a\n" + struct.pack('>I', 13) + b"IHDR" + struct.pack('>II', width, height) + b"\x08\x02\0\0\0"
+
+def jpeg(width, height):
+    app0 = b"\xff\xe0" + struct.pack('>H', 16) + b"JFIF\0" + b"\0" * 9
+    sof = b"\xff\xc0" + struct.pack('>HBHH', 17, 8, height, width) + b"\0" * 10
+    return b"\xff\xd8" + app0 + sof
+
+def test_glb_sizes_are_summed():
+    info = probe(glb())
+    assert (info["version"], info["vertices"], info["faces"]) == (2, 30, 20)
+
+def test_non_indexed_and_non_triangle_primitives():
+    gltf = {"accessors": [{"count": 9}],
+            "meshes": [{"primitives": [{"attributes": {"POSITION": 0}}, {"attributes": {"POSITION": 0}, "mode": 1}]}]}
+    assert probe(glb(gltf))["faces"] == 3
+
+@pytest.mark.parametrize("data, message", [
+    (glb(magic=b"glTf"), "bad magic"),
+    (glb(version=1), "version 1"),
+    (glb(length=10_000), "declares 10000 bytes"),
+])
+def test_malformed_headers_are_rejected(data, message):
+    with pytest.raises(InvalidInput, match=message):
+        probe(data)
+
+def test_truncated_json_chunk_is_rejected():
+    with pytest.raises(InvalidInput, match="truncated"):
+        probe_glb(io.BytesIO(glb()[:30]))
+
+def test_oversized_json_chunk_is_rejected_before_reading_it():
+    header = struct.pack('<4sII', b"glTF", 2, 2**31) + struct.pack('<II', MAX_GLB_JSON_BYTES + 4, 0x4E4F534A)
+    with pytest.raises(InvalidInput, match="out of bounds"):
+        probe_glb(io.BytesIO(header))
+
+@pytest.mark.parametrize("gltf", [
+    [1, 2, 3],
+    "meshes",
+    {"meshes": [1]},
+    {"meshes": [{"primitives": [None]}]},
+    {"accessors": {"count": 3}, "meshes": TRIANGLES["meshes"]},
+    {"accessors": [{"count": 30}], "meshes": TRIANGLES["meshes"]},
+    {"accessors": [{"count": 30}, {"count": 60}],
+     "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "indices": -1}]}]},
+    {"accessors": [{"count": "30"}], "meshes": [{"primitives": [{"attributes": {"POSITION": 0}}]}]},
+])
+def test_malformed_json_is_invalid_input_not_a_crash(gltf):
+    with pytest.raises(InvalidInput):
+        probe(glb(gltf))
+
+def test_invalid_json_is_rejected():
+    with pytest.raises(InvalidInput, match="not valid JSON"):
+        probe(glb(json_bytes=b"{\"meshes\": ["))
+
+def test_mesh_without_faces_is_rejected():
+    points = {"accessors": [{"count": 30}], "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "mode": 0}]}]}
+    with pytest.raises(InvalidInput, match="no triangle meshes"):
+        probe(glb(points))
+
+def test_image_headers_are_probed():
+    assert probe_image(png(640, 480)) == {"format": "png", "width": 640, "height": 480}
+    assert probe_image(jpeg(1024, 768)) == {"format": "jpeg", "width": 1024, "height": 768}
+
+@pytest.mark.parametrize("data, message", [
+    (b"GIF89a" + b"\0" * 30, "PNG or JPEG"),
+    (png(640, 480)[:20], "truncated"),
+    (png(0, 480), "zero width"),
+    (b"\xff\xd8\x00\x01\x02\x03", "corrupt"),
+    (b"\xff\xd8" + b"\xff\xe0" + struct.pack('>H', 4) + b"\0\0", "No JPEG frame header"),
+])
+def test_bad_images_are_rejected(data, message):
+    with pytest.raises(InvalidInput, match=message):
+        probe_image(data)
+
+def test_validate_uploads_checks_pixels_and_rewinds():
+    glb_stream, image_stream = io.BytesIO(glb()), io.BytesIO(png(100, 100))
+    glb_info, image_info = validate_uploads(glb_stream, image_stream, max_image_pixels=10_000)
+    assert glb_info["faces"] == 20 and image_info["width"] == 100
+    assert glb_stream.tell() == 0 and image_stream.tell() == 0
+    with pytest.raises(InvalidInput, match="exceeds"):
+        validate_uploads(io.BytesIO(glb()), io.BytesIO(png(101, 100)), max_image_pixels=10_000)
@@ -0,0 +1,36 @@
+import os
+import time
+from jobs import Job, evict_finished_jobs, remove_expired_jobs
+
+def make_job(job_dir, age, event=None):
+    job = Job.create(str(job_dir), max_jobs=None)
+    if event is not None:
+        job.emit(event)
+    stamp = time.time() - age
+    os.utime(job.events_path, (stamp, stamp))
+    return job
+
+def test_eviction_follows_the_last_event_not_the_directory(tmp_path):
+    old = make_job(tmp_path, age=300, event="done")
+    recent = make_job(tmp_path, age=10, event="done")
+    # Adding a file bumps the directory mtime of the old job, but not its last event
+    open(os.path.join(old.path, "result.zip"), 'wb').close()
+    assert evict_finished_jobs(str(tmp_path), max_jobs=1) == [old.id]
+    assert os.path.isdir(recent.path)
+
+def test_unfinished_jobs_are_never_evicted(tmp_path):
+    running = make_job(tmp_path, age=600, event="stage")
+    queued = make_job(tmp_path, age=500)
+    done = make_job(tmp_path, age=10, event="error")
+    assert evict_finished_jobs(str(tmp_path), max_jobs=1) == [done.id]
+    assert evict_finished_jobs(str(tmp_path), max_jobs=1) == []
+    assert os.path.isdir(running.path) and os.path.isdir(queued.path)
+
+def test_expiry_keeps_running_jobs_until_they_are_abandoned(tmp_path):
+    done = make_job(tmp_path, age=120, event="cancelled")
+    running = make_job(tmp_path, age=120, event="stage")
+    abandoned = make_job(tmp_path, age=7200, event="stage")
+    remove_expired_jobs(str(tmp_path), ttl_seconds=60, abandoned_seconds=3600)
+    assert not os.path.isdir(done.path)
+    assert os.path.isdir(running.path)
+    assert not os.path.isdir(abandoned.path)
@@ -0,0 +1,17 @@
+import numpy as np
+from landmark_cache import image_cache_key, load_landmarks, store_landmarks
+
+def test_entries_round_trip_and_depend_on_both_versions(tmp_path):
+    image = tmp_path / "face.png"
+    image.write_bytes(b"not really a png")
+    key = image_cache_key(str(image), "model-1", 1)
+    assert key != image_cache_key(str(image), "model-1", 2)
+    assert key != image_cache_key(str(image), "model-2", 1)
+
+    landmarks, reference_points = np.random.default_rng(0).random((68, 3)), -np.ones((4, 3))
+    cache_dir = str(tmp_path / "cache")
+    assert load_landmarks(key, cache_dir) is None
+    store_landmarks(key, landmarks, reference_points, cache_dir)
+    cached_landmarks, cached_points = load_landmarks(key, cache_dir)
+    np.testing.assert_allclose(cached_landmarks, landmarks, rtol=1e-6)
+    np.testing.assert_array_equal(cached_points, reference_points)
@@ -0,0 +1,70 @@
+import os
+import numpy as np
+from benchmark_kernels import synthetic_head
+from cache_utils import evict_lru
+from mesh_cache import load_head_mesh, store_head_mesh
+
+def make_head(n=2_000):
+    vertices, faces = synthetic_head(n)
+    return {
+        "vertices": vertices,
+        "faces": faces,
+        "neck_height": 0.17,
+        "transform": np.eye(4),
+        "nose": np.array([0.13, 0.25, 0.0]),
+        "back_head": np.array([-0.10, 0.27, 0.0]),
+        "profile": {"heights": np.linspace(0, 0.4, 5), "widths": np.ones(5), "slice_height": np.float64(0.01)},
+        "anatomy": {"chin": 0.2, "top": 0.39, "ear_band": [0.25, 0.29]},
+    }
+
+def set_mtime(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+def test_round_trip_is_memory_mapped(tmp_path):
+    head = make_head()
+    store_head_mesh("key", head, cache_dir=str(tmp_path))
+    loaded = load_head_mesh("key", cache_dir=str(tmp_path))
+
+    for name in ("vertices", "faces"):
+        assert isinstance(loaded[name], np.memmap)
+        assert not loaded[name].flags.writeable
+        np.testing.assert_array_equal(loaded[name], head[name])
+    assert loaded["vertices"].dtype == np.float32 and loaded["faces"].dtype == np.int32
+    assert loaded["neck_height"] == head["neck_height"]
+    np.testing.assert_array_equal(loaded["transform"], head["transform"])
+    np.testing.assert_array_equal(loaded["nose"], head["nose"])
+    np.testing.assert_array_equal(loaded["profile"]["widths"], head["profile"]["widths"])
+    assert loaded["profile"]["slice_height"] == 0.01
+    assert loaded["anatomy"]["ear_band"] == (0.25, 0.29)
+
+def test_misses_and_broken_entries_return_none(tmp_path):
+    assert load_head_mesh("missing", cache_dir=str(tmp_path)) is None
+    entry = store_head_mesh("key", make_head(), cache_dir=str(tmp_path))
+    os.remove(os.path.join(entry, "profile.npz"))
+    assert load_head_mesh("key", cache_dir=str(tmp_path)) is None
+
+def test_store_keeps_an_existing_entry(tmp_path):
+    first = make_head()
+    store_head_mesh("key", first, cache_dir=str(tmp_path))
+    store_head_mesh("key", make_head(4_000), cache_dir=str(tmp_path))
+    assert len(load_head_mesh("key", cache_dir=str(tmp_path))["vertices"]) == len(first["vertices"])
+
+def test_store_evicts_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path)
+    for i, key in enumerate(("a", "b", "c")):
+        set_mtime(store_head_mesh(key, make_head(), cache_dir=cache_dir, max_entries=3), 1000 + i)
+    # A hit marks an entry as recently used
+    assert load_head_mesh("a", cache_dir=cache_dir) is not None
+
+    store_head_mesh("d", make_head(), cache_dir=cache_dir, max_entries=3)
+    assert sorted(os.listdir(cache_dir)) == ["a", "c", "d"]
+
+def test_evict_lru_skips_partial_entries(tmp_path):
+    for i, name in enumerate(("old", "new", ".partial")):
+        path = tmp_path / name
+        path.write_bytes(b"x")
+        set_mtime(path, 1000 + i)
+    removed = evict_lru(str(tmp_path), 1)
+    assert removed == [str(tmp_path / "old")]
+    assert sorted(os.listdir(tmp_path)) == [".partial", "new"]
+    assert evict_lru(str(tmp_path), None) == []
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import montage
+from benchmark_kernels import synthetic_head
+from compact_mesh import CompactMesh
+from montage import geodesic_solver, montage_sites, place_montage
+
+# Nasion, left and right preauricular points and inion of synthetic_head, whose head
+# ellipsoid is centered at (0, 0.27, 0) with its top at y = 0.39
+REFERENCE = np.array([[0.0997, 0.28, 0.0], [0.0, 0.28, 0.0797], [0.0, 0.28, -0.0797], [-0.0997, 0.28, 0.0]])
+VERTEX = np.array([0.0, 0.39, 0.0])
+
+@pytest.fixture(scope="module")
+def head():
+    return CompactMesh(*synthetic_head(100_000))
+
+@pytest.fixture(scope="module")
+def placements(head):
+    return {system: place_montage(head, REFERENCE, system) for system in ("10-20", "10-10", "10-5")}
+
+def mirror_name(name):
+    # Odd numbers are on the left, the next even number is the mirrored site on the right
+    digits = "".join(c for c in name if c.isdigit())
+    if not digits:
+        return name
+    number = int(digits)
+    return name.replace(digits, str(number + 1 if number % 2 else number - 1))
+
+@pytest.mark.parametrize("system, count", [("10-20", 21), ("10-10", 85), ("10-5", 319)])
+def test_site_counts(system, count):
+    names, targets = montage_sites(system)
+    assert len(names) == len(set(names)) == count
+    assert targets.shape == (count, 2)
+    assert ((targets >= 0) & (targets <= 1)).all()
+
+def test_systems_nest():
+    names = {system: set(montage_sites(system)[0]) for system in ("10-20", "10-10", "10-5")}
+    assert names["10-20"] < names["10-10"] < names["10-5"]
+    assert {"Fp1", "Fpz", "F7", "T7", "Cz", "P4", "O2"} <= names["10-20"]
+
+def test_unknown_system_is_rejected():
+    with pytest.raises(ValueError):
+        montage_sites("10-15")
+
+def test_targets_are_symmetric():
+    names, targets = montage_sites("10-5")
+    by_name = dict(zip(names, targets))
+    for name, (u, v) in by_name.items():
+        mirrored = by_name[mirror_name(name)]
+        assert mirrored[0] == pytest.approx(u)
+        assert mirrored[1] == pytest.approx(1 - v)
+
+@pytest.mark.parametrize("system", ["10-20", "10-10", "10-5"])
+def test_placement_on_synthetic_head(placements, system):
+    names, positions, normals = placements[system]
+    assert len(names) == len(positions) == len(normals) == len(montage_sites(system)[0])
+    sites = dict(zip(names, positions))
+
+    np.testing.assert_allclose(sites["Cz"], VERTEX, atol=0.005)
+    # Midline sites stay on the midline, the others mirror across it
+    for name, position in sites.items():
+        if name.endswith("z"):
+            assert abs(position[2]) < 0.012, name
+        else:
+            mirrored = sites[mirror_name(name)] * np.array([1, 1, -1])
+            assert np.linalg.norm(position - mirrored) < 0.012, name
+    # Left sites are on the left (+z)
+    assert sites["C3"][2] > 0.03 and sites["C4"][2] < -0.03
+    # Front to back along the midline
+    assert sites["Fpz"][0] > sites["Fz"][0] > sites["Cz"][0] > sites["Pz"][0] > sites["Oz"][0]
+
+def test_solver_is_shared_by_mesh_key(monkeypatch):
+    monkeypatch.setattr(montage, "_keyed_solvers", type(montage._keyed_solvers)())
+    monkeypatch.setattr(montage, "MAX_SOLVERS", 2)
+    vertices, faces = synthetic_head(5_000)
+    first, second = CompactMesh(vertices, faces), CompactMesh(vertices, faces)
+
+    solver = geodesic_solver(first, "head-a")
+    # Another mesh object loaded from the same cache entry reuses the solver
+    assert geodesic_solver(second, "head-a") is solver
+    # Without a key, only the same mesh object does
+    unkeyed = geodesic_solver(second)
+    assert unkeyed is not solver and geodesic_solver(second) is unkeyed
+
+    # The least recently used key is dropped beyond MAX_SOLVERS
+    geodesic_solver(first, "head-b")
+    geodesic_solver(first, "head-a")
+    geodesic_solver(first, "head-c")
+    assert list(montage._keyed_solvers) == ["head-a", "head-c"]
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from benchmark_kernels import synthetic_head
+
+for module in ("open3d", "pyvista", "stl_reader"):
+    pytest.importorskip(module)
+
+from reference_point_scaling import (orient_vertices, orientation_profile, rotation_about_y, apply_transform,
+                                     bounds_center)
+
+@pytest.fixture(scope="module")
+def head_mesh():
+    return synthetic_head(100_000)
+
+@pytest.fixture(scope="module")
+def head(head_mesh):
+    return head_mesh[0]
+
+def test_oriented_head_is_left_as_is(head):
+    oriented = orient_vertices(head)
+    np.testing.assert_allclose(oriented["transform"], np.eye(4))
+    np.testing.assert_array_equal(oriented["vertices"], head)
+    # The tip of the synthetic nose, see benchmark_kernels.SYNTHETIC_PARTS
+    np.testing.assert_allclose(oriented["nose"], [0.13, 0.25, 0.0], atol=0.005)
+    assert oriented["back_head"][0] < -0.09
+
+@pytest.mark.parametrize("angle", [90, 180, 270])
+def test_turned_head_is_turned_back(head, angle):
+    turn = rotation_about_y(angle, bounds_center(head))
+    oriented = orient_vertices(apply_transform(head, turn))
+    np.testing.assert_allclose((oriented["transform"] @ turn)[:3, :3], np.eye(3), atol=1e-9)
+    assert oriented["nose"][0] - bounds_center(oriented["vertices"])[0] > 0.1
+
+@pytest.mark.parametrize("angle", [0, 90])
+def test_sampled_decisions_match_all_vertices(head_mesh, angle):
+    vertices, faces = head_mesh
+    vertices = apply_transform(vertices, rotation_about_y(angle, bounds_center(vertices)))
+    _, sampled_neck, sampled_axis = orientation_profile(vertices, faces, min_margin=0.0)
+    _, neck, axis = orientation_profile(vertices)
+    assert sampled_axis == axis
+    assert abs(sampled_neck - neck) < 0.01
+
+def test_low_margin_falls_back_to_all_vertices(head_mesh, capsys):
+    vertices, faces = head_mesh
+    profile, neck, _ = orientation_profile(vertices, faces, sample_size=5000, min_margin=1.1)
+    assert "using all vertices" in capsys.readouterr().out
+    assert profile["count"].sum() == len(vertices)
+    assert neck == orientation_profile(vertices)[1]
@@ -0,0 +1,57 @@
+import os
+import pytest
+
+for module in ("open3d", "pyvista", "stl_reader", "face_alignment"):
+    pytest.importorskip(module)
+
+import pipeline
+from benchmark_kernels import synthetic_head
+from compact_mesh import CompactMesh
+from point_sets import PointSet, load_point_set
+
+@pytest.fixture
+def graph_outputs(monkeypatch):
+    head_mesh = CompactMesh(*synthetic_head(2000))
+    outputs = {"head_mesh": head_mesh, "electrode_model": head_mesh,
+               "landmarks": PointSet.landmarks([[i, -i, 0.5 * i] for i in range(68)]),
+               "aligned_points": PointSet.reference([[0.1, 0.27, 0], [0, 0.25, -0.08], [0, 0.25, 0.08],
+                                                     [-0.1, 0.25, 0]], frame="head")}
+
+    def run(sources, params, targets, backends=()):
+        return {target: outputs[target] for target in targets}, {}
+    monkeypatch.setattr(pipeline.PIPELINE_GRAPH, "run", run)
+    return outputs
+
+def test_cli_writes_the_head_where_run_pipeline_does(graph_outputs, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conversion = tmp_path / "scan.stl"
+    conversion.write_bytes(b"unrotated conversion")
+
+    person_stl, electrode_stl = pipeline.create_electrodes_stl(str(tmp_path / "scan.glb"), "photo.png")
+
+    assert person_stl == "output_stl/rotated_model.stl"
+    assert os.path.getsize(person_stl) == 84 + 50 * len(graph_outputs["head_mesh"].faces)
+    assert os.path.isfile(electrode_stl)
+    assert conversion.read_bytes() == b"unrotated conversion"
+
+def test_cli_saves_the_point_sets_the_scripts_read(graph_outputs, tmp_path, monkeypatch):
+    # visualize.py reads landmarks.npz, electrode_modelling.py and sweep.py aligned_points.npz
+    monkeypatch.chdir(tmp_path)
+    pipeline.create_electrodes_stl(str(tmp_path / "scan.glb"), "photo.png")
+    for name, expected in (("landmarks.npz", graph_outputs["landmarks"]),
+                           ("aligned_points.npz", graph_outputs["aligned_points"])):
+        saved = load_point_set(name)
+        assert saved.roles == expected.roles and saved.frame == expected.frame
+        assert (saved.points == expected.points).all()
+
+def test_graph_derives_landmarks_and_reference_points_from_one_detection(tmp_path, monkeypatch):
+    image = tmp_path / "photo.png"
+    image.write_bytes(b"photo")
+    calls = []
+    landmarks = PointSet.landmarks([[i, i, i] for i in range(68)])
+    reference = PointSet.reference([[1, 0, 0], [0, 1, 0], [0, -1, 0], [-1, 0, 0]])
+    monkeypatch.setattr(pipeline, "detect_landmarks", lambda path: calls.append(path) or (landmarks, reference))
+
+    outputs, _ = pipeline.PIPELINE_GRAPH.run({"image_file": str(image)}, {}, ["landmarks", "reference_points"])
+    assert outputs["landmarks"] is landmarks and outputs["reference_points"] is reference
+    assert calls == [str(image)]
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from point_sets import PointSet, load_point_set, as_reference_points, REFERENCE_ROLES
+
+REFERENCE = np.array([[0.1, 0.27, -0.0], [-0.012, 0.25, -0.08], [0.0, -0.25, 0.08], [-0.1, 0.25, -1.5e-5]])
+
+@pytest.mark.parametrize("fmt", ["%.18e", "%f", "%g"])
+def test_xyz_round_trip_keeps_negative_coordinates(tmp_path, fmt):
+    path = str(tmp_path / "aligned_points.xyz")
+    np.savetxt(path, REFERENCE, fmt=fmt)
+    points = load_point_set(path)
+    assert points.roles == REFERENCE_ROLES and points.frame == "head"
+    np.testing.assert_allclose(points.points, REFERENCE, atol=1e-6)
+    assert (np.sign(points.points) == np.sign(np.round(REFERENCE, 6))).all()
+
+def test_xyz_rows_get_roles_by_count(tmp_path):
+    path = str(tmp_path / "landmarks.xyz")
+    np.savetxt(path, -np.arange(68 * 3, dtype=float).reshape(68, 3))
+    landmarks = load_point_set(path, frame="image")
+    assert landmarks.roles[0] == "landmark_1" and landmarks.frame == "image"
+    assert landmarks["landmark_68"][2] == -(68 * 3 - 1)
+
+    np.savetxt(path, REFERENCE[:2])
+    assert load_point_set(path).roles == ("point_1", "point_2")
+
+def test_npz_round_trip_keeps_roles_and_frame(tmp_path):
+    points = PointSet(REFERENCE[[3, 0, 2, 1]], ["inion", "nasion", "right_preauricular", "left_preauricular"],
+                      frame="image")
+    path = points.save(str(tmp_path / "points" / "reference.npz"))
+    loaded = load_point_set(path)
+    assert loaded.roles == points.roles and loaded.frame == "image"
+    np.testing.assert_array_equal(loaded.points, points.points)
+    # Reading them as reference points puts them in REFERENCE_ROLES order
+    np.testing.assert_array_equal(as_reference_points(path).points, REFERENCE)
+    assert [name for name in (tmp_path / "points").iterdir() if name.name.startswith(".")] == []
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from benchmark_kernels import synthetic_head
+from compact_mesh import CompactMesh
+from model_generation import (
+    closest_points_on_triangles, head_region_tree, refine_reference_points, _similarity_transform,
+    MAX_REFINE_SCALE_CHANGE, MIN_HEAD_REGION_VERTICES,
+)
+
+# Head ellipsoid of synthetic_head
+HEAD_CENTER = np.array([0.0, 0.27, 0.0])
+HEAD_RADII = np.array([0.10, 0.12, 0.08])
+NECK_HEIGHT = 0.17
+
+def on_scalp(direction):
+    direction = np.asarray(direction, dtype=float)
+    return HEAD_CENTER + direction / np.linalg.norm(direction / HEAD_RADII)
+
+# Nasion, left and right preauricular, inion, tilted up off the ellipsoid's equator
+REFERENCE = np.array([on_scalp(d) for d in ([1, 0.3, 0], [0, 0.3, -1], [0, 0.3, 1], [-1, 0.3, 0])])
+
+def rotation(axis, angle):
+    axis = np.asarray(axis, dtype=float) / np.linalg.norm(axis)
+    K = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    return np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * K @ K
+
+@pytest.fixture(scope="module")
+def head():
+    return CompactMesh(*synthetic_head(100_000))
+
+@pytest.fixture(scope="module")
+def coarse_head():
+    return CompactMesh(*synthetic_head(3_000))
+
+def test_similarity_transform_recovers_known_transform():
+    R = rotation([0.2, 1, 0.1], 0.3)
+    t = np.array([0.01, -0.02, 0.03])
+    target = 1.1 * REFERENCE @ R.T + t
+    s, R_fit, t_fit = _similarity_transform(REFERENCE, target)
+    assert s == pytest.approx(1.1)
+    np.testing.assert_allclose(R_fit, R, atol=1e-9)
+    np.testing.assert_allclose(t_fit, t, atol=1e-9)
+
+def test_similarity_transform_clamps_scale():
+    s, _, _ = _similarity_transform(REFERENCE, 1.5 * REFERENCE)
+    assert s == pytest.approx(1 + MAX_REFINE_SCALE_CHANGE)
+    s, _, _ = _similarity_transform(REFERENCE, 0.5 * REFERENCE)
+    assert s == pytest.approx(1 - MAX_REFINE_SCALE_CHANGE)
+    s, _, _ = _similarity_transform(REFERENCE, 1.5 * REFERENCE, scale=False)
+    assert s == 1.0
+
+def test_refinement_undoes_small_similarity(head):
+    # Blown up about the head center, so the points float off the scalp
+    displaced = 1.08 * (REFERENCE - HEAD_CENTER) + HEAD_CENTER
+    refined = refine_reference_points(head, displaced, neck_height=NECK_HEIGHT)
+    # Four points on a smooth scalp can slide a little along it, but most of the
+    # displacement is undone and every point ends up on the scalp
+    before = np.linalg.norm(displaced - REFERENCE, axis=1)
+    after = np.linalg.norm(refined - REFERENCE, axis=1)
+    assert after.max() < 0.2 * before.max()
+    on_ellipsoid = np.linalg.norm((refined - HEAD_CENTER) / HEAD_RADII, axis=1)
+    np.testing.assert_allclose(on_ellipsoid, 1, atol=0.01)
+
+def test_refined_points_lie_on_faces_not_vertices(coarse_head):
+    refined = refine_reference_points(coarse_head, REFERENCE + 0.004, neck_height=NECK_HEIGHT)
+    vertices = np.asarray(coarse_head.vertices, dtype=np.float64)
+    corners = vertices[np.asarray(coarse_head.faces)]
+    for point in refined:
+        closest = closest_points_on_triangles(np.broadcast_to(point, (len(corners), 3)),
+                                              corners[:, 0], corners[:, 1], corners[:, 2])
+        assert np.linalg.norm(closest - point, axis=1).min() < 1e-9
+        assert np.linalg.norm(vertices - point, axis=1).min() > 1e-6
+
+def test_closest_points_on_triangles_match_dense_sampling():
+    rng = np.random.default_rng(3)
+    a, b, c = rng.normal(size=(3, 200, 3))
+    points = rng.normal(size=(200, 3)) * 2
+    closest = closest_points_on_triangles(points, a, b, c)
+    u, v = np.meshgrid(np.linspace(0, 1, 101), np.linspace(0, 1, 101))
+    keep = u + v <= 1
+    u, v = u[keep], v[keep]
+    for i in range(len(points)):
+        samples = a[i] + u[:, None] * (b[i] - a[i]) + v[:, None] * (c[i] - a[i])
+        sampled = np.linalg.norm(samples - points[i], axis=1).min()
+        exact = np.linalg.norm(closest[i] - points[i])
+        assert exact <= sampled + 1e-12
+        assert exact >= sampled - 0.05
+
+def test_closest_points_on_degenerate_triangle_is_finite():
+    a = np.zeros((1, 3))
+    closest = closest_points_on_triangles(np.ones((1, 3)), a, a, a)
+    np.testing.assert_array_equal(closest, a)
+
+def test_head_region_tree_is_cached_per_mesh_and_neck_height(head):
+    tree, vertices = head_region_tree(head, NECK_HEIGHT)
+    assert head_region_tree(head, NECK_HEIGHT)[0] is tree
+    assert (vertices[:, 1] > NECK_HEIGHT).all()
+    whole, all_vertices = head_region_tree(head)
+    assert whole is not tree and len(all_vertices) == len(head.vertices)
+    # Too few vertices above the neck falls back to the whole mesh
+    top = np.asarray(head.vertices)[:, 1].max()
+    _, fallback = head_region_tree(head, top - 1e-6)
+    assert MIN_HEAD_REGION_VERTICES > 1 and len(fallback) == len(head.vertices)
@@ -0,0 +1,25 @@
+import os
+from request_profiling import RequestProfiler, profile_path
+
+def busy():
+    return sum(i * i for i in range(20000))
+
+def test_profile_is_saved_under_the_name_known_at_start(tmp_path):
+    profiler = RequestProfiler("sample", interval=0.001)
+    profiler.start()
+    name = profiler.name
+    for _ in range(20):
+        busy()
+    profiler.stop()
+    profiler.stop()
+    assert profiler.save(str(tmp_path)) == name
+    assert profile_path(name, str(tmp_path)) == os.path.join(str(tmp_path), name)
+
+def test_cprofile_request_falls_back_to_sampling_before_it_is_named(tmp_path):
+    with RequestProfiler("cprofile") as first:
+        second = RequestProfiler("cprofile")
+        second.start()
+        second.stop()
+    assert first.name.endswith(".pstats")
+    assert second.name.endswith(".collapsed")
+    assert second.save(str(tmp_path)) == second.name
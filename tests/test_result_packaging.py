@@ -0,0 +1,67 @@
+import gzip
+import io
+import struct
+import zipfile
+import numpy as np
+import pytest
+from benchmark_kernels import synthetic_head
+from compact_mesh import CompactMesh
+from result_packaging import iter_binary_stl, stream_entries_zip, stream_meshes_zip
+
+def read_zip(chunks, gzip_encoding):
+    data = b"".join(chunks)
+    if gzip_encoding:
+        data = gzip.decompress(data)
+    return zipfile.ZipFile(io.BytesIO(data))
+
+def parse_stl(data):
+    count = struct.unpack('<I', data[80:84])[0]
+    assert len(data) == 84 + 50 * count
+    records = np.frombuffer(data[84:], dtype=np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)),
+                                                       ('attr', '<u2')]))
+    return records
+
+@pytest.mark.parametrize("gzip_encoding", [False, True])
+def test_streamed_zip_holds_every_entry(gzip_encoding):
+    payload = np.random.default_rng(0).bytes(300_000)
+    entries = [("a.bin", [payload[:100_000], payload[100_000:]]), ("empty.txt", []), ("b.txt", [b"hello"])]
+    archive = read_zip(stream_entries_zip(entries, gzip_encoding=gzip_encoding), gzip_encoding)
+
+    assert archive.namelist() == ["a.bin", "empty.txt", "b.txt"]
+    assert archive.read("a.bin") == payload
+    assert archive.read("empty.txt") == b""
+    assert archive.read("b.txt") == b"hello"
+    # Compressed once: by the zip entries, or by the gzip encoding around stored entries
+    expected = zipfile.ZIP_STORED if gzip_encoding else zipfile.ZIP_DEFLATED
+    assert {info.compress_type for info in archive.infolist()} == {expected}
+    assert archive.testzip() is None
+
+def test_zip_is_streamed_while_entries_are_produced():
+    produced = []
+
+    def chunks():
+        for i in range(4):
+            produced.append(i)
+            yield np.random.default_rng(i).bytes(100_000)
+
+    stream = stream_entries_zip([("data.bin", chunks())])
+    next(stream)
+    # Data comes out before the last chunk has been produced
+    assert produced != [0, 1, 2, 3]
+    rest = b"".join(stream)
+    assert produced == [0, 1, 2, 3] and rest
+
+def test_binary_stl_records_match_the_mesh():
+    vertices, faces = synthetic_head(2_000)
+    data = b"".join(iter_binary_stl(vertices, faces, chunk_faces=1000))
+    records = parse_stl(data)
+    assert len(records) == len(faces)
+    np.testing.assert_array_equal(records['vertices'], vertices[faces])
+    np.testing.assert_allclose(np.linalg.norm(records['normal'], axis=1), 1, atol=1e-5)
+    np.testing.assert_allclose(records['normal'], CompactMesh(vertices, faces).face_normals, atol=1e-5)
+
+def test_streamed_meshes_zip_round_trip():
+    head = CompactMesh(*synthetic_head(2_000))
+    archive = read_zip(stream_meshes_zip([("head.stl", head)]), False)
+    records = parse_stl(archive.read("head.stl"))
+    np.testing.assert_array_equal(records['vertices'], head.vertices[head.faces])
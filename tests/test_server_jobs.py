@@ -0,0 +1,33 @@
+import threading
+import time
+import pytest
+
+for module in ("flask", "flask_cors", "open3d", "pyvista", "stl_reader", "face_alignment"):
+    pytest.importorskip(module)
+
+import server
+from admission import AdmissionController
+from jobs import Job
+from stage_timing import StageTimings
+
+def test_job_cancelled_in_the_queue_gives_its_slot_back(tmp_path, monkeypatch):
+    admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=10)
+    monkeypatch.setattr(server, "admission", admission)
+    ran = []
+    monkeypatch.setattr(server, "process_upload", lambda *args: ran.append(args))
+
+    job = Job.create(str(tmp_path))
+    busy = admission.admit().acquire()
+    worker = threading.Thread(target=server.run_job,
+                              args=(job, "scan.glb", "photo.png", {}, StageTimings(listener=job.stage_listener)))
+    worker.start()
+    while admission.waiting == 0:
+        time.sleep(0.01)
+    job.cancel()
+    busy.release()
+    worker.join(10)
+
+    assert not worker.is_alive()
+    assert job.status()["event"] == "cancelled"
+    assert not ran
+    assert admission.running == 0
@@ -0,0 +1,34 @@
+import pytest
+from input_validation import InvalidInput
+from sessions import parse_output_params, parse_relayout_params, MAX_RING_COUNT, MAX_RELAYOUT_ELECTRODES
+
+def test_valid_params_are_converted():
+    params = parse_relayout_params({"sphere_radius": 0.02, "rings": [[0.5, 6], [0.8, 8, True]]})
+    assert params == {"sphere_radius": 0.02, "rings": ((0.5, 6, False), (0.8, 8, True))}
+
+@pytest.mark.parametrize("body", [
+    {"sphere_radius": float("nan")},
+    {"outward_offset": float("inf")},
+    {"intermediate_ratio": True},
+    {"intermediate_ratio": 0.5},
+    {"sphere_radius": 0},
+    {"rings": [[float("nan"), 4]]},
+    {"rings": [[0.5, 0]]},
+    {"rings": [[0.5, MAX_RING_COUNT + 1]]},
+    {"rings": [[0.1 * (i + 1), MAX_RING_COUNT] for i in range(MAX_RELAYOUT_ELECTRODES // MAX_RING_COUNT)]},
+    {"rings": "0.5,4"},
+])
+def test_unsafe_params_are_rejected(body):
+    with pytest.raises(ValueError):
+        parse_relayout_params(body)
+
+def test_missing_body_means_defaults():
+    assert parse_relayout_params(None) == {}
+    assert parse_output_params(None) == ("stl", False)
+
+@pytest.mark.parametrize("body", [[], [1, 2], "rings", 3, True])
+def test_non_object_bodies_are_rejected(body):
+    with pytest.raises(InvalidInput):
+        parse_relayout_params(body)
+    with pytest.raises(InvalidInput):
+        parse_output_params(body)
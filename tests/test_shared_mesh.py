@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytest
+from multiprocessing import shared_memory, resource_tracker
+from benchmark_kernels import synthetic_head
+from compact_mesh import CompactMesh
+from shared_mesh import share_mesh, remove_stale_segments, SHM_DIR, SEGMENT_PREFIX
+
+_head = None
+
+def _attach(handle):
+    global _head
+    _head = handle.attach()
+
+def _summary(_):
+    # Read in a worker: the arrays must be views of the segment, not copies
+    return (os.getpid(), _head.vertices.flags.owndata, _head.vertices.flags.writeable,
+            float(_head.vertices.astype(float).sum()), int(_head.faces.sum()))
+
+@pytest.fixture(scope="module")
+def head():
+    return CompactMesh(*synthetic_head(20_000))
+
+def test_workers_attach_the_same_mesh_without_copying(head):
+    with share_mesh(head) as handle:
+        with ProcessPoolExecutor(max_workers=2, initializer=_attach, initargs=(handle,)) as pool:
+            results = list(pool.map(_summary, range(8)))
+    assert all(pid != os.getpid() for pid, *_ in results)
+    for _, owns_data, writeable, vertex_sum, face_sum in results:
+        assert not owns_data and not writeable
+        assert vertex_sum == pytest.approx(float(head.vertices.astype(float).sum()))
+        assert face_sum == int(head.faces.sum())
+
+def test_segment_is_removed_when_the_block_exits(head):
+    with pytest.raises(RuntimeError):
+        with share_mesh(head) as handle:
+            assert handle.attach().vertices.shape == head.vertices.shape
+            raise RuntimeError("worker failed")
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=handle.name)
+
+@pytest.mark.skipif(SHM_DIR is None, reason="segments are not visible as files here")
+def test_segments_of_dead_owners_are_swept():
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                          capture_output=True, text=True, check=True)
+    stale_name = f"{SEGMENT_PREFIX}{int(dead.stdout)}_0123456789abcdef"
+    live_name = f"{SEGMENT_PREFIX}{os.getpid()}_fedcba9876543210"
+    for name in (stale_name, live_name):
+        segment = shared_memory.SharedMemory(name=name, create=True, size=16)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        segment.close()
+    try:
+        assert remove_stale_segments() == [stale_name]
+        assert os.path.exists(os.path.join(SHM_DIR, live_name))
+    finally:
+        for name in (stale_name, live_name):
+            if os.path.exists(os.path.join(SHM_DIR, name)):
+                os.remove(os.path.join(SHM_DIR, name))
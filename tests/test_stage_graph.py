@@ -0,0 +1,63 @@
+import pytest
+from stage_graph import Stage, StageGraph, MemoryBackend, DiskBackend
+
+def make_graph(calls, source_version=1):
+    def stage(name, func):
+        def run(**kwargs):
+            calls.append(name)
+            return func(**kwargs)
+        return run
+    return StageGraph([
+        Stage("loaded", stage("loaded", lambda path: open(path).read()), inputs=("path",), version=source_version),
+        Stage("scaled", stage("scaled", lambda loaded, factor: loaded * factor), inputs=("loaded",),
+              params=("factor",)),
+        Stage("tagged", stage("tagged", lambda scaled, tag: f"{tag}:{scaled}"), inputs=("scaled",), params=("tag",)),
+    ], file_sources=("path",))
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("ab")
+    return str(path)
+
+def test_only_stages_after_a_change_rerun(source):
+    calls = []
+    graph, backends = make_graph(calls), (MemoryBackend(),)
+    params = {"factor": 2, "tag": "x"}
+    assert graph.run({"path": source}, params, ["tagged"], backends)[0] == {"tagged": "x:abab"}
+    assert calls == ["loaded", "scaled", "tagged"]
+
+    calls.clear()
+    graph.run({"path": source}, dict(params, tag="y"), ["tagged"], backends)
+    assert calls == ["tagged"]
+
+    calls.clear()
+    graph.run({"path": source}, dict(params, factor=3), ["tagged"], backends)
+    assert calls == ["scaled", "tagged"]
+
+def test_file_sources_are_keyed_by_content(source):
+    calls = []
+    graph, backends = make_graph(calls), (MemoryBackend(),)
+    params = {"factor": 1, "tag": "x"}
+    graph.run({"path": source}, params, ["tagged"], backends)
+    calls.clear()
+    with open(source, "w") as f:
+        f.write("cd")
+    assert graph.run({"path": source}, params, ["tagged"], backends)[0]["tagged"] == "x:cd"
+    assert calls == ["loaded", "scaled", "tagged"]
+
+def test_upstream_version_changes_every_downstream_key(source):
+    params = {"factor": 1, "tag": "x"}
+    old = make_graph([]).keys({"path": source}, params, ["tagged"])
+    new = make_graph([], source_version="2").keys({"path": source}, params, ["tagged"])
+    assert old["path"] == new["path"]
+    assert all(old[name] != new[name] for name in ("loaded", "scaled", "tagged"))
+
+def test_disk_results_are_shared_between_graphs(source, tmp_path):
+    params = {"factor": 2, "tag": "x"}
+    backend = DiskBackend(cache_dir=str(tmp_path / "stages"))
+    make_graph([]).run({"path": source}, params, ["tagged"], (backend,))
+    calls = []
+    outputs, statuses = make_graph(calls).run({"path": source}, params, ["tagged"], (MemoryBackend(), backend))
+    assert outputs["tagged"] == "x:abab"
+    assert calls == [] and statuses == {"tagged": "DiskBackend"}
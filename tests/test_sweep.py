@@ -0,0 +1,43 @@
+import csv
+import numpy as np
+import pytest
+from benchmark_kernels import synthetic_head
+from compact_mesh import CompactMesh
+from electrode_checks import check_electrode_layout
+from model_generation import (generate_electrode_layout, load_electrode_template, scale_electrode_template,
+                              CENTRAL_INDEX)
+from sweep import run_sweep
+
+# Nasion, left and right preauricular and inion of synthetic_head
+REFERENCE_POINTS = np.array([[0.10, 0.27, 0.0], [0.0, 0.25, -0.08], [0.0, 0.25, 0.08], [-0.10, 0.25, 0.0]])
+
+@pytest.fixture(scope="module")
+def head():
+    return CompactMesh(*synthetic_head(60_000))
+
+def read_positions(summary_path, variant):
+    with open(summary_path) as f:
+        rows = [row for row in csv.DictReader(f) if int(row["variant"]) == variant]
+    return np.array([[float(row[axis]) for axis in "xyz"] for row in rows])
+
+def test_sweep_positions_match_the_checked_pipeline_layout(head, tmp_path):
+    # A negative offset sinks the electrodes into the scalp, so the check has to push them out
+    param_sets = [{"outward_offset": -0.01}, {"outward_offset": 0.02, "sphere_radius": 0.015}]
+    result = run_sweep(REFERENCE_POINTS, head, param_sets, output_dir=str(tmp_path), summary_only=True, workers=1)
+
+    template = load_electrode_template("electrode.stl")
+    for variant, params in enumerate(param_sets):
+        electrode_mesh = scale_electrode_template(template, params.get("sphere_radius", 0.01))
+        instances = generate_electrode_layout(REFERENCE_POINTS, head, outward_offset=params["outward_offset"])
+        checked, report = check_electrode_layout(head, electrode_mesh, instances, central=CENTRAL_INDEX)
+        if variant == 0:
+            assert report["adjusted"]
+        expected = np.array([t[:3, 3] for i, (t, _) in enumerate(checked) if i != CENTRAL_INDEX])
+        np.testing.assert_allclose(read_positions(result["summary"], variant), expected, atol=1e-6)
+
+def test_sweep_exports_every_variant_from_worker_processes(head, tmp_path):
+    param_sets = [{"outward_offset": 0.01}, {"outward_offset": 0.02}]
+    result = run_sweep(REFERENCE_POINTS, head, param_sets, output_dir=str(tmp_path), workers=2)
+    assert [path.endswith(f"variant_{i}.stl") for i, path in enumerate(result["variants"])] == [True, True]
+    exported = [load_electrode_template(path) for path in result["variants"]]
+    assert len(exported[0].vertices) > 0 and len(exported[0].faces) == len(exported[1].faces)
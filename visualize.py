@@ -9,6 +9,7 @@ def create_sphere(center, radius=1, color=[1, 0, 0]):
 
 import open3d as o3d
 import numpy as np
+from point_sets import load_point_set
 
 def create_labels(points, scale=0.5, offset=5):
     labels = []
@@ -32,8 +33,8 @@ def create_labels(points, scale=0.5, offset=5):
         labels.append(label_legacy)
     return labels
 
-# Load your point cloud data
-xyz_data = np.loadtxt("landmarks.xyz")
+# Load your point cloud data (written by the pipeline when it writes files)
+xyz_data = load_point_set("landmarks.npz").points
 pcd = o3d.geometry.PointCloud()
 pcd.points = o3d.utility.Vector3dVector(xyz_data)
 